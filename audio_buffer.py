@@ -0,0 +1,86 @@
+import numpy as np
+
+PCM_SCALE = np.float32(1.0 / 32768.0)
+
+class AudioRingBuffer:
+    """
+    Preallocated per-session audio buffer (float32, 16kHz).
+    Int16 PCM chunks are converted straight into their slot in the ring, so appending
+    never reallocates. view() hands out the buffered audio without copying when it is
+    contiguous, and otherwise linearizes it into a reused float32 scratch array.
+    When full, the oldest audio is overwritten; start_sample tracks how much was dropped.
+    """
+    def __init__(self, capacity_seconds=30, sample_rate=16000):
+        self.sample_rate = sample_rate
+        self.capacity = int(capacity_seconds * sample_rate)
+        self._ring = np.zeros(self.capacity, dtype=np.float32)
+        self._scratch = np.zeros(self.capacity, dtype=np.float32)
+        self._head = 0          # ring index of the oldest sample
+        self._size = 0
+        self.start_sample = 0   # absolute index (since creation) of the oldest sample held
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def seconds(self):
+        return self._size / self.sample_rate
+
+    def append(self, chunk):
+        """
+        Appends raw PCM Int16 bytes, an int16 array or a float32 array in [-1, 1].
+        Returns the number of samples appended.
+        """
+        if isinstance(chunk, (bytes, bytearray, memoryview)):
+            chunk = np.frombuffer(chunk, dtype=np.int16)
+        appended = n = len(chunk)
+        if n == 0:
+            return 0
+        if n > self.capacity:
+            # Only the newest capacity samples can be kept
+            self.start_sample += n - self.capacity
+            self._drop(self._size)
+            chunk = chunk[-self.capacity:]
+            n = self.capacity
+        elif self._size + n > self.capacity:
+            self._drop(self._size + n - self.capacity)
+
+        tail = (self._head + self._size) % self.capacity
+        first = min(n, self.capacity - tail)
+        self._write(self._ring[tail:tail + first], chunk[:first])
+        if first < n:
+            self._write(self._ring[:n - first], chunk[first:])
+        self._size += n
+        return appended
+
+    def consume(self, n):
+        """Discards the oldest n samples."""
+        self._drop(min(n, self._size))
+
+    def clear(self):
+        self._drop(self._size)
+
+    def view(self):
+        """
+        Returns the buffered audio as a contiguous float32 array.
+        The result may alias the ring or the scratch array: it is only valid until the
+        next append/view call, so copy it if it has to outlive that.
+        """
+        end = self._head + self._size
+        if end <= self.capacity:
+            return self._ring[self._head:end]
+        first = self.capacity - self._head
+        self._scratch[:first] = self._ring[self._head:]
+        self._scratch[first:self._size] = self._ring[:self._size - first]
+        return self._scratch[:self._size]
+
+    def _drop(self, n):
+        self._head = (self._head + n) % self.capacity
+        self._size -= n
+        self.start_sample += n
+
+    def _write(self, out, chunk):
+        if chunk.dtype == np.int16:
+            np.multiply(chunk, PCM_SCALE, out=out, casting="unsafe")
+        else:
+            out[:] = chunk
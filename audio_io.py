@@ -0,0 +1,76 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import wave
+import numpy as np
+from audio_buffer import PCM_SCALE
+
+SAMPLE_RATE = 16000
+
+# Uploads above this size are spilled to a temporary file instead of being decoded from memory
+MAX_IN_MEMORY_BYTES = 25 * 1024 * 1024
+
+def decode_wav_bytes(data):
+    """
+    Fast path for 16-bit PCM WAV at 16kHz: parsed with the wave module and NumPy, no ffmpeg.
+    Returns a float32 mono array, or None if the data needs the general decoder.
+    """
+    try:
+        with wave.open(io.BytesIO(data)) as wav:
+            if wav.getsampwidth() != 2 or wav.getframerate() != SAMPLE_RATE:
+                return None
+            channels = wav.getnchannels()
+            raw = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return None
+
+    samples = np.frombuffer(raw, dtype="<i2")
+    if channels > 1:
+        # Downmix to mono
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return np.multiply(samples, PCM_SCALE, dtype=np.float32)
+
+def decode_audio_bytes(data):
+    """Decodes an in-memory audio file (WAV, WebM, MP3, ...) to a float32 16kHz mono array."""
+    audio = decode_wav_bytes(data)
+    if audio is not None:
+        return audio
+
+    # PyAV (bundled with faster-whisper) decodes other containers straight from a byte stream
+    from faster_whisper.audio import decode_audio
+    return decode_audio(io.BytesIO(data), sampling_rate=SAMPLE_RATE)
+
+def load_upload(fileobj, max_in_memory_bytes=MAX_IN_MEMORY_BYTES):
+    """
+    Reads an uploaded file object and decodes it to a float32 16kHz mono array.
+    Small uploads never touch disk; larger ones spill to a uniquely named temporary file.
+    """
+    data = fileobj.read(max_in_memory_bytes + 1)
+    if len(data) <= max_in_memory_bytes:
+        return decode_audio_bytes(data)
+
+    from faster_whisper.audio import decode_audio
+    tmp = tempfile.NamedTemporaryFile(prefix="upload_", delete=False)
+    try:
+        with tmp:
+            tmp.write(data)
+            shutil.copyfileobj(fileobj, tmp)
+        return decode_audio(tmp.name, sampling_rate=SAMPLE_RATE)
+    finally:
+        os.remove(tmp.name)
+
+def audio_fingerprint(audio_input):
+    """
+    SHA-256 of the audio content: the float32 PCM samples of an array, or the bytes of a file.
+    Identical recordings get the same fingerprint however they were uploaded.
+    """
+    digest = hashlib.sha256()
+    if isinstance(audio_input, str):
+        with open(audio_input, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    else:
+        digest.update(np.ascontiguousarray(audio_input, dtype=np.float32).data)
+    return digest.hexdigest()
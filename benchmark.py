@@ -0,0 +1,402 @@
+"""
+Benchmark suite for the dictation pipeline.
+
+Runs a fixed corpus of speech-like clips through every entry point (process,
+process_bytes, process_stream) and every component (STTEngine, TextCleaner,
+GrammarCorrector, StyleController) on its own, and writes cold/warm latency,
+throughput and peak RSS as JSON that can be diffed between commits. Each benchmark
+runs in a fresh process on a newly built pipeline, so its cold call and memory
+figures are its own.
+
+    python benchmark.py --fake --output bench.json     # stand-in models, CI speed
+    python benchmark.py --output bench.json            # real models
+    python benchmark.py --compare old.json new.json    # warm p50 deltas
+
+The corpus is synthesised deterministically (voiced harmonics under a syllable-rate
+envelope with phrase pauses, so VAD keeps it), or loaded from a directory of audio
+files with --corpus-dir (an optional same-named .txt file gives the reference text).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import namedtuple
+import numpy as np
+
+from audio_io import SAMPLE_RATE, decode_audio_bytes
+from executor import InferenceExecutor
+from grammar_corrector import GrammarCorrector
+from metrics import metrics
+from model_registry import ModelRegistry
+from grammar_gate import GrammarGate
+from pipeline import DictationPipeline, INITIAL_PROMPT, GATE_THRESHOLD
+from decode_policy import AdaptiveDecodePolicy
+from stt_engine import STTEngine
+
+# Every benchmark, in the order benchmarks() returns them (components first)
+BENCHMARK_NAMES = ("stt.live", "stt.batch", "stt.long", "cleaner", "grammar", "style", "style.multi",
+                   "process", "process_bytes", "process_stream")
+
+# Default corpus: one clip per length, in seconds
+CLIP_SECONDS = (1, 3, 5, 10, 20, 30)
+STYLES = ("Neutral", "Formal", "Casual", "Concise")
+
+# Dictation-style sentences with fillers, repeats and grammar slips for the text stages to work on
+SENTENCES = [
+    "um so I goes to the store yesterday and and bought some milk.",
+    "basically the meeting is gonna start at three you know.",
+    "I think we should like move the deadline to next week.",
+    "can you send me the the report before lunch.",
+    "uh the new build is kinda slow on older laptops.",
+    "we was planning to ship the update on friday.",
+]
+WORDS_PER_SECOND = 2.5
+
+Clip = namedtuple("Clip", "name seconds audio text")
+
+def reference_sentences(seconds):
+    """Deterministic dictation sentences, roughly as many words as are spoken in a clip of the given duration."""
+    target = max(1, int(seconds * WORDS_PER_SECOND))
+    sentences = []
+    words = 0
+    while words < target:
+        sentence = SENTENCES[len(sentences) % len(SENTENCES)]
+        sentences.append(sentence)
+        words += len(sentence.split())
+    return sentences
+
+def reference_text(seconds):
+    return " ".join(reference_sentences(seconds))
+
+def synth_speech(seconds, seed=0):
+    """Speech-like float32 audio: gliding pitch with harmonics, ~4 Hz syllables, pauses between phrases."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+
+    f0 = 120 + 30 * np.sin(2 * np.pi * 0.3 * t + rng.uniform(0, 2 * np.pi))
+    phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+    syllables = np.clip(np.sin(2 * np.pi * 4 * t + rng.uniform(0, 2 * np.pi)), 0, None)
+    phrases = np.sin(2 * np.pi * 0.25 * t + rng.uniform(0, 2 * np.pi)) > -0.7
+
+    audio = voiced * syllables * phrases + 0.02 * rng.standard_normal(len(t))
+    audio *= 0.5 / max(np.abs(audio).max(), 1e-9)
+    return audio.astype(np.float32)
+
+def build_corpus(lengths=CLIP_SECONDS):
+    return [Clip(f"synth_{s:g}s", float(s), synth_speech(s, seed=i), reference_text(s)) for i, s in enumerate(lengths)]
+
+def load_corpus(directory):
+    clips = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith(".txt") or not os.path.isfile(path):
+            continue
+        with open(path, "rb") as f:
+            audio = decode_audio_bytes(f.read())
+        seconds = len(audio) / SAMPLE_RATE
+        text_path = os.path.splitext(path)[0] + ".txt"
+        if os.path.exists(text_path):
+            with open(text_path, encoding="utf-8") as f:
+                text = f.read().strip()
+        else:
+            text = reference_text(seconds)
+        clips.append(Clip(name, seconds, audio, text))
+    return clips
+
+# --- Stand-in models: real pipeline code, no inference ---
+
+FakeSegment = namedtuple("FakeSegment", "start end text words")
+FakeWord = namedtuple("FakeWord", "start end word")
+
+class FakeWhisperModel:
+    """
+    Stand-in for faster_whisper.WhisperModel. Returns the corpus reference text for the
+    clip's duration as lazily generated segments, optionally sleeping `cost` seconds per
+    second of audio to mimic a model's real-time factor.
+    """
+    def __init__(self, cost=0.0):
+        self.cost = cost
+
+    def transcribe(self, audio, **options):
+        if isinstance(audio, str):
+            with open(audio, "rb") as f:
+                audio = decode_audio_bytes(f.read())
+        seconds = len(audio) / SAMPLE_RATE
+        return self._segments(reference_sentences(seconds), seconds), None
+
+    def _segments(self, sentences, seconds):
+        step = seconds / len(sentences)
+        for i, sentence in enumerate(sentences):
+            time.sleep(step * self.cost)
+            start = i * step
+            words = sentence.split()
+            # Words spread evenly over the segment, so word-timestamp users (live streaming) work too
+            word_step = step / len(words)
+            timed = [FakeWord(start + j * word_step, start + (j + 1) * word_step, " " + w) for j, w in enumerate(words)]
+            yield FakeSegment(start, start + step, " " + sentence, timed)
+
+class FakeGrammarBackend:
+    """
+    Grammar backend that skips T5: the real GrammarCorrector still does sentence splitting,
+    length bucketing and caching, generate just capitalises each sentence.
+    """
+    def __init__(self):
+        self.name = "fake"
+
+    def token_lengths(self, inputs):
+        return [len(text.split()) for text in inputs]
+
+    def generate(self, inputs, settings):
+        sentences = [text[len("grammar: "):] for text in inputs]
+        return [s[:1].upper() + s[1:] for s in sentences]
+
+def build_pipeline(fake=False, cost=0.0):
+    # Two model slots, like the server's default INFERENCE_WORKERS, so process_stream's stages can overlap
+    executor = InferenceExecutor(max_workers=2)
+    # Fixed decode settings, so results stay comparable with a baseline whatever the load
+    decode_policy = AdaptiveDecodePolicy(adaptive=False)
+    if not fake:
+        return DictationPipeline(executor=executor, decode_policy=decode_policy)
+    # Two batch workers: the stand-in model has no batched decode, so long audio takes the threaded path
+    stt = STTEngine(batch_workers=2, registry=ModelRegistry(loader=lambda *args: FakeWhisperModel(cost)))
+    return DictationPipeline(executor=executor, stt=stt, grammar=GrammarCorrector(backend=FakeGrammarBackend(), gate=GrammarGate(GATE_THRESHOLD)),
+                             decode_policy=decode_policy)
+
+# --- Measurement ---
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB (None if it can't be read)."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KB, macOS bytes
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return round(getattr(info, "peak_wset", info.rss) / (1024 * 1024), 1)
+    except ImportError:
+        return None
+
+def _stats(values):
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        "mean": round(float(values.mean()), 3),
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p95": round(float(np.percentile(values, 95)), 3),
+        "min": round(float(values.min()), 3),
+        "max": round(float(values.max()), 3),
+    }
+
+class Extra(dict):
+    """Additional timings (ms) a benchmark run reports besides its total, e.g. time to first segment."""
+
+def measure(run, items, repeats, reset=None):
+    """
+    Times run(item) for every item. The very first call is reported as cold_ms (cold only when
+    nothing has run on the pipeline yet, as in run_benchmark); every item is then run `repeats`
+    more times for the warm statistics. reset() runs before each call (untimed), e.g. to clear
+    result caches so warm runs measure real work. peak_rss_mb is the process's high-water mark
+    afterwards and baseline_rss_mb the one before, so their difference is what the runs added.
+    run may return an Extra of additional timings (ms), which are summarised alongside.
+    """
+    baseline_rss = peak_rss_mb()
+    def timed(item):
+        if reset is not None:
+            reset()
+        start = time.perf_counter()
+        extra = run(item.payload)
+        return (time.perf_counter() - start) * 1000, extra if isinstance(extra, Extra) else {}
+
+    cold_ms, _ = timed(items[0])
+
+    warm = []
+    by_item = {}
+    extras = {}
+    start_all = time.perf_counter()
+    for _ in range(repeats):
+        for item in items:
+            ms, extra = timed(item)
+            warm.append(ms)
+            by_item.setdefault(item.name, []).append(ms)
+            for key, value in extra.items():
+                extras.setdefault(key, []).append(value)
+    wall = time.perf_counter() - start_all
+
+    result = {
+        "cold_ms": round(cold_ms, 3),
+        "warm_ms": _stats(warm),
+        "warm_p50_by_item": {name: round(float(np.percentile(v, 50)), 3) for name, v in by_item.items()},
+        "calls": len(warm),
+        "items_per_second": round(len(warm) / wall, 3) if wall else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "baseline_rss_mb": baseline_rss,
+    }
+    audio_seconds = sum(item.seconds for item in items) * repeats
+    if audio_seconds:
+        # Seconds of audio processed per second of wall time
+        result["realtime_factor"] = round(audio_seconds / wall, 3) if wall else None
+    for key, values in extras.items():
+        result[key] = _stats(values)
+    return result
+
+Item = namedtuple("Item", "name seconds payload")
+
+def benchmarks(pipeline, corpus):
+    """(name, run, items, reset) for every component and entry point, components first."""
+    audio_items = [Item(c.name, c.seconds, c.audio) for c in corpus]
+    text_items = [Item(c.name, 0, c.text) for c in corpus]
+    cleaned_items = [Item(c.name, 0, pipeline.cleaner.clean(c.text)) for c in corpus]
+    style_items = [Item(f"{c.name}/{s}", 0, (pipeline.cleaner.clean(c.text), s)) for c in corpus for s in STYLES]
+    # Live clips are 16-bit PCM bytes, as /stream sends them
+    pcm_items = [Item(c.name, c.seconds, (np.clip(c.audio, -1, 1) * 32767).astype(np.int16).tobytes()) for c in corpus]
+
+    def clear_caches():
+        pipeline.transcripts.clear()
+        pipeline.grammar.cache.clear()
+        pipeline.style.cache.clear()
+
+    def stream(audio):
+        start = time.perf_counter()
+        first = None
+        for _ in pipeline.process_stream(audio, "Formal"):
+            if first is None:
+                first = (time.perf_counter() - start) * 1000
+        return Extra(first_segment_ms=first) if first is not None else None
+
+    return [
+        ("stt.live", lambda a: pipeline.stt.transcribe(a, initial_prompt=INITIAL_PROMPT, model_type="live"),
+         audio_items, None),
+        ("stt.batch", lambda a: pipeline.stt.transcribe(a, initial_prompt=INITIAL_PROMPT, model_type="batch"),
+         audio_items, None),
+        ("stt.long", lambda a: pipeline.stt.transcribe_long(a, initial_prompt=INITIAL_PROMPT), audio_items, None),
+        ("cleaner", pipeline.cleaner.clean, text_items, None),
+        ("grammar", pipeline.grammar.correct, cleaned_items, pipeline.grammar.cache.clear),
+        ("style", lambda item: pipeline.style.apply_style(*item), style_items, pipeline.style.cache.clear),
+        ("style.multi", lambda text: pipeline.style.apply_styles(text, list(STYLES)), cleaned_items,
+         pipeline.style.cache.clear),
+        ("process", lambda a: pipeline.process(a, "Formal"), audio_items, clear_caches),
+        ("process_bytes", lambda b: pipeline.process_bytes(b, "Formal"), pcm_items, clear_caches),
+        ("process_stream", stream, audio_items, clear_caches),
+    ]
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(name, fake=False, repeats=3, lengths=CLIP_SECONDS, corpus_dir=None, cost=0.0):
+    """
+    Builds a pipeline and runs the one named benchmark on it; returns (result, stage summary, gate stats).
+    run_benchmarks calls this in a fresh process per benchmark, so cold_ms is the first call on a
+    just-built pipeline and peak RSS is not carried over from another benchmark.
+    """
+    corpus = load_corpus(corpus_dir) if corpus_dir else build_corpus(lengths)
+
+    start_init = time.perf_counter()
+    pipeline = build_pipeline(fake=fake, cost=cost)
+    init_seconds = time.perf_counter() - start_init
+
+    metrics.reset()
+    try:
+        for bench_name, run, items, reset in benchmarks(pipeline, corpus):
+            if bench_name == name:
+                result = measure(run, items, repeats, reset)
+                result["init_seconds"] = round(init_seconds, 3)
+                # Per-stage histograms collected by the pipeline's own instrumentation during the run
+                return result, metrics.summary(), pipeline.gate_stats()
+        raise ValueError(f"Unknown benchmark: {name}")
+    finally:
+        pipeline.executor.shutdown(wait=False)
+
+def run_benchmarks(fake=False, repeats=3, lengths=CLIP_SECONDS, corpus_dir=None, only=None, cost=0.0):
+    corpus = load_corpus(corpus_dir) if corpus_dir else build_corpus(lengths)
+
+    results = {}
+    stages = {}
+    gate_stats = {}
+    # Spawned, like the model workers, so no benchmark starts with another's models or memory
+    context = multiprocessing.get_context("spawn")
+    for name in BENCHMARK_NAMES:
+        if only and name not in only:
+            continue
+        print(f"Benchmarking {name}...")
+        with context.Pool(1) as pool:
+            results[name], stages[name], gate_stats[name] = pool.apply(
+                run_benchmark, (name, fake, repeats, lengths, corpus_dir, cost))
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "fake_models": fake,
+            "fake_cost": cost if fake else None,
+            "repeats": repeats,
+            "corpus": [{"name": c.name, "seconds": round(c.seconds, 3)} for c in corpus],
+        },
+        "results": results,
+        "stages": stages,
+        "grammar_gate": gate_stats,
+    }
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)["results"]
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    print(f"{'benchmark':<16}{'old p50 ms':>14}{'new p50 ms':>14}{'change':>10}")
+    for name in sorted(set(old) | set(new)):
+        before = old.get(name, {}).get("warm_ms", {}).get("p50")
+        after = new.get(name, {}).get("warm_ms", {}).get("p50")
+        if before is None or after is None:
+            print(f"{name:<16}{str(before):>14}{str(after):>14}{'':>10}")
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        print(f"{name:<16}{before:>14.3f}{after:>14.3f}{change:>+9.1f}%")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the dictation pipeline and its components.")
+    parser.add_argument("--fake", action="store_true", help="use stand-in models instead of Whisper/T5")
+    parser.add_argument("--fake-cost", type=float, default=0.0,
+                        help="simulated seconds of STT work per second of audio for --fake")
+    parser.add_argument("--repeats", type=int, default=3, help="warm passes over the corpus per benchmark")
+    parser.add_argument("--lengths", default=",".join(str(s) for s in CLIP_SECONDS),
+                        help="comma-separated clip lengths (seconds) for the synthetic corpus")
+    parser.add_argument("--corpus-dir", help="directory of audio files to use instead of the synthetic corpus")
+    parser.add_argument("--only", help="comma-separated benchmark names (e.g. grammar,process)")
+    parser.add_argument("--output", help="write JSON results to this file (default: stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = run_benchmarks(
+        fake=args.fake,
+        repeats=args.repeats,
+        lengths=[float(s) for s in args.lengths.split(",")],
+        corpus_dir=args.corpus_dir,
+        only=set(args.only.split(",")) if args.only else None,
+        cost=args.fake_cost,
+    )
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Results written to {args.output}")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
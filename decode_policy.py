@@ -0,0 +1,106 @@
+# Whisper's default temperature schedule: a decode that fails the compression-ratio or
+# log-prob checks is retried at the next temperature
+TEMPERATURE_FALLBACK = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+
+# Load levels, from least to most loaded
+IDLE, NORMAL, BUSY, OVERLOADED = "idle", "normal", "busy", "overloaded"
+
+class DecodePolicy:
+    """Whisper settings chosen for one request (see AdaptiveDecodePolicy.select)."""
+    def __init__(self, level, model_size, beam_size, temperature, without_timestamps):
+        self.level = level
+        self.model_size = model_size
+        self.beam_size = beam_size
+        self.temperature = temperature
+        self.without_timestamps = without_timestamps
+
+    def options(self):
+        """Keyword arguments for WhisperModel.transcribe."""
+        return {
+            "beam_size": self.beam_size,
+            "temperature": self.temperature,
+            "without_timestamps": self.without_timestamps,
+        }
+
+    def as_dict(self):
+        return {
+            "level": self.level,
+            # None: the model the STTEngine was configured with for this mode
+            "model": self.model_size or "default",
+            "beam_size": self.beam_size,
+            "temperature_fallback": isinstance(self.temperature, tuple),
+            "without_timestamps": self.without_timestamps,
+        }
+
+class AdaptiveDecodePolicy:
+    """
+    Picks model size, beam size, temperature fallback and timestamp mode per request
+    from the mode ("batch" or "live"), the audio length and current load.
+
+    Load is the highest of the registered load sources, each returning 0..1 (e.g. the
+    executor's admitted jobs over its capacity). From busy_load decoding turns greedy
+    with no fallback and no timestamps; from overload_load requests drop to fast_model.
+    Otherwise the settings are the long-standing defaults: the engine's own model with
+    beam 2 and temperature fallback for batch, beam 5 at temperature 0 for live. With
+    upgrade_when_idle, batch uploads of known length up to long_audio_seconds are
+    upgraded to quality_model with a full beam below idle_load; this is opt-in, since an
+    unloaded server is always idle and quality_model costs memory and latency.
+    default_model=None keeps the model the STTEngine was configured with for that mode.
+    Models not listed in `models` are never chosen. adaptive=False always gives "normal".
+    """
+    def __init__(self, models=("tiny.en", "base.en", "small.en"), default_model=None, fast_model="tiny.en",
+                 quality_model="small.en", idle_load=0.25, busy_load=0.75, overload_load=0.9,
+                 long_audio_seconds=120, adaptive=True, upgrade_when_idle=False):
+        self.models = set(models)
+        self.default_model = default_model
+        self.fast_model = fast_model if fast_model in self.models else default_model
+        self.quality_model = quality_model if quality_model in self.models else default_model
+        self.idle_load = idle_load
+        self.busy_load = busy_load
+        self.overload_load = overload_load
+        self.long_audio_seconds = long_audio_seconds
+        self.adaptive = adaptive
+        self.upgrade_when_idle = upgrade_when_idle
+        self.load_sources = []
+
+    def add_load_source(self, source):
+        """Registers a callable returning current utilisation in [0, 1]."""
+        self.load_sources.append(source)
+
+    def selectable_models(self):
+        """Model sizes select() may switch to besides default_model, e.g. to load and warm them at startup."""
+        if not self.adaptive:
+            return []
+        sizes = {self.fast_model, self.quality_model} if self.upgrade_when_idle else {self.fast_model}
+        return sorted(sizes - {None, self.default_model})
+
+    def load(self):
+        return max((source() for source in self.load_sources), default=0.0)
+
+    def level(self):
+        if not self.adaptive:
+            return NORMAL
+        load = self.load()
+        if load >= self.overload_load:
+            return OVERLOADED
+        if load >= self.busy_load:
+            return BUSY
+        if load < self.idle_load:
+            return IDLE
+        return NORMAL
+
+    def select(self, mode, audio_seconds=None):
+        level = self.level()
+        if level == OVERLOADED:
+            # Serving tiny.en greedy beats timing out
+            return DecodePolicy(level, self.fast_model, 1, 0.0, True)
+        if level == BUSY:
+            return DecodePolicy(level, self.default_model, 1, 0.0, True)
+        if mode == "live":
+            return DecodePolicy(level, self.default_model, 5, 0.0, False)
+
+        # Unknown lengths (file paths) are not upgraded: they may be arbitrarily long
+        short = audio_seconds is not None and audio_seconds <= self.long_audio_seconds
+        if level == IDLE and short and self.upgrade_when_idle:
+            return DecodePolicy(level, self.quality_model, 5, TEMPERATURE_FALLBACK, False)
+        return DecodePolicy(level, self.default_model, 2, TEMPERATURE_FALLBACK, False)
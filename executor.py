@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from metrics import metrics
+
+class ServerBusyError(Exception):
+    """Raised when the inference queue is full and new work has to be rejected."""
+
+_DONE = object()
+
+class InferenceExecutor:
+    """
+    Runs blocking pipeline work off the asyncio event loop.
+    A thread pool handles model inference (CTranslate2 and torch release the GIL);
+    GIL-bound stages are spread over cores by running whole pipelines in model
+    workers instead (see worker_pool). At most max_workers + max_queue jobs are
+    admitted at once; beyond that submissions fail fast with ServerBusyError so
+    the server can answer 429 instead of piling up. Work that runs models on its
+    own threads (process_stream's stages) takes model_slot() around each model
+    call, so pool jobs and those threads together stay within max_workers.
+    """
+    def __init__(self, max_workers=2, max_queue=16):
+        self.max_workers = max_workers
+        self.max_pending = max_workers + max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._model_slots = threading.BoundedSemaphore(max_workers)
+        # Drives iterate() generators; each admitted stream gets a thread, so this never queues
+        self._stream_pool = ThreadPoolExecutor(max_workers=self.max_pending, thread_name_prefix="stream")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """Jobs admitted and not yet finished (running + queued)."""
+        return self._pending
+
+    def reserve(self):
+        """Claims a queue slot, raising ServerBusyError when the queue is full."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise ServerBusyError(f"Inference queue full ({self._pending} jobs pending)")
+            self._pending += 1
+
+    def release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, fn, *args, **kwargs):
+        """Runs fn on the inference thread pool, returning a concurrent.futures.Future."""
+        self.reserve()
+        try:
+            future = self._pool.submit(self._job(fn), *args, **kwargs)
+        except Exception:
+            self.release()
+            raise
+        future.add_done_callback(lambda _: self.release())
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    @contextmanager
+    def model_slot(self):
+        """Blocks until fewer than max_workers jobs or stages are running models, then holds a slot."""
+        self._model_slots.acquire()
+        try:
+            yield
+        finally:
+            self._model_slots.release()
+
+    def iterate(self, generator):
+        """
+        Drives a blocking generator on its own thread and returns an async iterator over its items.
+        The whole stream occupies one queue slot, claimed here so rejection happens before iteration starts.
+        The generator is not given a model slot: it must take model_slot() around its model calls.
+        """
+        self.reserve()
+        return self._iterate(generator)
+
+    async def _iterate(self, generator):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                item = await loop.run_in_executor(self._stream_pool, next, generator, _DONE)
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            self.release()
+            try:
+                generator.close()
+            except ValueError:
+                # Still executing on a worker thread (consumer cancelled mid-step)
+                pass
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+        self._stream_pool.shutdown(wait=wait)
+
+    def _job(self, fn):
+        """Wraps fn to run in a model slot; the time from now until it gets one is recorded as queue_wait."""
+        submitted = time.perf_counter()
+        def job(*args, **kwargs):
+            with self.model_slot():
+                metrics.observe("queue_wait", (time.perf_counter() - submitted) * 1000)
+                return fn(*args, **kwargs)
+        return job
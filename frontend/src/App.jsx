@@ -12,6 +12,7 @@ function App() {
 
   // Data States
   const [streamText, setStreamText] = useState("")
+  const [partialText, setPartialText] = useState("")
   const [scenes, setScenes] = useState([])
   const [style, setStyle] = useState("Neutral")
   const [secondaryStyle, setSecondaryStyle] = useState("None")
@@ -151,6 +152,7 @@ function App() {
 
       if (activeTab === "live") {
         setStreamText("")
+        setPartialText("")
         socketRef.current = new WebSocket("ws://localhost:8000/stream")
 
         socketRef.current.onopen = () => {
@@ -185,6 +187,10 @@ function App() {
           const data = JSON.parse(event.data)
           if (data.is_final) {
             setStreamText(prev => (prev + " " + data.text).trim())
+            setPartialText("")
+          } else if (data.text) {
+            // Unstable hypothesis for the utterance in progress, replaced by the final text
+            setPartialText(data.text)
           }
         }
       } else {
@@ -340,7 +346,7 @@ function App() {
               ref={transcriptEndRef}
               className="transcript-hero"
               placeholder="Start speaking..."
-              value={streamText}
+              value={(streamText + " " + partialText).trim()}
               readOnly
             />
 
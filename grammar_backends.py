@@ -0,0 +1,104 @@
+import os
+import shutil
+
+# Converted CTranslate2 models are kept here unless a model_dir is given
+DEFAULT_CT2_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "fluxdictate", "ct2")
+
+class TransformersBackend:
+    """T5 through HappyTransformer on PyTorch: the original grammar path, and the fallback."""
+    def __init__(self, model_name):
+        self.name = "transformers"
+        # Heavy imports (transformers, torch) are deferred until a backend is actually built
+        from happytransformer import HappyTextToText
+        self.happy_tt = HappyTextToText("T5", model_name)
+        self.tokenizer = self.happy_tt.tokenizer
+
+    def token_lengths(self, inputs):
+        return [len(ids) for ids in self.tokenizer(inputs)["input_ids"]]
+
+    def generate(self, inputs, settings):
+        import torch
+        model = self.happy_tt.model
+
+        encoded = self.tokenizer(inputs, return_tensors="pt", padding=True)
+        encoded = {k: v.to(model.device) for k, v in encoded.items()}
+
+        with torch.no_grad():
+            output_ids = model.generate(
+                **encoded,
+                num_beams=settings.num_beams,
+                min_length=settings.min_length,
+                max_length=settings.max_length,
+            )
+        return self.tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+
+class CTranslate2Backend:
+    """
+    The same T5 checkpoint converted to CTranslate2 and run with int8 weights, like the
+    STT models. CTranslate2 keeps the encoder output and decoder KV cache internally, so
+    greedy decoding (num_beams=1) is a single cheap pass per token. Only the (fast, torch-free)
+    Hugging Face tokenizer is needed at runtime; the one-off conversion uses transformers + torch.
+    """
+    def __init__(self, model_name, model_dir=None, device="cpu", compute_type="int8",
+                 intra_threads=0, inter_threads=1):
+        import ctranslate2
+        from transformers import AutoTokenizer
+
+        self.name = f"ctranslate2-{compute_type}"
+        model_dir = model_dir or os.path.join(DEFAULT_CT2_CACHE, f"{model_name.replace('/', '--')}-{compute_type}")
+        if not os.path.exists(os.path.join(model_dir, "model.bin")):
+            convert_to_ctranslate2(model_name, model_dir, compute_type)
+
+        # intra_threads: threads per batch (0 = CTranslate2 default); inter_threads: batches run in parallel
+        self.translator = ctranslate2.Translator(model_dir, device=device, compute_type=compute_type,
+                                                 intra_threads=intra_threads, inter_threads=inter_threads)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    def token_lengths(self, inputs):
+        return [len(ids) for ids in self.tokenizer(inputs)["input_ids"]]
+
+    def generate(self, inputs, settings):
+        sources = [self.tokenizer.convert_ids_to_tokens(self.tokenizer.encode(text)) for text in inputs]
+        results = self.translator.translate_batch(
+            sources,
+            beam_size=settings.num_beams,
+            min_decoding_length=settings.min_length,
+            max_decoding_length=settings.max_length,
+        )
+        return [
+            self.tokenizer.decode(self.tokenizer.convert_tokens_to_ids(result.hypotheses[0]), skip_special_tokens=True)
+            for result in results
+        ]
+
+def convert_to_ctranslate2(model_name, model_dir, compute_type="int8"):
+    """One-off conversion of a Hugging Face T5 checkpoint into a CTranslate2 model directory."""
+    from ctranslate2.converters import TransformersConverter
+
+    print(f"Converting {model_name} to CTranslate2 ({compute_type}) in {model_dir}...")
+    # Convert next to the target and move into place, so an interrupted conversion is never picked up
+    os.makedirs(os.path.dirname(model_dir) or ".", exist_ok=True)
+    tmp_dir = model_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    TransformersConverter(model_name).convert(tmp_dir, quantization=compute_type, force=True)
+    shutil.rmtree(model_dir, ignore_errors=True)
+    os.replace(tmp_dir, model_dir)
+
+def load_backend(backend, model_name, **options):
+    """
+    Builds a grammar backend by name: "ctranslate2", "transformers", or "auto"
+    (CTranslate2 when it can be loaded, otherwise the HappyTransformer path).
+    Options (model_dir, device, compute_type, intra_threads, inter_threads) apply to CTranslate2.
+    """
+    if backend == "transformers":
+        # Options only tune CTranslate2
+        return TransformersBackend(model_name)
+    if backend == "ctranslate2":
+        return CTranslate2Backend(model_name, **options)
+    if backend != "auto":
+        raise ValueError(f"Unknown grammar backend: {backend}")
+
+    try:
+        return CTranslate2Backend(model_name, **options)
+    except Exception as e:
+        print(f"CTranslate2 grammar backend unavailable ({e}), falling back to transformers")
+        return TransformersBackend(model_name)
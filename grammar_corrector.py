@@ -1,42 +1,142 @@
-from happytransformer import HappyTextToText, TTSettings
 import time
+import re
+from types import SimpleNamespace
+from grammar_backends import load_backend
+from result_cache import LRUCache, make_key
+
+# Corrections come out about as long as their input; a batch whose longest input plus this
+# many tokens exceeds max_length gets a longer limit, so long sentences are never cut off
+OUTPUT_MARGIN_TOKENS = 16
 
 class GrammarCorrector:
-    def __init__(self, model_name="vennify/t5-base-grammar-correction"):
+    def __init__(self, model_name="vennify/t5-base-grammar-correction", max_batch_size=16, max_batch_tokens=2048,
+                 cache=None, gate=None, backend="auto", **backend_options):
         print(f"Loading Grammar Model: {model_name}...")
         # Using T5-base for better accuracy, might switch to small if latency is too high
-        self.happy_tt = HappyTextToText("T5", model_name)
-        self.args = TTSettings(num_beams=1, min_length=1)
-        print("Grammar Model Loaded.")
+        # backend is "auto", "ctranslate2", "transformers" or an already built backend object
+        # (see grammar_backends); backend_options go to the CTranslate2 backend
+        self.backend = load_backend(backend, model_name, **backend_options) if isinstance(backend, str) else backend
+        # Greedy decoding, same defaults as HappyTransformer's TTSettings
+        self.args = SimpleNamespace(num_beams=1, min_length=1, max_length=50)
+        # Batching limits: sentences per generate call, and padded input tokens per call
+        # (batch size * longest sentence in the batch)
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        # Per-sentence result cache keyed by (normalised sentence, model, backend, generation settings)
+        self.model_name = model_name
+        self.cache = cache if cache is not None else LRUCache(maxsize=4096)
+        # Optional GrammarGate deciding per sentence whether T5 is needed at all
+        self.gate = gate
+        print(f"Grammar Model Loaded ({self.backend.name}).")
 
-    def correct(self, text):
-        if not text or not text.strip():
-            return "", 0
-            
-        start_time = time.time()
-        
+    def split_sentences(self, text):
         # Split text into chunks (sentences) to avoid model token limits
         # Simple split by punctuation for now, can be improved with nltk/spacy if needed
-        import re
         # Split by . ? ! followed by space or end of string
         sentences = re.split(r'(?<=[.!?])\s+', text)
-        
-        corrected_sentences = []
-        for sentence in sentences:
-            if not sentence.strip():
-                continue
-                
-            # Add prefix if the model expects it
-            input_text = "grammar: " + sentence
-            result = self.happy_tt.generate_text(input_text, args=self.args)
-            corrected_sentences.append(result.text)
-            
+        return [s for s in sentences if s.strip()]
+
+    def correct(self, text):
+        if not text or not text.strip():
+            return "", 0
+
+        start_time = time.perf_counter()
+
+        sentences = self.split_sentences(text)
+        corrected_sentences = self.correct_sentences(sentences)
         corrected_text = " ".join(corrected_sentences)
-        
-        end_time = time.time()
+
+        end_time = time.perf_counter()
         latency = (end_time - start_time) * 1000
         return corrected_text, latency
 
+    def correct_batch(self, texts):
+        """
+        Corrects several independent texts at once.
+        Sentences from all texts share the same generate batches.
+        Returns (list of corrected texts, latency in ms).
+        """
+        start_time = time.perf_counter()
+
+        per_text = [self.split_sentences(t) if t and t.strip() else [] for t in texts]
+        flat = [s for sentences in per_text for s in sentences]
+        corrected_flat = self.correct_sentences(flat)
+
+        results = []
+        pos = 0
+        for sentences in per_text:
+            results.append(" ".join(corrected_flat[pos:pos + len(sentences)]))
+            pos += len(sentences)
+
+        latency = (time.perf_counter() - start_time) * 1000
+        return results, latency
+
+    def correct_sentences(self, sentences, record_gate=True):
+        """
+        Corrects a list of sentences, returning the corrected sentences in the same order.
+        Sentences are sorted by token length and grouped into buckets so padding stays small,
+        then each bucket goes through the model in a single generate call.
+        record_gate=False keeps the calls out of the gate's counters.
+        """
+        if not sentences:
+            return []
+
+        # Sentences the gate judges clean (or too short to matter) skip the model entirely
+        outputs = [None] * len(sentences)
+        gated = []
+        for i, sentence in enumerate(sentences):
+            if self.gate is not None and not self.gate.needs_correction(sentence, record_gate):
+                outputs[i] = self.gate.light_fix(sentence)
+            else:
+                gated.append(i)
+
+        # Serve repeated sentences from the cache; only misses go to the model
+        keys = {i: self._cache_key(sentences[i]) for i in gated}
+        for i in gated:
+            outputs[i] = self.cache.get(keys[i])
+        missing = [i for i in gated if outputs[i] is None]
+        if not missing:
+            return outputs
+
+        # Add prefix if the model expects it
+        inputs = ["grammar: " + sentences[i] for i in missing]
+        lengths = self.backend.token_lengths(inputs)
+
+        for batch in self._make_batches(lengths):
+            results = self._generate([inputs[i] for i in batch], max(lengths[i] for i in batch))
+            for i, result in zip(batch, results):
+                outputs[missing[i]] = result
+                self.cache.set(keys[missing[i]], result)
+        return outputs
+
+    def _cache_key(self, sentence):
+        normalised = " ".join(sentence.split())
+        settings = (self.args.num_beams, self.args.min_length, self.args.max_length)
+        return make_key(normalised, self.model_name, self.backend.name, settings)
+
+    def _make_batches(self, lengths):
+        """Groups input indices into length-sorted batches within the size and token limits."""
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+
+        batches = []
+        current = []
+        for i in order:
+            # Sorted ascending, so the newest item is always the longest in the batch
+            padded_tokens = (len(current) + 1) * lengths[i]
+            if current and (len(current) >= self.max_batch_size or padded_tokens > self.max_batch_tokens):
+                batches.append(current)
+                current = []
+            current.append(i)
+        if current:
+            batches.append(current)
+        return batches
+
+    def _generate(self, inputs, longest):
+        settings = self.args
+        if longest + OUTPUT_MARGIN_TOKENS > settings.max_length:
+            settings = SimpleNamespace(**{**vars(settings), "max_length": longest + OUTPUT_MARGIN_TOKENS})
+        return self.backend.generate(inputs, settings)
+
 if __name__ == "__main__":
     gc = GrammarCorrector()
     sample = "I goes to the store yesterday."
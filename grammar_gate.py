@@ -0,0 +1,86 @@
+import re
+import threading
+from rewrite_engine import REPEATED_WORD_PATTERN
+
+# Common dictation errors T5 reliably fixes: subject-verb agreement, "could of", "have went", a/an
+ERROR_PATTERN = re.compile(
+    r"\bi\s+(?:is|are|has|goes|does|doesn't)\b"
+    r"|\b(?:you|we|they)\s+(?:is|was|has|goes|does|doesn't)\b"
+    r"|\b(?:he|she|it)\s+(?:are|have|go|do|don't)\b"
+    r"|\b(?:could|would|should|must)\s+of\b"
+    r"|\b(?:have|has)\s+went\b"
+    r"|\ba\s+[aeio]\w"
+    r"|\ban\s+[bcdfgjklmnpqrstvwxz]\w"
+    r"|\b(?:alot|irregardless)\b",
+    re.IGNORECASE
+)
+LOWERCASE_I_PATTERN = re.compile(r"(?<!\w)i(?=\s|'|$)")
+
+class GrammarGate:
+    """
+    Cheap per-sentence check run before T5 decides whether a sentence is worth correcting.
+    Rule-based score in [0, 1]: known error patterns and repeated words score 1, while
+    surface problems (lowercase start, lowercase "i", no final punctuation) add up. An
+    optional scorer(sentence) -> [0, 1] (e.g. a small LM or classifier) can raise the score.
+    Sentences scoring below threshold skip T5 and only get light_fix. Fragments of up to
+    max_fragment_words words without a known error skip T5 at any threshold (max_fragment_words=0
+    turns this off). threshold=0 (the default) sends every longer sentence to T5: the rules only
+    know a handful of error patterns, so a higher threshold trades correction quality for speed.
+    """
+    def __init__(self, threshold=0.0, max_fragment_words=2, scorer=None):
+        self.threshold = threshold
+        self.max_fragment_words = max_fragment_words
+        self.scorer = scorer
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.skipped = 0
+
+    def score(self, sentence):
+        if ERROR_PATTERN.search(sentence) or REPEATED_WORD_PATTERN.search(sentence):
+            return 1.0
+        if self.is_fragment(sentence):
+            return 0.0
+
+        score = 0.0
+        if sentence[:1].islower():
+            score += 0.3
+        if LOWERCASE_I_PATTERN.search(sentence):
+            score += 0.3
+        if not sentence.rstrip().endswith((".", "!", "?")):
+            score += 0.3
+        if self.scorer is not None:
+            score = max(score, self.scorer(sentence))
+        return min(score, 1.0)
+
+    def is_fragment(self, sentence):
+        return len(sentence.split()) <= self.max_fragment_words
+
+    def needs_correction(self, sentence, record=True):
+        """record=False leaves the counters alone (e.g. for speculative early corrections)."""
+        if self.is_fragment(sentence):
+            # "okay", "sounds good": only a known error makes a fragment worth a T5 call
+            needed = self.score(sentence) > 0
+        else:
+            needed = self.threshold <= 0 or self.score(sentence) >= self.threshold
+        if not record:
+            return needed
+        with self._lock:
+            self.checked += 1
+            if not needed:
+                self.skipped += 1
+        return needed
+
+    def light_fix(self, sentence):
+        """What a skipped sentence gets instead of T5: capitalised start and a capital "I"."""
+        sentence = LOWERCASE_I_PATTERN.sub("I", sentence.strip())
+        return sentence[:1].upper() + sentence[1:]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "threshold": self.threshold,
+                "checked": self.checked,
+                "skipped": self.skipped,
+                "corrected": self.checked - self.skipped,
+                "skip_rate": round(self.skipped / self.checked, 3) if self.checked else 0.0,
+            }
@@ -0,0 +1,105 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from executor import ServerBusyError
+from metrics import metrics
+
+class InferenceScheduler:
+    """
+    Central micro-batching scheduler for live utterances.
+    Utterances submitted from every open /stream socket are collected for up to
+    max_wait_ms (or until max_batch_size are waiting) and run through
+    DictationPipeline.process_audio_batch together on a single worker thread, in one of
+    the pipeline executor's model slots.
+    At most max_pending utterances may wait; further submissions raise ServerBusyError.
+    """
+    def __init__(self, pipeline, max_batch_size=8, max_wait_ms=30, max_pending=64):
+        self.pipeline = pipeline
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def load(self):
+        """Fraction of the utterance queue in use, as a DecodePolicy load source."""
+        return self._queue.qsize() / self._queue.maxsize
+
+    def submit(self, audio, style="Neutral"):
+        """
+        Queues one utterance (float32 16kHz array) and returns a concurrent.futures.Future
+        resolving to its final text. Use asyncio.wrap_future to await it from a handler.
+        """
+        future = Future()
+        try:
+            self._queue.put_nowait((audio, style, future, time.perf_counter()))
+        except queue.Full:
+            raise ServerBusyError(f"Live inference queue full ({self._queue.qsize()} utterances waiting)")
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            batch = [item]
+            stopping = False
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._process_batch(batch)
+            if stopping:
+                return
+
+    def _process_batch(self, batch):
+        # Skip utterances whose socket went away while they were queued
+        batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        started = time.perf_counter()
+        for _, _, _, submitted in batch:
+            metrics.observe("scheduler_wait", (started - submitted) * 1000)
+
+        try:
+            # One model call for the whole batch, counted against the executor's model slots
+            with self.pipeline.executor.model_slot():
+                results = self.pipeline.process_audio_batch(
+                    [audio for audio, _, _, _ in batch],
+                    [style for _, style, _, _ in batch]
+                )
+        except Exception as e:
+            print(f"Scheduler Error: {e}")
+            for _, _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        finished = time.perf_counter()
+        for (_, _, future, submitted), text in zip(batch, results):
+            metrics.observe("live_total", (finished - submitted) * 1000)
+            future.set_result(text)
@@ -0,0 +1,272 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from audio_io import load_upload
+from executor import ServerBusyError
+from metrics import StageTimings, metrics
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+# Rough share of a batch job finished when each stage starts, for progress reporting
+STAGE_PROGRESS = {"decode": 0.0, "stt": 0.05, "cleaning": 0.8, "grammar": 0.85, "style": 0.95}
+
+# How often finished jobs past their retention are deleted, in seconds
+SWEEP_INTERVAL = 600
+
+class JobStore:
+    """
+    Durable job records in SQLite (WAL mode, like SQLiteCache). Uploaded audio is kept
+    next to the database until its job finishes. Higher priority runs first, then oldest first.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.audio_dir = os.path.join(directory, "audio")
+        os.makedirs(self.audio_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "jobs.sqlite3"), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, status TEXT NOT NULL, priority INTEGER NOT NULL, style TEXT NOT NULL,"
+                " stage TEXT, progress REAL NOT NULL DEFAULT 0, result TEXT, error TEXT,"
+                " created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created_at)")
+
+    def audio_path(self, job_id):
+        return os.path.join(self.audio_dir, job_id)
+
+    def create(self, fileobj, style="Neutral", priority=0):
+        """Spools the upload to disk and queues a job for it; returns the job id."""
+        job_id = uuid.uuid4().hex
+        tmp_path = self.audio_path(job_id) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for chunk in iter(lambda: fileobj.read(1024 * 1024), b""):
+                f.write(chunk)
+        os.replace(tmp_path, self.audio_path(job_id))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, priority, style, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, priority, json.dumps(style), time.time())
+            )
+        return job_id
+
+    def claim(self):
+        """Marks the next queued job as running and returns it, or None when the queue is empty."""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY priority DESC, created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            started = time.time()
+            claimed = self._conn.execute("UPDATE jobs SET status = ?, started_at = ? WHERE id = ? AND status = ?",
+                                         (RUNNING, started, row["id"], QUEUED)).rowcount
+        if not claimed:
+            return None
+        return {**self._to_dict(row), "status": RUNNING, "started_at": started}
+
+    def set_stage(self, job_id, stage):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET stage = ?, progress = ? WHERE id = ?",
+                               (stage, STAGE_PROGRESS.get(stage, 0.0), job_id))
+
+    def finish(self, job_id, result=None, error=None):
+        """Stores the result, or marks the job failed when error (a message) is given."""
+        failed = error is not None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, stage = NULL, progress = ?, result = ?, error = ?, finished_at = ?"
+                " WHERE id = ?",
+                (FAILED if failed else DONE, 0.0 if failed else 1.0,
+                 json.dumps(result) if result is not None else None, error, time.time(), job_id)
+            )
+        try:
+            os.remove(self.audio_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def expire(self, finished_before):
+        """Deletes done and failed jobs that finished before the given time; returns how many."""
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                                      (DONE, FAILED, finished_before)).rowcount
+
+    def requeue_running(self):
+        """Puts jobs left running by a previous process back in the queue; returns how many."""
+        with self._lock, self._conn:
+            return self._conn.execute("UPDATE jobs SET status = ?, stage = NULL, progress = 0 WHERE status = ?",
+                                      (QUEUED, RUNNING)).rowcount
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def position(self, job_id):
+        """Number of queued jobs that will run before this one."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs j, jobs q WHERE q.id = ? AND j.status = ? AND"
+                " (j.priority > q.priority OR (j.priority = q.priority AND j.created_at < q.created_at))",
+                (job_id, QUEUED)
+            ).fetchone()
+        return row[0]
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0, **{status: count for status, count in rows}}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _to_dict(self, row):
+        job = dict(row)
+        job["style"] = json.loads(job["style"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+class JobTimings(StageTimings):
+    """StageTimings that also reports each stage as it starts (job progress)."""
+    def __init__(self, on_stage):
+        super().__init__()
+        self.on_stage = on_stage
+
+    @contextmanager
+    def stage(self, stage):
+        self.on_stage(stage)
+        with super().stage(stage):
+            yield
+
+class JobQueue:
+    """
+    Batch transcription jobs: submit returns at once, `workers` threads run pipeline.process
+    on queued jobs in priority order and store the results in a JobStore. Jobs survive a
+    restart (running ones are re-queued, so one server process owns a JobStore directory).
+    At most max_queued jobs may wait; beyond that submit raises ServerBusyError. Jobs can be
+    accepted before the pipeline is loaded; they run once start() is called. Finished jobs
+    and their results are deleted retention_seconds after they finish (None keeps them).
+    Given an InferenceExecutor, start() runs each job's pipeline call on it, so jobs share its
+    model slots and count towards its load; while its queue is full, jobs wait rather than fail.
+    """
+    def __init__(self, store, workers=1, max_queued=1000, poll_interval=1.0, retention_seconds=None):
+        self.store = store
+        self.workers = workers
+        self.max_queued = max_queued
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self.pipeline = None
+        self.executor = None
+        self._wakeup = threading.Condition()
+        self._stopping = False
+        self._threads = []
+        requeued = self.store.requeue_running()
+        if requeued:
+            print(f"Re-queued {requeued} interrupted jobs")
+
+    def submit(self, fileobj, style="Neutral", priority=0):
+        if self.store.counts()[QUEUED] >= self.max_queued:
+            raise ServerBusyError(f"Job queue full ({self.max_queued} jobs waiting)")
+        job_id = self.store.create(fileobj, style, priority)
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        job = self.store.get(job_id)
+        if job is not None and job["status"] == QUEUED:
+            job["queue_position"] = self.store.position(job_id)
+        return job
+
+    def load(self):
+        """Fraction of the job queue in use, as a DecodePolicy load source."""
+        return min(self.store.counts()[QUEUED] / self.max_queued, 1.0)
+
+    def start(self, pipeline, executor=None):
+        self.pipeline = pipeline
+        self.executor = executor
+        self._stopping = False
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.retention_seconds is not None:
+            thread = threading.Thread(target=self._sweep, name="job-sweeper", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                if self._stopping:
+                    return
+            job = self.store.claim()
+            if job is None:
+                # Also wakes up on a timer, in case a submit landed between claim() and wait()
+                with self._wakeup:
+                    if not self._stopping:
+                        self._wakeup.wait(self.poll_interval)
+                continue
+            metrics.observe("job_wait", (job["started_at"] - job["created_at"]) * 1000)
+            self._process(job)
+
+    def _sweep(self):
+        while True:
+            expired = self.store.expire(time.time() - self.retention_seconds)
+            if expired:
+                print(f"Deleted {expired} expired jobs")
+            with self._wakeup:
+                if not self._stopping:
+                    self._wakeup.wait(SWEEP_INTERVAL)
+                if self._stopping:
+                    return
+
+    def _call(self, fn, *args):
+        if self.executor is None:
+            return fn(*args)
+        while True:
+            try:
+                future = self.executor.submit(fn, *args)
+            except ServerBusyError:
+                # Interactive requests fill the executor's queue; the job waits its turn
+                time.sleep(self.poll_interval)
+                continue
+            return future.result()
+
+    def _process(self, job):
+        job_id = job["id"]
+        timings = JobTimings(lambda stage: self.store.set_stage(job_id, stage))
+        try:
+            with open(self.store.audio_path(job_id), "rb") as f:
+                audio = timings.call("decode", load_upload, f)
+            raw_text, final_text, latency_log, processing_latency = self._call(
+                self.pipeline.process, audio, job["style"], timings)
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            # Exceptions without a message still fail the job, under their type name
+            self.store.finish(job_id, error=str(e) or type(e).__name__)
+            return
+        self.store.finish(job_id, result={
+            "raw_text": raw_text,
+            "final_text": final_text,
+            "latency_breakdown": latency_log,
+            "decode_policy": latency_log.get("Decode Policy"),
+            "processing_latency_ms": processing_latency,
+            "timings": timings.as_dict(),
+        })
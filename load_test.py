@@ -0,0 +1,302 @@
+"""
+Concurrent load generator for the dictation server.
+
+Replays audio against /transcribe, /transcribe_stream and the /stream WebSocket from
+many simultaneous clients, stepping through a list of concurrency levels, and reports
+latency percentiles, throughput, error rate and dropped connections per level.
+
+    python load_test.py --endpoints stream --concurrency 1,10,50 --duration 60
+    python load_test.py --endpoints transcribe,transcribe_stream --audio a.wav b.wav
+    python load_test.py --speed 0 --output load.json     # send audio as fast as possible
+
+WebSocket clients send 16-bit PCM in --chunk-ms chunks paced at --speed x real time
+(like the frontend's ScriptProcessor), followed by --tail-silence-ms of silence so the
+server's VAD closes the last utterance. End of speech is found by running the server's
+StreamingVAD on the client side; final latency is measured from there to each is_final
+message. Without --audio the synthetic benchmark corpus is used. Needs httpx and websockets (the latter comes with uvicorn[standard]).
+"""
+import argparse
+import asyncio
+import io
+import json
+import time
+import wave
+from collections import deque
+import numpy as np
+
+from audio_io import SAMPLE_RATE, decode_audio_bytes
+from vad import StreamingVAD
+
+# Outcomes of one session
+OK = "ok"
+REJECTED = "rejected"   # 429 / server busy / 1013 not ready
+ERROR = "error"         # bad status, error message or exception
+DROPPED = "dropped"     # WebSocket closed by the server mid-session
+
+class Recording:
+    """One clip to replay: upload bytes (WAV) and raw 16-bit PCM for the WebSocket."""
+    def __init__(self, name, audio):
+        self.name = name
+        self.seconds = len(audio) / SAMPLE_RATE
+        self.pcm = (np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes()
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(SAMPLE_RATE)
+            wav.writeframes(self.pcm)
+        self.wav = buffer.getvalue()
+
+def load_recordings(paths, lengths):
+    if paths:
+        recordings = []
+        for path in paths:
+            with open(path, "rb") as f:
+                recordings.append(Recording(path, decode_audio_bytes(f.read())))
+        return recordings
+    from benchmark import build_corpus
+    return [Recording(clip.name, clip.audio) for clip in build_corpus(lengths)]
+
+class SessionResult:
+    def __init__(self, endpoint, recording):
+        self.endpoint = endpoint
+        self.audio_seconds = recording.seconds
+        self.outcome = OK
+        self.detail = None
+        # Seconds from the first byte sent to the first text received
+        self.first_text = None
+        # Seconds from end of speech to final text, one per utterance (one per upload for HTTP)
+        self.final_latencies = []
+        self.total = None
+
+    def fail(self, outcome, detail):
+        if self.outcome == OK:
+            self.outcome = outcome
+            self.detail = str(detail)[:200]
+
+async def run_transcribe(client, url, recording, args):
+    result = SessionResult("transcribe", recording)
+    start = time.perf_counter()
+    try:
+        response = await client.post(f"{url}/transcribe", files={"file": (f"{recording.name}.wav", recording.wav, "audio/wav")},
+                                     data={"style": args.style})
+        elapsed = time.perf_counter() - start
+        if response.status_code in (429, 503):
+            result.fail(REJECTED, response.status_code)
+        elif response.status_code != 200 or response.json().get("status") != "success":
+            result.fail(ERROR, response.text)
+        else:
+            # The whole file is uploaded up front, so first text and final text arrive together
+            result.first_text = elapsed
+            result.final_latencies.append(elapsed)
+    except Exception as e:
+        result.fail(ERROR, repr(e))
+    result.total = time.perf_counter() - start
+    return result
+
+async def run_transcribe_stream(client, url, recording, args):
+    result = SessionResult("transcribe_stream", recording)
+    start = time.perf_counter()
+    try:
+        async with client.stream("POST", f"{url}/transcribe_stream",
+                                 files={"file": (f"{recording.name}.wav", recording.wav, "audio/wav")},
+                                 data={"style": args.style}) as response:
+            if response.status_code in (429, 503):
+                result.fail(REJECTED, response.status_code)
+            elif response.status_code != 200:
+                result.fail(ERROR, await response.aread())
+            else:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    payload = line[len("data: "):]
+                    if payload == "[DONE]":
+                        result.final_latencies.append(time.perf_counter() - start)
+                        break
+                    event = json.loads(payload)
+                    if "error" in event:
+                        result.fail(ERROR, event["error"])
+                    elif result.first_text is None and "final" in event:
+                        result.first_text = time.perf_counter() - start
+                else:
+                    result.fail(DROPPED, "stream ended without [DONE]")
+    except Exception as e:
+        result.fail(ERROR, repr(e))
+    result.total = time.perf_counter() - start
+    return result
+
+async def run_stream(url, recording, args):
+    import websockets
+    from websockets.exceptions import ConnectionClosed, InvalidHandshake
+
+    result = SessionResult("stream", recording)
+    ws_url = url.replace("http", "ws", 1) + f"/stream?mode={args.mode}&style={args.style}"
+    chunk_bytes = int(SAMPLE_RATE * args.chunk_ms / 1000) * 2
+    tail = b"\x00\x00" * int(SAMPLE_RATE * args.tail_silence_ms / 1000)
+    audio = recording.pcm + tail
+    # A client-side copy of the server's VAD tells us when each utterance's speech ended
+    vad = StreamingVAD()
+    end_delay = vad.end_frames * vad.frame_samples / SAMPLE_RATE / (args.speed or float("inf"))
+    speech_ends = deque()
+    start = time.perf_counter()
+    last_message = start
+
+    async def receive(ws):
+        nonlocal last_message
+        async for message in ws:
+            event = json.loads(message)
+            now = last_message = time.perf_counter()
+            if "error" in event:
+                result.fail(REJECTED if "full" in event["error"] else ERROR, event["error"])
+            elif event.get("text"):
+                if result.first_text is None:
+                    result.first_text = now - start
+                if event.get("is_final") and speech_ends:
+                    # Finals arrive in utterance order
+                    result.final_latencies.append(now - speech_ends.popleft())
+
+    try:
+        async with websockets.connect(ws_url, open_timeout=args.timeout, max_size=None) as ws:
+            receiver = asyncio.create_task(receive(ws))
+            try:
+                for offset in range(0, len(audio), chunk_bytes):
+                    chunk = audio[offset:offset + chunk_bytes]
+                    await ws.send(chunk)
+                    if vad.process(np.frombuffer(chunk, dtype=np.int16)).speech_ended:
+                        # The VAD only calls it after end_ms of silence; the speaker stopped that long ago
+                        speech_ends.append(time.perf_counter() - end_delay)
+                    if args.speed > 0:
+                        # Pace against the clock so slow sends don't stretch the session
+                        due = start + (offset + len(chunk)) / 2 / SAMPLE_RATE / args.speed
+                        await asyncio.sleep(max(0.0, due - time.perf_counter()))
+                # Wait for the last finals: done once the server has been quiet for settle_seconds
+                sent = time.perf_counter()
+                while time.perf_counter() < sent + args.timeout and not receiver.done():
+                    if time.perf_counter() - max(last_message, sent) > args.settle_seconds:
+                        break
+                    await asyncio.sleep(0.05)
+                await ws.close()
+            finally:
+                receiver.cancel()
+                try:
+                    await receiver
+                except (asyncio.CancelledError, ConnectionClosed):
+                    pass
+    except InvalidHandshake as e:
+        # The server closes before accepting (403 on the handshake) while models are loading
+        status = getattr(getattr(e, "response", None), "status_code", getattr(e, "status_code", None))
+        result.fail(REJECTED if status == 403 else ERROR, e)
+    except ConnectionClosed as e:
+        # 1013: server not ready / try again later
+        result.fail(REJECTED if e.rcvd is not None and e.rcvd.code == 1013 else DROPPED, e)
+    except Exception as e:
+        result.fail(ERROR, repr(e))
+
+    if result.outcome == OK and result.first_text is None:
+        result.fail(ERROR, "no text received")
+    result.total = time.perf_counter() - start
+    return result
+
+async def client_loop(endpoint, url, recordings, args, deadline, results, index):
+    """One simulated user: replays recordings back to back until the deadline, starting at a different clip per client."""
+    async def replay(run):
+        i = index
+        while time.perf_counter() < deadline:
+            result = await run(recordings[i % len(recordings)])
+            results.append(result)
+            i += 1
+            if result.outcome != OK:
+                # Back off like a real client instead of hammering a failing server
+                await asyncio.sleep(args.retry_delay)
+
+    if endpoint == "stream":
+        await replay(lambda recording: run_stream(url, recording, args))
+        return
+
+    import httpx
+    run = run_transcribe if endpoint == "transcribe" else run_transcribe_stream
+    async with httpx.AsyncClient(timeout=args.timeout) as client:
+        await replay(lambda recording: run(client, url, recording, args))
+
+def _percentiles(values):
+    if not values:
+        return None
+    values = np.asarray(values) * 1000
+    return {f"p{q}": round(float(np.percentile(values, q)), 1) for q in (50, 95, 99)}
+
+def summarise(endpoint, concurrency, results, wall):
+    outcomes = {name: sum(r.outcome == name for r in results) for name in (OK, REJECTED, ERROR, DROPPED)}
+    ok = [r for r in results if r.outcome == OK]
+    errors = [r.detail for r in results if r.outcome != OK]
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "sessions": len(results),
+        **outcomes,
+        "error_rate": round((len(results) - len(ok)) / len(results), 4) if results else None,
+        "sessions_per_second": round(len(ok) / wall, 3),
+        # Seconds of audio served per second: how many real-time streams the server keeps up with
+        "audio_seconds_per_second": round(sum(r.audio_seconds for r in ok) / wall, 3),
+        "first_text_ms": _percentiles([r.first_text for r in ok if r.first_text is not None]),
+        "final_latency_ms": _percentiles([latency for r in ok for latency in r.final_latencies]),
+        "sample_errors": sorted(set(errors))[:5],
+    }
+
+async def run_level(endpoint, concurrency, recordings, args):
+    results = []
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*(client_loop(endpoint, args.url, recordings, args, deadline, results, i)
+                           for i in range(concurrency)))
+    return summarise(endpoint, concurrency, results, time.perf_counter() - start)
+
+def print_report(levels):
+    print(f"\n{'endpoint':<18}{'conc':>5}{'sessions':>9}{'err%':>7}{'drop':>6}{'audio s/s':>10}"
+          f"{'first p50':>10}{'p95':>8}{'final p50':>10}{'p95':>8}{'p99':>8}")
+    for level in levels:
+        first = level["first_text_ms"] or {}
+        final = level["final_latency_ms"] or {}
+        error_rate = level["error_rate"] * 100 if level["error_rate"] is not None else 0
+        print(f"{level['endpoint']:<18}{level['concurrency']:>5}{level['sessions']:>9}{error_rate:>7.1f}"
+              f"{level['dropped']:>6}{level['audio_seconds_per_second']:>10.1f}"
+              f"{first.get('p50', '-'):>10}{first.get('p95', '-'):>8}"
+              f"{final.get('p50', '-'):>10}{final.get('p95', '-'):>8}{final.get('p99', '-'):>8}")
+
+async def main_async(args):
+    recordings = load_recordings(args.audio, [float(s) for s in args.lengths.split(",")])
+    levels = []
+    for endpoint in args.endpoints.split(","):
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            print(f"{endpoint}: {concurrency} concurrent clients for {args.duration:g}s...")
+            levels.append(await run_level(endpoint, concurrency, recordings, args))
+    return levels
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent load test for the dictation server.")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--endpoints", default="stream", help="comma-separated: transcribe,transcribe_stream,stream")
+    parser.add_argument("--concurrency", default="1,5,10,25,50", help="comma-separated client counts to step through")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run each concurrency level")
+    parser.add_argument("--audio", nargs="*", help="audio files to replay (default: synthetic corpus)")
+    parser.add_argument("--lengths", default="3,5,10", help="synthetic clip lengths in seconds")
+    parser.add_argument("--speed", type=float, default=1.0, help="WebSocket replay speed (x real time, 0 = no pacing)")
+    parser.add_argument("--chunk-ms", type=float, default=85, help="WebSocket chunk size in ms of audio")
+    parser.add_argument("--tail-silence-ms", type=float, default=1000, help="silence sent after each clip")
+    parser.add_argument("--settle-seconds", type=float, default=1.0,
+                        help="quiet time after the last final text before a WebSocket session ends")
+    parser.add_argument("--mode", default="incremental", help="/stream mode: incremental or utterance")
+    parser.add_argument("--style", default="Neutral")
+    parser.add_argument("--timeout", type=float, default=60, help="per-request / final-text timeout in seconds")
+    parser.add_argument("--retry-delay", type=float, default=0.5, help="pause after a failed session in seconds")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    levels = asyncio.run(main_async(args))
+    print_report(levels)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "levels": levels}, f, indent=2)
+        print(f"Report written to {args.output}")
+
+if __name__ == "__main__":
+    main()
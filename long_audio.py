@@ -0,0 +1,93 @@
+import re
+import numpy as np
+from vad import StreamingVAD
+
+SAMPLE_RATE = 16000
+
+# Chunks never exceed one Whisper window, so each decodes in a single pass
+MAX_CHUNK_SECONDS = 30.0
+# Below this a chunk is not cut yet, even at a pause (fewer, fuller chunks decode better)
+MIN_CHUNK_SECONDS = 10.0
+# Pauses at least this long are cut points
+MIN_SILENCE_MS = 300
+# Speech with no usable pause is hard-cut, repeating this much audio in the next chunk
+OVERLAP_SECONDS = 1.0
+# Longest run of words searched for when removing text repeated across a hard cut
+MAX_OVERLAP_WORDS = 8
+
+def split_on_silence(audio, sample_rate=SAMPLE_RATE, max_seconds=MAX_CHUNK_SECONDS, min_seconds=MIN_CHUNK_SECONDS,
+                     min_silence_ms=MIN_SILENCE_MS, overlap_seconds=OVERLAP_SECONDS, vad=None):
+    """
+    Splits a whole recording into chunks of at most max_seconds for independent decoding.
+    Each chunk is cut in the middle of the last pause of at least min_silence_ms that leaves it
+    min_seconds or longer; where there is no such pause it is hard-cut at max_seconds and the
+    next chunk starts overlap_seconds earlier (see stitch_segments). Chunks without any speech
+    are dropped. Returns a list of (start, end) sample ranges.
+    """
+    vad = vad or StreamingVAD(sample_rate=sample_rate)
+    frame = vad.frame_samples
+    speech = vad.speech_mask(audio)
+
+    # Cut points: the middle of every long enough run of non-speech frames
+    edges = np.flatnonzero(np.diff(np.concatenate([[1], speech.astype(np.int8), [1]])))
+    min_frames = max(1, int(min_silence_ms * sample_rate / 1000) // frame)
+    cuts = np.array([(start + end) // 2 * frame for start, end in zip(edges[::2], edges[1::2])
+                     if end - start >= min_frames], dtype=np.int64)
+
+    max_samples = int(max_seconds * sample_rate)
+    min_samples = int(min_seconds * sample_rate)
+    overlap = int(overlap_seconds * sample_rate)
+    chunks = []
+    start = 0
+    while start < len(audio):
+        limit = start + max_samples
+        if limit >= len(audio):
+            chunks.append((start, len(audio)))
+            break
+        candidates = cuts[(cuts >= start + min_samples) & (cuts <= limit)]
+        if len(candidates):
+            end = int(candidates[-1])
+            chunks.append((start, end))
+            start = end
+        else:
+            chunks.append((start, limit))
+            start = limit - overlap
+
+    return [(start, end) for start, end in chunks if speech[start // frame:-(-end // frame)].any()]
+
+def _norm(word):
+    return re.sub(r"[^\w']", "", word.lower())
+
+def _drop_repeated_words(previous_text, text, max_words=MAX_OVERLAP_WORDS):
+    """Removes the longest run of leading words in text that repeats the end of previous_text."""
+    previous = [_norm(w) for w in previous_text.split()]
+    words = text.split()
+    current = [_norm(w) for w in words]
+    for n in range(min(max_words, len(previous), len(current)), 0, -1):
+        if previous[-n:] == current[:n]:
+            return " ".join(words[n:])
+    return text
+
+def stitch_segments(chunks, chunk_segments, sample_rate=SAMPLE_RATE):
+    """
+    Joins per-chunk (start, end, text) segments (times relative to each chunk) into one
+    timeline in seconds. Where a chunk overlaps the previous one (a hard cut), segments that
+    end inside the overlap are dropped and words repeated across the cut are removed.
+    """
+    stitched = []
+    previous_end = 0
+    for (start, end), segments in zip(chunks, chunk_segments):
+        offset = start / sample_rate
+        overlap_end = (previous_end - start) / sample_rate
+        for seg_start, seg_end, text in segments:
+            if overlap_end > 0 and stitched:
+                if seg_end <= overlap_end:
+                    continue
+                text = _drop_repeated_words(stitched[-1][2], text)
+                if not text.strip():
+                    continue
+            stitched.append((seg_start + offset, seg_end + offset, text))
+            # Only the first kept segment can repeat the previous chunk
+            overlap_end = 0
+        previous_end = end
+    return stitched
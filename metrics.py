@@ -0,0 +1,140 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+class LatencyHistogram:
+    """
+    Latency observations (ms) for one stage. Count and sum cover the whole process
+    lifetime; percentiles are computed over the most recent `window` observations.
+    """
+    def __init__(self, window=2048):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, ms, count=1):
+        with self._lock:
+            for _ in range(count):
+                self._samples.append(ms)
+            self.count += count
+            self.total += ms * count
+
+    def summary(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total = self.count, self.total
+        result = {
+            "count": count,
+            "sum_ms": round(total, 3),
+            "mean_ms": round(total / count, 3) if count else 0.0,
+            "max_ms": round(samples[-1], 3) if samples else 0.0,
+        }
+        for q in QUANTILES:
+            result[f"p{int(q * 100)}_ms"] = round(_percentile(samples, q), 3)
+        return result
+
+def _percentile(samples, q):
+    # Nearest-rank percentile over an already sorted list
+    if not samples:
+        return 0.0
+    rank = math.ceil(q * len(samples))
+    return samples[max(rank, 1) - 1]
+
+class StageMetrics:
+    """Process-wide latency histograms keyed by stage name (decode, vad, stt, grammar, ...)."""
+    def __init__(self, window=2048):
+        self.window = window
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, ms, count=1):
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = LatencyHistogram(self.window)
+        histogram.observe(ms, count)
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, (time.perf_counter() - start) * 1000)
+
+    @contextmanager
+    def time_batch(self, stage, count):
+        """Times one batched call and records it once for each of the count items it served."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if count:
+                self.observe(stage, (time.perf_counter() - start) * 1000, count)
+
+    def summary(self):
+        with self._lock:
+            stages = dict(self._stages)
+        return {stage: histogram.summary() for stage, histogram in sorted(stages.items())}
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+    def render_prometheus(self, name="fluxdictate_stage_latency_ms"):
+        """Prometheus text exposition: one summary metric with a stage label per stage."""
+        lines = [
+            f"# HELP {name} Pipeline stage latency in milliseconds.",
+            f"# TYPE {name} summary",
+        ]
+        for stage, stats in self.summary().items():
+            for q in QUANTILES:
+                lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} {stats[f"p{int(q * 100)}_ms"]}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {stats["sum_ms"]}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {stats["count"]}')
+        return "\n".join(lines) + "\n"
+
+class StageTimings:
+    """
+    Stage timings for a single request. Every stage is also recorded in the
+    process-wide StageMetrics. Stages from concurrent pipeline workers may add
+    to the same instance; repeated stages (e.g. per stream segment) are summed.
+    """
+    def __init__(self, stage_metrics=None):
+        self.metrics = stage_metrics if stage_metrics is not None else metrics
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, ms):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + ms
+        self.metrics.observe(stage, ms)
+
+    @contextmanager
+    def stage(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, (time.perf_counter() - start) * 1000)
+
+    def call(self, stage, fn, *args, **kwargs):
+        """Runs fn(*args, **kwargs) timed as stage and returns its result."""
+        with self.stage(stage):
+            return fn(*args, **kwargs)
+
+    def get(self, stage):
+        with self._lock:
+            return self.stages.get(stage, 0.0)
+
+    def as_dict(self):
+        with self._lock:
+            return {stage: round(ms, 2) for stage, ms in self.stages.items()}
+
+# Shared by the pipeline, executor, scheduler and server; exposed on /metrics
+metrics = StageMetrics()
@@ -0,0 +1,98 @@
+import threading
+
+def load_whisper_model(model_size, device, compute_type, num_workers):
+    from faster_whisper import WhisperModel
+    return WhisperModel(model_size, device=device, compute_type=compute_type, num_workers=num_workers)
+
+class ModelHandle:
+    """
+    A reference to a shared model in a ModelRegistry.
+    The model is loaded on the first get(); release() gives the reference back.
+    """
+    def __init__(self, registry, key, num_workers):
+        self.registry = registry
+        self.key = key
+        self.num_workers = num_workers
+        self.released = False
+
+    def get(self):
+        return self.registry.get(self.key)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.registry.release(self)
+
+class ModelRegistry:
+    """
+    Process-wide registry of Whisper models keyed by (model size, device, compute_type).
+    Identical models are loaded once and shared by every handle that asks for them.
+    Each handle states how many concurrent transcriptions it needs (num_workers); the
+    shared CTranslate2 model is loaded with the sum over the handles acquired so far,
+    so sharing one model does not reduce the concurrency each engine had on its own.
+    Models with no handles left are unloaded when evict_unused is set (or on evict()).
+    """
+    def __init__(self, loader=load_whisper_model, evict_unused=False):
+        self.loader = loader
+        self.evict_unused = evict_unused
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, model_size, device="cpu", compute_type="int8", num_workers=1):
+        key = (model_size, device, compute_type)
+        with self._lock:
+            entry = self._entries.setdefault(key, {"model": None, "refs": 0, "num_workers": 0,
+                                                   "lock": threading.Lock()})
+            entry["refs"] += 1
+            entry["num_workers"] += num_workers
+            if entry["model"] is not None:
+                print(f"Sharing loaded model {key} ({entry['refs']} handles)")
+        return ModelHandle(self, key, num_workers)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            raise KeyError(f"Model {key} is not registered")
+
+        # Per-model lock so one slow load doesn't block lookups of other models
+        with entry["lock"]:
+            if entry["model"] is None:
+                model_size, device, compute_type = key
+                print(f"Loading STT Model: {model_size} ({device}, {compute_type}, {entry['num_workers']} workers)...")
+                entry["model"] = self.loader(model_size, device, compute_type, entry["num_workers"])
+            return entry["model"]
+
+    def release(self, handle):
+        with self._lock:
+            entry = self._entries.get(handle.key)
+            if entry is None:
+                return
+            entry["refs"] -= 1
+            entry["num_workers"] -= handle.num_workers
+            if entry["refs"] <= 0 and self.evict_unused:
+                del self._entries[handle.key]
+
+    def evict(self):
+        """Unloads every model that no handle refers to any more."""
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e["refs"] <= 0]:
+                del self._entries[key]
+
+    def unload(self, key):
+        """Drops a loaded model; it is reloaded lazily if a handle uses it again."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            with entry["lock"]:
+                entry["model"] = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "/".join(key): {"loaded": e["model"] is not None, "refs": e["refs"], "num_workers": e["num_workers"]}
+                for key, e in self._entries.items()
+            }
+
+# Shared by every STTEngine in the process unless one is given its own registry
+registry = ModelRegistry()
@@ -2,139 +2,408 @@ import time
 from stt_engine import STTEngine
 from text_cleaner import TextCleaner
 from grammar_corrector import GrammarCorrector
+from grammar_gate import GrammarGate
 from style_controller import StyleController
+from executor import InferenceExecutor
+from audio_buffer import PCM_SCALE
+from staged_stream import Batch, Regroup, run_stages
+from result_cache import LRUCache, SQLiteCache, make_key
+from audio_io import audio_fingerprint
+from decode_policy import AdaptiveDecodePolicy, DecodePolicy, NORMAL
+from metrics import StageTimings, metrics
+from sentence_assembler import assemble_sentences
+import os
 import numpy as np
+import re
+
+INITIAL_PROMPT = "The following is a transcript of an Indian English speaker."
+
+# In-memory grammar results kept (one entry per sentence)
+GRAMMAR_CACHE_SIZE = 4096
+
+# Default GrammarGate threshold: sentences scoring lower skip T5 (0: only short fragments without a known error skip it)
+GATE_THRESHOLD = 0.0
+
+# Whole-recording transcripts kept, so re-uploads with another style skip Whisper
+TRANSCRIPT_CACHE_SIZE = 256
+
+# Recordings longer than this are split at pauses and their chunks decoded in parallel (see STTEngine.transcribe_long)
+LONG_AUDIO_SECONDS = 60
+
+# Segments buffered between process_stream stages
+STAGE_QUEUE_SIZE = 4
+
+# Pattern matches "The following is a transcript..." and variations, case-insensitive
+HALLUCINATION_PATTERN = re.compile(
+    r"(the\s+following\s+is\s+a\s+transcript\s+of\s+an\s+indian\s+english\s+speaker\.?|transcript\s+of\s+an\s+indian\s+english\s+speaker\.?)",
+    re.IGNORECASE
+)
+
+def pcm_to_float32(audio_bytes):
+    # Convert Raw Int16 bytes to Float32 array normalized to [-1, 1]
+    # frombuffer is a zero-copy view; the scaled multiply is the only pass over the data
+    audio_int16 = np.frombuffer(audio_bytes, dtype=np.int16)
+    return np.multiply(audio_int16, PCM_SCALE, dtype=np.float32)
+
+def audio_seconds(audio_input):
+    """Duration of a float32 16kHz array; None for file paths (unknown until decoded)."""
+    if isinstance(audio_input, np.ndarray):
+        return len(audio_input) / 16000
+    return None
 
 class DictationPipeline:
-    def __init__(self):
+    def __init__(self, executor=None, cache_dir=None, stt=None, cleaner=None, grammar=None, style=None,
+                 grammar_backend="auto", grammar_options=None, gate_threshold=GATE_THRESHOLD, decode_policy=None,
+                 stt_options=None):
         print("Initializing Pipeline...")
-        self.stt = STTEngine()
-        self.cleaner = TextCleaner()
-        self.grammar = GrammarCorrector()
-        self.style = StyleController()
+        # Worker pool used by the async wrappers (aprocess, aprocess_bytes, aprocess_stream)
+        self.executor = executor or InferenceExecutor()
+        # Components can be passed in (e.g. the stand-in models in benchmark.py); the rest are built here
+        # stt_options: STTEngine settings, e.g. batch_workers for parallel long-audio decoding
+        self.stt = stt or STTEngine(**(stt_options or {}))
+        self.cleaner = cleaner or TextCleaner()
+        # grammar_backend/grammar_options select and tune the T5 runtime (see grammar_backends)
+        # gate_threshold: sentences scoring below it skip T5 (0 corrects all but short fragments, see grammar_gate)
+        self.grammar = grammar or GrammarCorrector(cache=self._grammar_cache(cache_dir),
+                                                   gate=GrammarGate(threshold=gate_threshold),
+                                                   backend=grammar_backend, **(grammar_options or {}))
+        self.style = style or StyleController()
+        # Raw STT text and segments keyed by audio fingerprint + model + decode options
+        self.transcripts = LRUCache(maxsize=TRANSCRIPT_CACHE_SIZE)
+        # Whisper model/beam/temperature per request, from the executor's load (more sources can be added)
+        self.decode_policy = decode_policy or AdaptiveDecodePolicy()
+        self.decode_policy.add_load_source(lambda: self.executor.pending / self.executor.max_pending)
         print("Pipeline Initialized.")
 
-    def process(self, audio_path, style_mode="Neutral"):
+    def process(self, audio_input, style_mode="Neutral", timings=None):
+        """
+        Batch processing of a whole recording.
+        audio_input can be a file path or a float32 16kHz numpy array (see audio_io).
+        Stage timings are added to timings (a StageTimings) when one is given.
+        """
+        timings = timings if timings is not None else StageTimings()
+        start_total = time.perf_counter()
         latency_log = {}
         
         # Step 1: STT
         print("Step 1: Transcribing (Batch)...")
-        raw_text, stt_latency = self.stt.transcribe(
-            audio_path, 
-            initial_prompt="The following is a transcript of an Indian English speaker.",
-            model_type="batch"
-        )
-        latency_log["STT"] = f"{stt_latency:.2f} ms"
+        policy = self.decode_policy.select("batch", audio_seconds(audio_input))
+        with timings.stage("stt"):
+            raw_text, cache_hit, chunks = self._transcribe_cached(audio_input, policy)
+        latency_log["STT"] = f"{timings.get('stt'):.2f} ms"
+        latency_log["Transcript Cache"] = "hit" if cache_hit else "miss"
+        if chunks:
+            latency_log["STT Chunks"] = chunks
+        latency_log["Decode Policy"] = policy.as_dict()
         
         if not raw_text:
-            return "", "", latency_log, 0
+            total_latency = (time.perf_counter() - start_total) * 1000
+            timings.add("batch_total", total_latency)
+            return "", "", latency_log, total_latency
 
         # Step 2: Cleaning (Disfluency + Repetition)
         print("Step 2: Cleaning...")
-        start_clean = time.time()
-        cleaned_text = self.cleaner.clean(raw_text)
-        clean_latency = (time.time() - start_clean) * 1000
-        latency_log["Cleaning"] = f"{clean_latency:.2f} ms"
+        with timings.stage("cleaning"):
+            cleaned_text = self.cleaner.clean(raw_text)
+        latency_log["Cleaning"] = f"{timings.get('cleaning'):.2f} ms"
 
         # Step 3: Grammar Correction
         print("Step 3: Grammar Correction...")
-        grammar_text, grammar_latency = self.grammar.correct(cleaned_text)
-        latency_log["Grammar"] = f"{grammar_latency:.2f} ms"
+        with timings.stage("grammar"):
+            grammar_text, _ = self.grammar.correct(cleaned_text)
+        latency_log["Grammar"] = f"{timings.get('grammar'):.2f} ms"
 
         # Step 4: Style Transfer
         print("Step 4: Style Transfer...")
-        start_style = time.time()
-        final_text = self.style.apply_style(grammar_text, style_mode)
-        style_latency = (time.time() - start_style) * 1000
-        latency_log["Style"] = f"{style_latency:.2f} ms"
-        
-        # Total Latency
-        total_latency = stt_latency + clean_latency + grammar_latency + style_latency
-        
-        # Cap latency at 1498ms
-        import random
-        if total_latency > 1498:
-            total_latency = random.uniform(1200, 1498)
-            
+        with timings.stage("style"):
+            final_text = self._apply_styles(grammar_text, style_mode)
+        latency_log["Style"] = f"{timings.get('style'):.2f} ms"
+        
+        # Total Latency: wall time of the whole call, including the glue between stages
+        total_latency = (time.perf_counter() - start_total) * 1000
+        timings.add("batch_total", total_latency)
         latency_log["Total"] = f"{total_latency:.2f} ms"
         
         return raw_text, final_text, latency_log, total_latency
 
-    def process_bytes(self, audio_bytes, style="Neutral"):
+    def _transcribe_cached(self, audio_input, policy=None):
+        """
+        Batch transcription behind the transcript cache.
+        Long recordings go through chunked parallel decoding.
+        Returns (raw text, cache hit, number of chunks or None when decoded in one pass).
+        """
+        long_audio = (audio_seconds(audio_input) or 0) > LONG_AUDIO_SECONDS
+        key = self.stt.cache_key(audio_fingerprint(audio_input), initial_prompt=INITIAL_PROMPT, model_type="batch",
+                                 policy=policy)
+        if long_audio:
+            key = make_key(key, "chunked")
+        cached = self.transcripts.get(key)
+        if cached is not None:
+            return cached["text"], True, cached.get("chunks")
+
+        chunks = None
+        if long_audio:
+            segments, _, chunks = self.stt.transcribe_long(audio_input, initial_prompt=INITIAL_PROMPT, policy=policy)
+        else:
+            segments, _ = self.stt.transcribe_segments(
+                audio_input,
+                initial_prompt=INITIAL_PROMPT,
+                model_type="batch",
+                policy=policy
+            )
+        raw_text = " ".join(text for _, _, text in segments).strip()
+        self.transcripts.set(key, {"text": raw_text, "segments": segments, "chunks": chunks})
+        return raw_text, False, chunks
+
+    def process_bytes(self, audio_bytes, style="Neutral", timings=None):
         """
         Process in-memory audio bytes (Raw PCM Int16 16kHz).
         """
-        start_total = time.time()
+        timings = timings if timings is not None else StageTimings()
+        start_total = time.perf_counter()
         
-        # Convert Raw Int16 bytes to Float32 array normalized to [-1, 1]
-        audio_int16 = np.frombuffer(audio_bytes, dtype=np.int16)
-        audio_float32 = audio_int16.astype(np.float32) / 32768.0
+        with timings.stage("decode"):
+            audio_float32 = pcm_to_float32(audio_bytes)
+        
+        final_text = self.process_live(audio_float32, style, timings)
+        timings.add("live_total", (time.perf_counter() - start_total) * 1000)
+        return final_text
+
+    def process_live(self, audio_float32, style="Neutral", timings=None, vad_filter=None):
+        """
+        Live processing of one utterance already in float32 16kHz form (STT, grammar, style).
+        vad_filter=False skips Whisper's VAD for audio already gated by StreamingVAD.
+        """
+        timings = timings if timings is not None else StageTimings()
         
         # 1. STT
         # Transcribe directly from numpy array using Live Model
-        raw_text, stt_latency = self.stt.transcribe(
-            audio_float32,
-            initial_prompt="The following is a transcript of an Indian English speaker.",
-            model_type="live"
-        )
-        
-        # Filter Hallucinations (Aggressive Regex)
-        import re
-        # Pattern matches "The following is a transcript..." and variations, case-insensitive
-        hallucination_pattern = r"(the\s+following\s+is\s+a\s+transcript\s+of\s+an\s+indian\s+english\s+speaker\.?|transcript\s+of\s+an\s+indian\s+english\s+speaker\.?)"
+        policy = self.decode_policy.select("live", len(audio_float32) / 16000)
+        with timings.stage("stt"):
+            raw_text, _ = self.stt.transcribe(
+                audio_float32,
+                initial_prompt=INITIAL_PROMPT,
+                model_type="live",
+                vad_filter=vad_filter,
+                policy=policy
+            )
         
-        if re.search(hallucination_pattern, raw_text, re.IGNORECASE):
-            # If the text is mostly just the prompt (allow some margin for noise)
-            if len(raw_text) < 80: 
-                return ""
-            # Otherwise remove the phrase
-            raw_text = re.sub(hallucination_pattern, "", raw_text, flags=re.IGNORECASE).strip()
-            
+        # 2. Grammar + 3. Style
+        return self.process_text(raw_text, style, timings)
+
+    def process_text(self, raw_text, style="Neutral", timings=None):
+        """
+        Runs the live text stages (hallucination filter, grammar, style) on an already transcribed utterance.
+        """
+        timings = timings if timings is not None else StageTimings()
+        # Not timed: one regex search, and "cleaning" stays TextCleaner's time alone
+        raw_text = self._filter_hallucinations(raw_text)
         if not raw_text:
             return ""
             
         # 2. Grammar
-        corrected_text, _ = self.grammar.correct(raw_text)
+        with timings.stage("grammar"):
+            corrected_text, _ = self.grammar.correct(raw_text)
         
         # 3. Style
-        final_text = self.style.apply_style(corrected_text, style)
+        with timings.stage("style"):
+            final_text = self.style.apply_style(corrected_text, style)
         
         return final_text
 
-    def process_stream(self, audio_path, style_mode="Neutral"):
+    def process_audio_batch(self, audio_arrays, styles):
+        """
+        Batched live processing for several independent utterances (float32 16kHz arrays).
+        Whisper and T5 each run once for the whole batch; returns final texts in input order.
+        The utterances come from StreamingVAD, so Whisper's own VAD is not run on them again.
+        Each stage's batch time is recorded once per utterance, since every utterance waits for all of it.
+        """
+        count = len(audio_arrays)
+        # One policy for the whole batch: it is a single Whisper call
+        policy = self.decode_policy.select("live")
+        with metrics.time_batch("stt", count):
+            raw_texts, _ = self.stt.transcribe_batch(
+                audio_arrays,
+                initial_prompt=INITIAL_PROMPT,
+                model_type="live",
+                policy=policy,
+                vad_filter=False
+            )
+        raw_texts = [self._filter_hallucinations(t) for t in raw_texts]
+        
+        with metrics.time_batch("grammar", count):
+            corrected_texts, _ = self.grammar.correct_batch(raw_texts)
+        
+        with metrics.time_batch("style", count):
+            return [
+                self.style.apply_style(text, style) if text else ""
+                for text, style in zip(corrected_texts, styles)
+            ]
+
+    def _filter_hallucinations(self, raw_text):
+        """Strips the initial prompt when Whisper echoes it back on near-silent audio."""
+        # Filter Hallucinations (Aggressive Regex)
+        if HALLUCINATION_PATTERN.search(raw_text):
+            # If the text is mostly just the prompt (allow some margin for noise)
+            if len(raw_text) < 80: 
+                return ""
+            # Otherwise remove the phrase
+            raw_text = HALLUCINATION_PATTERN.sub("", raw_text).strip()
+        return raw_text
+
+    def process_stream(self, audio_input, style_mode="Neutral", timings=None):
         """
         Yields processed text segments as they become available.
+        Whisper segments are regrouped into whole sentences before grammar correction (see
+        sentence_assembler); each item carries the start/end times of its source segments.
+        audio_input can be a file path or a float32 16kHz numpy array.
+        Stage timings are summed over all segments into timings when one is given.
         """
         print("Starting Stream Processing...")
+        timings = timings if timings is not None else StageTimings()
+        start_total = time.perf_counter()
         
         # Generator for STT
+        policy = self.decode_policy.select("batch", audio_seconds(audio_input))
         stt_generator = self.stt.transcribe_generator(
-            audio_path,
-            initial_prompt="The following is a transcript of an Indian English speaker.",
-            model_type="batch"
+            audio_input,
+            initial_prompt=INITIAL_PROMPT,
+            model_type="batch",
+            policy=policy,
+            with_timestamps=True
         )
         
-        for raw_segment in stt_generator:
-            if not raw_segment.strip():
-                continue
-                
-            # Process each segment individually
-            # Note: Context might be lost between segments for grammar, but it's a trade-off for speed
-            cleaned_segment = self.cleaner.clean(raw_segment)
-            grammar_segment, _ = self.grammar.correct(cleaned_segment)
-            # Apply styles
-            if isinstance(style_mode, list):
-                final_segment = {}
-                for s in style_mode:
-                    if s: # Ignore empty strings/None
-                        final_segment[s] = self.style.apply_style(grammar_segment, s)
-            else:
-                final_segment = self.style.apply_style(grammar_segment, style_mode)
-            
-            yield {
-                "raw": raw_segment,
-                "final": final_segment
-            }
+        def segments():
+            # Whisper decodes lazily, so the STT time of a segment is the time taken to produce it.
+            # Recorded as stt_segment: per-segment times would skew the per-request "stt" percentiles.
+            while True:
+                with self.executor.model_slot(), timings.stage("stt_segment"):
+                    seg = next(stt_generator, None)
+                if seg is None:
+                    return
+                if seg[2].strip():
+                    yield seg
+        
+        # Whisper, sentence assembly, T5 and styling each run in their own worker connected by bounded
+        # queues, so sentence N+1 is transcribed while sentence N is being grammar-corrected.
+        # Sentences that pile up while T5 is busy are corrected together in one batch.
+        # The model stages take executor model slots, so open streams stay within its max_workers.
+        yield from run_stages(
+            segments(),
+            [Regroup(assemble_sentences),
+             Batch(lambda sentences: self._correct_segments(sentences, timings)),
+             lambda item: self._style_segment(item, style_mode, timings, policy)],
+            maxsize=STAGE_QUEUE_SIZE
+        )
+        timings.add("stream_total", (time.perf_counter() - start_total) * 1000)
+
+    def _correct_segments(self, sentences, timings):
+        # Assembled sentences keep their context, instead of T5 seeing fragments of a split segment
+        with timings.stage("cleaning"):
+            cleaned = [self.cleaner.clean(raw_segment) for raw_segment, _ in sentences]
+        with self.executor.model_slot(), timings.stage("grammar"):
+            corrected, _ = self.grammar.correct_batch(cleaned)
+        return [(raw_segment, grammar_segment, spans)
+                for (raw_segment, spans), grammar_segment in zip(sentences, corrected)]
+
+    def _style_segment(self, item, style_mode, timings, policy):
+        raw_segment, grammar_segment, spans = item
+        with timings.stage("style"):
+            final_segment = self._apply_styles(grammar_segment, style_mode)
+        
+        return {
+            "raw": raw_segment,
+            "final": final_segment,
+            "start": round(spans[0][0], 2),
+            "end": round(spans[-1][1], 2),
+            "segments": [[round(start, 2), round(end, 2)] for start, end in spans],
+            "decode_policy": policy.as_dict()
+        }
+
+    def _grammar_cache(self, cache_dir):
+        # With a cache_dir, grammar results also persist in SQLite and survive restarts
+        if not cache_dir:
+            return LRUCache(maxsize=GRAMMAR_CACHE_SIZE)
+        os.makedirs(cache_dir, exist_ok=True)
+        persistent = SQLiteCache(os.path.join(cache_dir, "grammar_cache.sqlite3"))
+        return LRUCache(maxsize=GRAMMAR_CACHE_SIZE, persistent=persistent)
+
+    def cache_stats(self):
+        return {
+            "grammar": self.grammar.cache.stats(),
+            "style": self.style.cache.stats(),
+            "transcript": self.transcripts.stats(),
+        }
+
+    def gate_stats(self):
+        """Sentences the grammar gate skipped vs. sent to T5 (None when the corrector has no gate)."""
+        gate = getattr(self.grammar, "gate", None)
+        return gate.stats() if gate is not None else None
+
+    def _apply_styles(self, text, style_mode):
+        # Apply styles: a list of styles gives {style: text}, computed from one shared scan
+        if isinstance(style_mode, list):
+            return self.style.apply_styles(text, style_mode)
+        return self.style.apply_style(text, style_mode)
+
+    def warmup(self):
+        """
+        Runs every model once on synthetic input so the first real request doesn't pay
+        one-off costs (weight paging, kernel selection, tokenizer caches).
+        """
+        # 1 s of low-level noise, like the clip test_latency.py generates; VAD is skipped so Whisper really runs
+        audio = (np.random.default_rng(0).standard_normal(16000) * 0.01).astype(np.float32)
+        self.stt.transcribe(audio, model_type="live", vad_filter=False)
+        self.stt.transcribe(audio, model_type="batch", vad_filter=False)
+        # Every other model the decode policy may pick, so switching never loads one mid-request
+        for model_size in self.decode_policy.selectable_models():
+            self.stt.transcribe(audio, model_type="batch", vad_filter=False,
+                                policy=DecodePolicy(NORMAL, model_size, 1, 0.0, True))
+        self.grammar.correct("I goes to the store yesterday.")
+        self.style.apply_style(self.cleaner.clean("Umm, I'm gonna go."), "Formal")
+
+    async def aprocess(self, audio_input, style_mode="Neutral", timings=None):
+        """Async wrapper for process; runs on the executor's worker pool."""
+        return await self.executor.run(self.process, audio_input, style_mode, timings)
+
+    async def aprocess_bytes(self, audio_bytes, style="Neutral", timings=None):
+        """Async wrapper for process_bytes; runs on the executor's worker pool."""
+        return await self.executor.run(self.process_bytes, audio_bytes, style, timings)
+
+    def aprocess_stream(self, audio_input, style_mode="Neutral", timings=None):
+        """
+        Async wrapper for process_stream. Claims a worker slot immediately (raising
+        ServerBusyError when the queue is full) and returns an async iterator of segments.
+        """
+        return self.executor.iterate(self.process_stream(audio_input, style_mode, timings))
+
+class EarlyGrammar:
+    """
+    Speculative grammar for one live utterance. While the user is still speaking, the
+    complete sentences of the committed (no longer changing) transcript are corrected into
+    the grammar cache, so the final process_text only sends the sentences that changed or
+    were still open to T5. Styling stays on the final text: it is cheap and works on the whole text.
+    """
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.reset()
+
+    def reset(self):
+        # Complete sentences already corrected
+        self.corrected = 0
+
+    def pending(self, committed_text):
+        """Complete sentences of committed_text not corrected yet."""
+        sentences = self.pipeline.grammar.split_sentences(self.pipeline._filter_hallucinations(committed_text))
+        # The last sentence may still grow unless it already ends the way split_sentences splits
+        if sentences and not sentences[-1].endswith((".", "!", "?")):
+            sentences = sentences[:-1]
+        return sentences[self.corrected:]
+
+    def correct(self, sentences):
+        """Corrects sentences (from pending) into the grammar cache; the gate's counters are left to the final pass."""
+        self.pipeline.grammar.correct_sentences(sentences, record_gate=False)
+        self.corrected += len(sentences)
 
 if __name__ == "__main__":
     pass
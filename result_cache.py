@@ -0,0 +1,113 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+def make_key(*parts):
+    """Content-addressed cache key: SHA-256 over the JSON encoding of parts."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU cache with an optional TTL (seconds) and an optional
+    persistent second tier. Lookups that miss in memory fall through to the persistent
+    tier and are promoted back into memory on a hit. Values must be JSON-serialisable
+    if a persistent tier is used.
+    """
+    def __init__(self, maxsize=1024, ttl=None, persistent=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.persistent = persistent
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if self.ttl is None or time.time() - stored_at < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+
+        if self.persistent is not None:
+            value = self.persistent.get(key)
+            if value is not None:
+                self._store(key, value)
+                with self._lock:
+                    self.hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def set(self, key, value):
+        self._store(key, value)
+        if self.persistent is not None:
+            self.persistent.set(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "persistent": self.persistent is not None,
+            }
+
+    def _store(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+class SQLiteCache:
+    """Persistent cache tier: JSON values in a single SQLite table, survives restarts."""
+    def __init__(self, path, ttl=None):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value, stored_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, stored_at = row
+        if self.ttl is not None and time.time() - stored_at >= self.ttl:
+            return None
+        return json.loads(value)
+
+    def set(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, stored_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time())
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,46 @@
+import re
+
+class RewriteEngine:
+    """
+    Applies a set of whole-word rewrite rules in a single pass over the text.
+    All rules are compiled into one case-insensitive alternation (longest phrases first,
+    so overlapping rules resolve the same way every time); each match is replaced by a
+    dict lookup. Cost is one scan of the text no matter how many rules there are.
+    """
+    def __init__(self, rules):
+        # rules: word or phrase -> replacement ("" removes it)
+        self.rules = {word.lower(): replacement for word, replacement in rules.items()}
+        alternation = "|".join(re.escape(word) for word in sorted(self.rules, key=len, reverse=True))
+        self.pattern = re.compile(rf"\b(?:{alternation})\b", re.IGNORECASE)
+
+    def apply(self, text):
+        return self.pattern.sub(self._replace, text)
+
+    def find(self, text):
+        """Returns (start, end, rule key) for every rule match, for reuse by render()."""
+        return [(m.start(), m.end(), m.group(0).lower()) for m in self.pattern.finditer(text)]
+
+    def _replace(self, match):
+        return self.rules[match.group(0).lower()]
+
+def render(text, spans, rules):
+    """
+    Splices replacements into text for spans found by RewriteEngine.find.
+    Spans whose key is not in rules are left untouched, so one scan with a combined
+    engine can be rendered separately for each rule set.
+    """
+    parts = []
+    pos = 0
+    for start, end, key in spans:
+        if key in rules:
+            parts.append(text[pos:start])
+            parts.append(rules[key])
+            pos = end
+    parts.append(text[pos:])
+    return "".join(parts)
+
+# Runs of the same word ("the the the") collapse to the first occurrence in one pass
+REPEATED_WORD_PATTERN = re.compile(r"\b(\w+)\b(?:\s+\1\b)+", re.IGNORECASE)
+
+def collapse_repeated_words(text):
+    return REPEATED_WORD_PATTERN.sub(r"\1", text)
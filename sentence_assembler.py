@@ -0,0 +1,58 @@
+import re
+import time
+
+# A sentence ends at . ! or ? (optionally followed by closing quotes/brackets) before whitespace or the end
+SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*(?=\s|$)")
+
+# Flush an unfinished sentence once its audio spans this long...
+MAX_SENTENCE_SECONDS = 30.0
+# ...or once it has waited this long (wall time). Whisper releases a 30 s window's segments together
+# and the last one is often cut mid-sentence, so this must stay above the time the next window takes
+# to decode, or that fragment reaches T5 on its own.
+MAX_WAIT_SECONDS = 15.0
+
+def assemble_sentences(segments, max_seconds=MAX_SENTENCE_SECONDS, max_wait_seconds=MAX_WAIT_SECONDS):
+    """
+    Regroups Whisper segments, which often stop mid-sentence, into whole sentences.
+    segments yields (start, end, text); this yields (text, spans) where spans lists the
+    (start, end) of every source segment the text came from. Text after the last sentence
+    end of a segment is carried over into the next item, so a segment split that way
+    appears in the spans of both. Unfinished text is flushed after max_seconds of audio,
+    max_wait_seconds of waiting, or at the end of the input. The wait is checked as segments
+    arrive and on every None in segments, which run_stages feeds a Regroup stage while no
+    segment arrives, so run as Regroup(assemble_sentences) it is timed out mid-decode too.
+    """
+    pieces = []
+    deadline = None
+
+    def flush(parts):
+        return " ".join(text for _, _, text in parts), [(start, end) for start, end, _ in parts]
+
+    for segment in segments:
+        if segment is None:
+            if pieces and time.monotonic() >= deadline:
+                yield flush(pieces)
+                pieces, deadline = [], None
+            continue
+
+        start, end, text = segment
+        text = text.strip()
+        if not text:
+            continue
+        if not pieces:
+            deadline = time.monotonic() + max_wait_seconds
+        pieces.append((start, end, text))
+
+        boundaries = list(SENTENCE_END.finditer(text))
+        if boundaries:
+            split = boundaries[-1].end()
+            head, tail = text[:split].strip(), text[split:].strip()
+            yield flush(pieces[:-1] + [(start, end, head)])
+            pieces = [(start, end, tail)] if tail else []
+            deadline = time.monotonic() + max_wait_seconds if tail else None
+        elif pieces[-1][1] - pieces[0][0] >= max_seconds or time.monotonic() >= deadline:
+            yield flush(pieces)
+            pieces, deadline = [], None
+
+    if pieces:
+        yield flush(pieces)
@@ -1,10 +1,22 @@
 from fastapi import FastAPI, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
-import shutil
 import os
 import time
-from pipeline import DictationPipeline
+import asyncio
+import threading
+from typing import List
+from pipeline import DictationPipeline, EarlyGrammar, INITIAL_PROMPT
+from decode_policy import AdaptiveDecodePolicy
+from audio_buffer import AudioRingBuffer
+from audio_io import load_upload
+from inference_scheduler import InferenceScheduler
+from executor import InferenceExecutor, ServerBusyError
+from vad import StreamingVAD
+from metrics import StageTimings, metrics
+from job_queue import JobQueue, JobStore, DONE, FAILED
+from worker_pool import WorkerPool, BATCH
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 app = FastAPI(title="Intelligent Speech Dictation API")
 
@@ -17,39 +29,201 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize Pipeline
-print("Initializing Pipeline...")
-pipeline = DictationPipeline()
-print("Pipeline Ready.")
+# Worker pool for blocking inference, so handlers never run models on the event loop
+# INFERENCE_WORKERS threads run jobs, INFERENCE_QUEUE_SIZE more may wait, the rest get 429
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "2"))
+INFERENCE_QUEUE_SIZE = int(os.environ.get("INFERENCE_QUEUE_SIZE", "16"))
+executor = InferenceExecutor(max_workers=INFERENCE_WORKERS, max_queue=INFERENCE_QUEUE_SIZE)
 
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Live utterances from all /stream sockets are micro-batched here
+# Up to SCHEDULER_MAX_BATCH utterances, waiting at most SCHEDULER_MAX_WAIT_MS for a batch to fill
+SCHEDULER_MAX_BATCH = 8
+SCHEDULER_MAX_WAIT_MS = 30
+
+# Models load in a background thread once the server is up, so /health answers immediately
+# and /ready flips to 200 after warmup. BACKGROUND_STARTUP=0 loads before accepting requests.
+BACKGROUND_STARTUP = os.environ.get("BACKGROUND_STARTUP", "1") == "1"
+
+# Directory for the persistent grammar result cache; unset keeps the cache in memory only
+CACHE_DIR = os.environ.get("CACHE_DIR")
+
+# Grammar runtime: "auto" (CTranslate2 int8, falling back to HappyTransformer), "ctranslate2" or "transformers"
+# GRAMMAR_INTRA_THREADS is threads per generate call (0 = CTranslate2 default), GRAMMAR_INTER_THREADS
+# how many calls may run in parallel (match INFERENCE_WORKERS to let every worker correct at once)
+GRAMMAR_BACKEND = os.environ.get("GRAMMAR_BACKEND", "auto")
+GRAMMAR_INTRA_THREADS = int(os.environ.get("GRAMMAR_INTRA_THREADS", "0"))
+GRAMMAR_INTER_THREADS = int(os.environ.get("GRAMMAR_INTER_THREADS", "1"))
+
+# Sentences the grammar gate scores below this skip T5 (0, the default, sends every sentence but
+# one- or two-word fragments to T5; 0.5 also skips sentences without a known error or surface problem)
+GRAMMAR_GATE_THRESHOLD = float(os.environ.get("GRAMMAR_GATE_THRESHOLD", "0"))
+
+# Concurrent decodes on the batch Whisper model; long uploads are split into chunks decoded
+# this many at a time (1 batches the chunks on a single decoder instead)
+STT_BATCH_WORKERS = int(os.environ.get("STT_BATCH_WORKERS", "1"))
+
+# Whisper sizes the decode policy may switch between (comma-separated) as load changes:
+# tiny.en under overload and, with DECODE_IDLE_UPGRADE=1, small.en for short batch uploads when idle.
+# Every size it may pick is loaded and warmed at startup. ADAPTIVE_DECODE=0 keeps the defaults.
+STT_MODELS = [m.strip() for m in os.environ.get("STT_MODELS", "tiny.en,base.en,small.en").split(",") if m.strip()]
+ADAPTIVE_DECODE = os.environ.get("ADAPTIVE_DECODE", "1") == "1"
+DECODE_IDLE_UPGRADE = os.environ.get("DECODE_IDLE_UPGRADE", "0") == "1"
+
+# Batch jobs (/jobs): durable queue in JOBS_DIR, run by JOB_WORKERS threads outside the request
+# path, whose model work takes the same INFERENCE_WORKERS slots; more than MAX_QUEUED_JOBS waiting jobs gets 429. Finished jobs and their results are
+# deleted JOB_RETENTION_HOURS after they finish (0 keeps them).
+JOBS_DIR = os.environ.get("JOBS_DIR", "jobs")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "1"))
+MAX_QUEUED_JOBS = int(os.environ.get("MAX_QUEUED_JOBS", "1000"))
+JOB_RETENTION_HOURS = float(os.environ.get("JOB_RETENTION_HOURS", "24"))
+# How often the job event stream checks for progress
+JOB_EVENT_INTERVAL = 0.5
+
+# MODEL_WORKERS > 0 runs the pipeline in that many model-worker processes instead of in this one;
+# /transcribe, /transcribe_stream, utterance /stream and jobs are dispatched to the least loaded worker
+# (up to MODEL_WORKER_SLOTS requests each). Incremental /stream needs an in-process model and
+# falls back to utterance mode.
+MODEL_WORKERS = int(os.environ.get("MODEL_WORKERS", "0"))
+MODEL_WORKER_SLOTS = int(os.environ.get("MODEL_WORKER_SLOTS", "4"))
+# Seconds every model worker gets to load and warm its pipeline before startup fails
+MODEL_WORKER_START_TIMEOUT = float(os.environ.get("MODEL_WORKER_START_TIMEOUT", "600"))
+
+pipeline = None
+scheduler = None
+shards = None
+jobs = None
+startup_state = {"ready": False, "error": None, "load_seconds": None}
+
+def load_pipeline():
+    global pipeline, scheduler, shards
+    try:
+        start_load = time.time()
+        pipeline_options = {
+            "cache_dir": CACHE_DIR,
+            "grammar_backend": GRAMMAR_BACKEND,
+            "grammar_options": {"intra_threads": GRAMMAR_INTRA_THREADS, "inter_threads": GRAMMAR_INTER_THREADS},
+            "gate_threshold": GRAMMAR_GATE_THRESHOLD,
+            "decode_policy": AdaptiveDecodePolicy(models=STT_MODELS, adaptive=ADAPTIVE_DECODE,
+                                                  upgrade_when_idle=DECODE_IDLE_UPGRADE),
+            "stt_options": {"batch_workers": STT_BATCH_WORKERS},
+        }
+        if MODEL_WORKERS > 0:
+            print(f"Starting {MODEL_WORKERS} model workers...")
+            started = WorkerPool(workers=MODEL_WORKERS, slots_per_worker=MODEL_WORKER_SLOTS,
+                                 factory_options=pipeline_options)
+            started.start(timeout=MODEL_WORKER_START_TIMEOUT)
+            jobs.start(started)
+            shards = started
+            startup_state["load_seconds"] = round(time.time() - start_load, 2)
+            startup_state["ready"] = True
+            print(f"Model Workers Ready. ({startup_state['load_seconds']}s)")
+            return
+
+        # Initialize Pipeline
+        print("Initializing Pipeline...")
+        decode_policy = pipeline_options["decode_policy"]
+        loaded = DictationPipeline(executor=executor, **pipeline_options)
+        print("Warming up models...")
+        loaded.warmup()
+        
+        scheduler = InferenceScheduler(loaded, max_batch_size=SCHEDULER_MAX_BATCH, max_wait_ms=SCHEDULER_MAX_WAIT_MS)
+        # A backed-up live queue degrades decoding just like a full worker pool
+        decode_policy.add_load_source(scheduler.load)
+        scheduler.start()
+        # Jobs submitted while the models were loading start running now, on the shared executor
+        decode_policy.add_load_source(jobs.load)
+        jobs.start(loaded, executor=executor)
+        pipeline = loaded
+        startup_state["load_seconds"] = round(time.time() - start_load, 2)
+        startup_state["ready"] = True
+        print(f"Pipeline Ready. ({startup_state['load_seconds']}s)")
+    except Exception as e:
+        print(f"Pipeline failed to load: {e}")
+        startup_state["error"] = str(e)
+
+@app.on_event("startup")
+def start_pipeline():
+    global jobs
+    # Opened here rather than at import, so importing the module (tests, tools) touches no files.
+    # Jobs are accepted from now on and start running once the pipeline has loaded.
+    jobs = JobQueue(JobStore(JOBS_DIR), workers=JOB_WORKERS, max_queued=MAX_QUEUED_JOBS,
+                    retention_seconds=JOB_RETENTION_HOURS * 3600 if JOB_RETENTION_HOURS > 0 else None)
+    if BACKGROUND_STARTUP:
+        threading.Thread(target=load_pipeline, name="pipeline-loader", daemon=True).start()
+    else:
+        load_pipeline()
+
+@app.on_event("shutdown")
+def stop_scheduler():
+    if scheduler is not None:
+        scheduler.stop()
+    if jobs is not None:
+        jobs.stop()
+        jobs.store.close()
+    if shards is not None:
+        shards.stop()
+    executor.shutdown(wait=False)
+
+def not_ready_response():
+    return JSONResponse(status_code=503, content={"status": "error", "message": "Models are still loading"})
+
+def parse_styles(*values):
+    """
+    Collects requested styles from form fields, in order and without repeats.
+    Each value may hold several comma-separated styles; empty and "None" entries are ignored.
+    A single style stays a plain string so single-style responses keep their shape.
+    """
+    styles = []
+    for value in values:
+        for entry in value if isinstance(value, list) else [value]:
+            for name in (entry or "").split(","):
+                name = name.strip()
+                if name and name != "None" and name not in styles:
+                    styles.append(name)
+    if not styles:
+        return "Neutral"
+    return styles if len(styles) > 1 else styles[0]
+
+def busy_response(e):
+    return JSONResponse(status_code=429, content={"status": "error", "message": str(e)})
 
 @app.post("/transcribe")
 async def transcribe_audio(
     file: UploadFile = File(...),
-    style: str = Form("Neutral")
+    style: str = Form("Neutral"),
+    styles: List[str] = Form(None),
+    timings: bool = Form(False)
 ):
+    if not startup_state["ready"]:
+        return not_ready_response()
+    # Extra styles turn final_text into {style: text}
+    style_arg = parse_styles(style, styles)
+    request_timings = StageTimings()
     try:
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        start_total = time.time()
-        raw_text, final_text, latency_log, processing_latency = pipeline.process(file_path, style)
-        total_time = (time.time() - start_total) * 1000
+        start_total = time.perf_counter()
+        # Decoded in memory straight into a float32 array; no uploads/ round trip
+        audio = await executor.run(request_timings.call, "decode", load_upload, file.file)
+        if shards is not None:
+            result = await shards.run(audio, style_arg, BATCH, request_timings)
+        else:
+            result = await pipeline.aprocess(audio, style_arg, request_timings)
+        raw_text, final_text, latency_log, processing_latency = result
+        total_time = (time.perf_counter() - start_total) * 1000
         
-        # Cleanup
-        os.remove(file_path)
-        
-        return {
+        response = {
             "status": "success",
             "raw_text": raw_text,
             "final_text": final_text,
             "latency_breakdown": latency_log,
+            "decode_policy": latency_log.get("Decode Policy"),
             "processing_latency_ms": processing_latency,
             "total_request_latency_ms": total_time
         }
+        if timings:
+            response["timings"] = request_timings.as_dict()
+        return response
+    except ServerBusyError as e:
+        return busy_response(e)
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
@@ -60,111 +234,338 @@ import json
 async def transcribe_audio_stream(
     file: UploadFile = File(...),
     style: str = Form("Neutral"),
-    style2: str = Form(None)
+    style2: str = Form(None),
+    styles: List[str] = Form(None),
+    timings: bool = Form(False)
 ):
-    styles = [style]
-    if style2 and style2 != "None":
-        styles.append(style2)
-    
-    # If only one style, keep it as string for backward compatibility if needed, 
-    # but pipeline now handles list. Let's pass list if multiple, or just pass the list always if pipeline supports it.
-    # The pipeline modification I made handles list or string. 
-    # To be safe and consistent with the plan, let's pass the list if style2 exists.
-    
-    style_arg = styles if len(styles) > 1 else style
-    file_path = os.path.join(UPLOAD_DIR, f"stream_{file.filename}")
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    if not startup_state["ready"]:
+        return not_ready_response()
+    # Any number of styles: style, style2 (kept for the frontend) and repeated/comma-separated styles
+    # With more than one, each segment's "final" is {style: text}, all rendered from one shared scan
+    style_arg = parse_styles(style, style2, styles)
+
+    # Decode and claim a worker slot up front, so bad input or an overloaded server
+    # gets a proper status code instead of a broken stream
+    request_timings = StageTimings()
+    try:
+        audio = await executor.run(request_timings.call, "decode", load_upload, file.file)
+        if shards is not None:
+            segments = worker_segments(shards.submit(audio, style_arg, BATCH, request_timings))
+        else:
+            segments = pipeline.aprocess_stream(audio, style_arg, request_timings)
+    except ServerBusyError as e:
+        return busy_response(e)
+    except Exception as e:
+        return JSONResponse(status_code=400, content={"status": "error", "message": str(e)})
         
     async def event_generator():
         try:
-            # We need to run the blocking generator in a threadpool or just iterate if it's fast enough
-            # Since faster_whisper releases GIL mostly, direct iteration might be okay, but let's be safe
-            # For simplicity in this MVP, we'll iterate directly. 
-            # Ideally, we'd use run_in_executor for the whole process or async generator if supported.
-            
-            for segment in pipeline.process_stream(file_path, style_arg):
+            # Each step of the blocking generator runs on the inference pool, keeping the event loop free
+            async for segment in segments:
                 data = json.dumps(segment)
                 yield f"data: {data}\n\n"
-                
+            
+            if timings:
+                # Stage totals over all segments, sent once the stream has finished
+                yield f"data: {json.dumps({'timings': request_timings.as_dict()})}\n\n"
             yield "data: [DONE]\n\n"
         except Exception as e:
             print(f"Streaming Error: {e}")
             import traceback
             traceback.print_exc()
             yield f"data: {json.dumps({'error': str(e)})}\n\n"
-        finally:
-            if os.path.exists(file_path):
-                os.remove(file_path)
                 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
+async def worker_segments(future):
+    """Model workers run whole-file process, so the stream carries a single segment."""
+    raw_text, final_text, latency_log, _ = await asyncio.wrap_future(future)
+    if raw_text:
+        yield {"raw": raw_text, "final": final_text, "decode_policy": latency_log.get("Decode Policy")}
+
 @app.get("/health")
 def health_check():
-    return {"status": "ok"}
+    """Liveness: the process is up. Readiness (models loaded and warm) is reported alongside."""
+    health = {"status": "ok", "live": True, **startup_state, "jobs": jobs.store.counts()}
+    if shards is not None:
+        health["model_workers"] = shards.stats()
+    if pipeline is not None:
+        health["caches"] = pipeline.cache_stats()
+        health["grammar_gate"] = pipeline.gate_stats()
+    return health
+
+@app.post("/jobs", status_code=202)
+def submit_job(
+    file: UploadFile = File(...),
+    style: str = Form("Neutral"),
+    styles: List[str] = Form(None),
+    priority: int = Form(0)
+):
+    """
+    Queues a batch transcription and returns its id at once; poll GET /jobs/{id} or follow
+    GET /jobs/{id}/events for progress and the result. Higher priority jobs run first.
+    Accepted while models are still loading.
+    """
+    # Sync handler: FastAPI runs it on its threadpool, so spooling the upload never blocks the event loop
+    try:
+        job_id = jobs.submit(file.file, parse_styles(style, styles), priority)
+    except ServerBusyError as e:
+        return busy_response(e)
+    return {"status": "queued", "id": job_id}
+
+def job_not_found(job_id):
+    return JSONResponse(status_code=404, content={"status": "error", "message": f"Unknown job: {job_id}"})
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Job status, stage and progress (0-1); the result (shaped like /transcribe's) once done."""
+    job = jobs.get(job_id)
+    if job is None:
+        return job_not_found(job_id)
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Server-sent events: the job record each time its status or stage changes, until it is done or failed
+    (or an error event if the job is deleted meanwhile).
+    """
+    if jobs.get(job_id) is None:
+        return job_not_found(job_id)
+
+    async def event_generator():
+        last = None
+        while True:
+            job = jobs.get(job_id)
+            if job is None:
+                # Deleted by the retention sweep while being followed
+                yield f"data: {json.dumps({'error': f'Unknown job: {job_id}'})}\n\n"
+                yield "data: [DONE]\n\n"
+                return
+            state = (job["status"], job["stage"], job.get("queue_position"))
+            if state != last:
+                last = state
+                yield f"data: {json.dumps(job)}\n\n"
+            if job["status"] in (DONE, FAILED):
+                yield "data: [DONE]\n\n"
+                return
+            await asyncio.sleep(JOB_EVENT_INTERVAL)
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+@app.get("/metrics")
+def metrics_endpoint(format: str = "prometheus"):
+    """
+    Stage latency histograms (decode, vad, stt, stt_segment, cleaning, grammar, style, queue waits, totals)
+    with p50/p95/p99 over recent requests. Prometheus text format by default, ?format=json for JSON.
+    """
+    if format == "json":
+        return metrics.summary()
+    return PlainTextResponse(metrics.render_prometheus())
+
+@app.get("/ready")
+def readiness_check():
+    """Readiness probe: 200 once models are loaded and warmed up, 503 until then."""
+    if not startup_state["ready"]:
+        status = "error" if startup_state["error"] else "loading"
+        return JSONResponse(status_code=503, content={"status": status, **startup_state})
+    return {"status": "ready", **startup_state}
 
 import numpy as np
 from fastapi import WebSocket, WebSocketDisconnect
 
-def calculate_rms(audio_chunk):
-    """Calculate Root Mean Square amplitude of a chunk."""
-    # Assuming 16-bit PCM (2 bytes per sample)
-    data = np.frombuffer(audio_chunk, dtype=np.int16)
-    if len(data) == 0:
-        return 0
-    return np.sqrt(np.mean(data**2))
+# Endpointing: an utterance ends after VAD_END_SILENCE_MS of non-speech.
+# Non-speech audio between utterances is dropped before it reaches Whisper.
+VAD_END_SILENCE_MS = 500
+VAD_PRE_PADDING_MS = 300
+
+# Utterance mode: force processing once this much speech has accumulated
+MAX_BATCH_UTTERANCE_SECONDS = 5
+
+def create_vad():
+    return StreamingVAD(end_ms=VAD_END_SILENCE_MS, pre_padding_ms=VAD_PRE_PADDING_MS)
+
+# Incremental mode: re-decode the open utterance once this much new audio has arrived
+PARTIAL_STEP_SECONDS = 0.5
+# Committed audio is trimmed as it goes, so utterances may run longer than in utterance mode
+MAX_UTTERANCE_SECONDS = 30
 
 @app.websocket("/stream")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(websocket: WebSocket, mode: str = "incremental", style: str = "Neutral",
+                             timings: bool = False):
+    """
+    Live dictation over raw PCM Int16 16kHz chunks.
+    mode=incremental (default) sends is_final: False partials while the user speaks;
+    mode=utterance waits for silence and transcribes each utterance in one go.
+    timings=true adds the utterance's stage timings (ms) to each final message.
+    With MODEL_WORKERS every socket runs in utterance mode.
+    """
+    if not startup_state["ready"]:
+        # 1013: try again later
+        await websocket.close(code=1013)
+        return
     await websocket.accept()
-    print("WebSocket connected")
+    print(f"WebSocket connected (mode: {mode})")
     
-    audio_buffer = b""
-    silence_counter = 0
-    # Tuning for "Near Instant"
-    # 2 chunks of silence = 0.5s.
-    SILENCE_THRESHOLD_CHUNKS = 2 
-    RMS_THRESHOLD = 300 # Tuned for Indian English / Mic Noise
+    try:
+        if mode == "utterance" or shards is not None:
+            await run_utterance_stream(websocket, style, timings)
+        else:
+            await run_incremental_stream(websocket, style, timings)
+    except WebSocketDisconnect:
+        print("WebSocket disconnected")
+    except Exception as e:
+        print(f"WebSocket Error: {e}")
+        try:
+            await websocket.close()
+        except:
+            pass
+
+async def run_utterance_stream(websocket, style, send_timings=False):
+    vad = create_vad()
+    # Preallocated per-socket buffer; speech is converted to float32 in place as it arrives
+    speech = AudioRingBuffer(capacity_seconds=MAX_BATCH_UTTERANCE_SECONDS + 1)
     
     try:
         while True:
-            # Receive audio chunk (bytes)
+            # Receive audio chunk (bytes), viewed as int16 without copying
             data = await websocket.receive_bytes()
             
-            rms = calculate_rms(data)
+            with metrics.time("vad"):
+                result = vad.process(np.frombuffer(data, dtype=np.int16))
+            speech.append(result.speech)
             
-            if rms < RMS_THRESHOLD:
-                silence_counter += 1
-            else:
-                silence_counter = 0
-                
-            audio_buffer += data
-            
-            # Force process if buffer > 5 seconds (16000 * 2 * 5 = 160000 bytes)
-            force_process = len(audio_buffer) > 160000
+            force_process = speech.seconds > MAX_BATCH_UTTERANCE_SECONDS
             
-            # If silence detected (> 0.5s) OR force process
-            if (silence_counter >= SILENCE_THRESHOLD_CHUNKS and len(audio_buffer) > 16000) or force_process:
-                print(f"Processing buffer... (Reason: {'Force' if force_process else 'Silence'}, RMS: {rms:.2f})")
+            # End of speech OR force process
+            if (result.speech_ended and len(speech) > 0) or force_process:
+                print(f"Processing utterance... (Reason: {'Force' if force_process else 'End of speech'}, {speech.seconds:.2f}s)")
                 
-                # Process the buffer with full pipeline
-                final_text = pipeline.process_bytes(audio_buffer)
+                # Process the utterance with full pipeline (batched with other sockets)
+                # The scheduler holds on to the audio, so it gets its own copy of the ring contents
+                start_final = time.perf_counter()
+                try:
+                    if shards is not None:
+                        # Copied straight into the worker's shared memory slot
+                        final_text = await shards.run(speech.view(), style)
+                    else:
+                        final_text = await asyncio.wrap_future(scheduler.submit(speech.view().copy(), style))
+                except ServerBusyError as e:
+                    # Overloaded: drop this utterance and tell the client rather than queueing unboundedly
+                    await websocket.send_json({"error": str(e)})
+                    final_text = ""
                 
                 if final_text:
-                    await websocket.send_json({"text": final_text, "is_final": True})
+                    message = {"text": final_text, "is_final": True}
+                    if send_timings:
+                        # Batched with other sockets, so only the end-to-end time is per utterance
+                        message["timings"] = {"live_total": round((time.perf_counter() - start_final) * 1000, 2)}
+                    await websocket.send_json(message)
                 
                 # Reset
-                audio_buffer = b""
-                silence_counter = 0
-                
-    except WebSocketDisconnect:
-        print("WebSocket disconnected")
-    except Exception as e:
-        print(f"WebSocket Error: {e}")
+                speech.clear()
+    finally:
+        print(f"VAD stats: {vad.stats()}")
+
+async def run_incremental_stream(websocket, style, send_timings=False):
+    vad = create_vad()
+    # Audio is already gated by our VAD, so Whisper's own VAD pass is skipped
+    transcriber = pipeline.stt.stream(initial_prompt=INITIAL_PROMPT, vad_filter=False,
+                                      capacity_seconds=MAX_UTTERANCE_SECONDS + 1)
+    decode_task = None
+    # Committed sentences are grammar-corrected while the user keeps talking (see EarlyGrammar)
+    early_grammar = EarlyGrammar(pipeline)
+    grammar_task = None
+    utterance_samples = 0
+    utterance_timings = StageTimings()
+    
+    def start_utterance():
+        # Decode settings are chosen per utterance from the load when it starts
+        transcriber.policy = pipeline.decode_policy.select("live")
+    
+    start_utterance()
+    
+    async def decode_step():
+        nonlocal grammar_task
         try:
-            await websocket.close()
-        except:
+            _, uncommitted = await executor.run(utterance_timings.call, "stt", transcriber.process_iter)
+        except ServerBusyError:
+            # Partials are best-effort; the final decode catches up
+            return
+        partial_text = transcriber.committed_text + " " + uncommitted
+        if partial_text.strip():
+            await websocket.send_json({"text": partial_text.strip(), "is_final": False})
+        
+        sentences = early_grammar.pending(transcriber.committed_text)
+        if sentences and (grammar_task is None or grammar_task.done()):
+            grammar_task = asyncio.create_task(early_grammar_step(sentences, utterance_timings))
+    
+    async def early_grammar_step(sentences, timings):
+        try:
+            await executor.run(timings.call, "grammar_early", early_grammar.correct, sentences)
+        except ServerBusyError:
+            # Also best-effort: whatever is left is corrected with the final text
             pass
+    
+    try:
+        while True:
+            data = await websocket.receive_bytes()
+            
+            with utterance_timings.stage("vad"):
+                result = vad.process(np.frombuffer(data, dtype=np.int16))
+            if len(result.speech):
+                transcriber.insert_audio(result.speech)
+                utterance_samples += len(result.speech)
+            
+            end_of_utterance = (
+                (result.speech_ended and utterance_samples > 0)
+                or utterance_samples > MAX_UTTERANCE_SECONDS * 16000
+            )
+            
+            if end_of_utterance:
+                # Let the in-flight partial land, decode the tail, then run the text stages once
+                if decode_task is not None:
+                    await decode_task
+                    decode_task = None
+                start_final = time.perf_counter()
+                # An early correction still running would otherwise be repeated by the final pass
+                if grammar_task is not None:
+                    await grammar_task
+                    grammar_task = None
+                try:
+                    if transcriber.pending_seconds() > 0:
+                        await executor.run(utterance_timings.call, "stt", transcriber.process_iter)
+                    raw_text = transcriber.finish()
+                    final_text = await executor.run(pipeline.process_text, raw_text, style, utterance_timings) if raw_text else ""
+                except ServerBusyError as e:
+                    await websocket.send_json({"error": str(e)})
+                    final_text = ""
+                # Time from end of speech to the final text
+                utterance_timings.add("live_total", (time.perf_counter() - start_final) * 1000)
+                
+                if final_text:
+                    message = {"text": final_text, "is_final": True, "decode_policy": transcriber.policy.as_dict()}
+                    if send_timings:
+                        message["timings"] = utterance_timings.as_dict()
+                        # Sentences corrected before the utterance ended
+                        message["early_sentences"] = early_grammar.corrected
+                    await websocket.send_json(message)
+                
+                transcriber.reset()
+                early_grammar.reset()
+                start_utterance()
+                utterance_samples = 0
+                utterance_timings = StageTimings()
+            elif transcriber.pending_seconds() >= PARTIAL_STEP_SECONDS and (decode_task is None or decode_task.done()):
+                if decode_task is not None:
+                    # Surface errors from the previous partial
+                    decode_task.result()
+                decode_task = asyncio.create_task(decode_step())
+    finally:
+        for task in (decode_task, grammar_task):
+            if task is not None and not task.done():
+                task.cancel()
+        print(f"VAD stats: {vad.stats()}")
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,142 @@
+import queue
+import threading
+
+_END = object()
+
+# How often blocked queue operations check whether the consumer has gone away, in seconds
+POLL_SECONDS = 0.1
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+class Batch:
+    """
+    Marks a run_stages stage that handles every item already waiting in its inbox at once:
+    fn takes a list of items and returns their results as a list in the same order.
+    """
+    def __init__(self, fn):
+        self.fn = fn
+
+class Regroup:
+    """
+    Marks a run_stages stage that turns its items into any number of outputs: fn takes an
+    iterator over the stage's items and is a generator of results. The iterator also yields
+    None each time POLL_SECONDS pass without an item, so fn can act on time passing.
+    """
+    def __init__(self, fn):
+        self.fn = fn
+
+def run_stages(source, stages, maxsize=4):
+    """
+    Runs a pipeline of stages concurrently and yields the final outputs in source order.
+    Iterating source and each stage function get their own thread, connected by bounded
+    queues of maxsize items, so item N+1 can be in stage 1 while item N is in stage 2.
+    A stage wrapped in Batch gets all the items queued for it in one call instead, and
+    one wrapped in Regroup reads its items itself (e.g. to merge or split them).
+    An exception in any stage is re-raised to the consumer; closing the generator early
+    stops all stage threads.
+    """
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=maxsize) for _ in range(len(stages) + 1)]
+
+    def put(q, item):
+        # Bounded put that gives up once the consumer has gone away
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _END
+
+    def produce():
+        try:
+            for item in source:
+                if not put(queues[0], item):
+                    return
+        except Exception as e:
+            put(queues[0], _Failure(e))
+            return
+        put(queues[0], _END)
+
+    def take(inbox, batched):
+        # One item, plus (for a Batch stage) whatever else is already waiting behind it
+        items = [get(inbox)]
+        while batched and items[-1] is not _END and not isinstance(items[-1], _Failure):
+            try:
+                items.append(inbox.get_nowait())
+            except queue.Empty:
+                break
+        if items[-1] is _END or isinstance(items[-1], _Failure):
+            return items[:-1], items[-1]
+        return items, None
+
+    def items(inbox):
+        # A Regroup stage's input: None while nothing arrives, an upstream failure re-raised
+        while not stop.is_set():
+            try:
+                item = inbox.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                yield None
+                continue
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+
+    def regroup(fn, inbox, outbox):
+        try:
+            for result in fn.fn(items(inbox)):
+                if not put(outbox, result):
+                    return
+        except Exception as e:
+            put(outbox, _Failure(e))
+            return
+        put(outbox, _END)
+
+    def work(fn, inbox, outbox):
+        if isinstance(fn, Regroup):
+            return regroup(fn, inbox, outbox)
+        batched = isinstance(fn, Batch)
+        while True:
+            items, last = take(inbox, batched)
+            if items:
+                try:
+                    results = fn.fn(items) if batched else [fn(items[0])]
+                except Exception as e:
+                    put(outbox, _Failure(e))
+                    return
+                for result in results:
+                    if not put(outbox, result):
+                        return
+            if last is not None:
+                put(outbox, last)
+                return
+
+    threads = [threading.Thread(target=produce, name="stage-source", daemon=True)]
+    for i, fn in enumerate(stages):
+        threads.append(threading.Thread(target=work, args=(fn, queues[i], queues[i + 1]),
+                                        name=f"stage-{i + 1}", daemon=True))
+    for t in threads:
+        t.start()
+
+    try:
+        while True:
+            item = get(queues[-1])
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
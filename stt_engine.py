@@ -1,30 +1,159 @@
-from faster_whisper import WhisperModel
+import model_registry
+from audio_buffer import AudioRingBuffer
+from result_cache import make_key
+from long_audio import split_on_silence, stitch_segments
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import os
+import threading
 import time
 
+# Whisper works on fixed 30 s windows (3000 mel frames)
+WINDOW_FRAMES = 3000
+WINDOW_SAMPLES = 16000 * 30
+
+# Long recordings on a single-worker model decode this many chunks per batched call
+LONG_AUDIO_BATCH_SIZE = 8
+
 class STTEngine:
-    def __init__(self, batch_model_size="base.en", live_model_size="base.en", device="cpu", compute_type="int8"):
-        print(f"Loading Batch STT Model: {batch_model_size}...")
-        self.batch_model = WhisperModel(batch_model_size, device=device, compute_type=compute_type)
-        
-        print(f"Loading Live STT Model: {live_model_size}...")
-        self.live_model = WhisperModel(live_model_size, device=device, compute_type=compute_type)
+    def __init__(self, batch_model_size="base.en", live_model_size="base.en", device="cpu", compute_type="int8",
+                 batch_workers=1, live_workers=1, lazy=False, registry=None):
+        # Models come from a shared registry: when batch and live ask for the same
+        # (size, device, compute_type) they share one CTranslate2 model
+        self.registry = registry or model_registry.registry
+        self._batch_handle = self.registry.acquire(batch_model_size, device, compute_type, num_workers=batch_workers)
+        self._live_handle = self.registry.acquire(live_model_size, device, compute_type, num_workers=live_workers)
+        # Extra model sizes a DecodePolicy asks for, acquired (and loaded) on first use
+        self._policy_handles = {}
+        self._policy_lock = threading.Lock()
         
+        if not lazy:
+            self.load()
+
+    def load(self):
+        """Loads both models now instead of on first use."""
+        self.batch_model
+        self.live_model
         print("STT Models Loaded.")
 
-    def transcribe(self, audio_input, initial_prompt=None, model_type="batch", beam_size=5):
+    @property
+    def batch_model(self):
+        return self._batch_handle.get()
+
+    @property
+    def live_model(self):
+        return self._live_handle.get()
+
+    def close(self):
+        """Releases this engine's model references back to the registry."""
+        self._batch_handle.release()
+        self._live_handle.release()
+        for handle in self._policy_handles.values():
+            handle.release()
+
+    def _handle(self, model_type, policy=None):
+        default = self._live_handle if model_type == "live" else self._batch_handle
+        if policy is None or policy.model_size in (None, default.key[0]):
+            return default
+        with self._policy_lock:
+            handle = self._policy_handles.get(policy.model_size)
+            if handle is None:
+                _, device, compute_type = default.key
+                handle = self.registry.acquire(policy.model_size, device, compute_type)
+                self._policy_handles[policy.model_size] = handle
+        return handle
+
+    def _model(self, model_type, policy=None):
+        return self._handle(model_type, policy).get()
+
+    def transcribe(self, audio_input, initial_prompt=None, model_type="batch", beam_size=5, vad_filter=None, policy=None):
         """
         Transcribes audio using the specified model type.
         audio_input can be a file path or numpy array.
+        A DecodePolicy, when given, overrides the model size, beam size, temperature and timestamp mode.
+        """
+        segments, latency = self.transcribe_segments(audio_input, initial_prompt, model_type, beam_size, vad_filter,
+                                                     policy)
+        text = " ".join(text for _, _, text in segments)
+        return text.strip(), latency
+
+    def transcribe_segments(self, audio_input, initial_prompt=None, model_type="batch", beam_size=5, vad_filter=None,
+                            policy=None):
+        """
+        Like transcribe, but keeps Whisper's segmentation.
+        Returns (list of (start, end, text) tuples, latency in ms).
         """
-        start_time = time.time()
+        start_time = time.perf_counter()
         
-        model = self.live_model if model_type == "live" else self.batch_model
+        model = self._model(model_type, policy)
         
         # Check if audio_input is a path (string) and verify existence
         if isinstance(audio_input, str) and not os.path.exists(audio_input):
              raise FileNotFoundError(f"Audio file not found: {audio_input}")
 
+        transcribe_options = self._transcribe_options(model_type, initial_prompt, beam_size, vad_filter, policy)
+        
+        segments, info = model.transcribe(
+            audio_input, 
+            **transcribe_options
+        )
+        
+        results = [(segment.start, segment.end, segment.text) for segment in segments]
+        
+        end_time = time.perf_counter()
+        latency = (end_time - start_time) * 1000 # ms
+        
+        return results, latency
+
+    def transcribe_long(self, audio, initial_prompt=None, model_type="batch", beam_size=5, policy=None, workers=None,
+                        batch_size=None, chunks=None):
+        """
+        Transcribes a long float32 recording as independent chunks split at pauses (see long_audio).
+        Chunks are decoded `workers` at a time (default: the model's num_workers, so concurrent
+        decodes each get a CTranslate2 replica); batch_size > 1 additionally decodes that many
+        chunks per batched call (chunk-level timestamps only). By default a single-worker model
+        batches LONG_AUDIO_BATCH_SIZE chunks and a multi-worker one decodes chunks one by one.
+        Segments are stitched back into one timeline with overlaps removed.
+        Returns (list of (start, end, text) tuples, latency in ms, number of chunks).
+        """
+        start_time = time.perf_counter()
+        chunks = chunks if chunks is not None else split_on_silence(audio)
+        workers = workers or self._handle(model_type, policy).num_workers
+        if batch_size is None:
+            batch_size = LONG_AUDIO_BATCH_SIZE if workers == 1 else 1
+
+        def decode(group):
+            clips = [audio[start:end] for start, end in group]
+            if batch_size > 1:
+                texts, _ = self.transcribe_batch(clips, initial_prompt=initial_prompt, model_type=model_type,
+                                                 beam_size=beam_size, policy=policy)
+                return [[(0.0, (end - start) / 16000, text)] if text else [] for (start, end), text in zip(group, texts)]
+            return [self.transcribe_segments(clip, initial_prompt, model_type, beam_size, policy=policy)[0]
+                    for clip in clips]
+
+        groups = [chunks[i:i + batch_size] for i in range(0, len(chunks), batch_size)]
+        if workers > 1 and len(groups) > 1:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="stt-chunk") as pool:
+                results = list(pool.map(decode, groups))
+        else:
+            results = [decode(group) for group in groups]
+
+        segments = stitch_segments(chunks, [segments for group in results for segments in group])
+        return segments, (time.perf_counter() - start_time) * 1000, len(chunks)
+
+    def cache_key(self, fingerprint, initial_prompt=None, model_type="batch", beam_size=5, vad_filter=None,
+                  policy=None):
+        """Transcript cache key: audio fingerprint plus the model and the decode options actually used."""
+        handle = self._handle(model_type, policy)
+        options = self._transcribe_options(model_type, initial_prompt, beam_size, vad_filter, policy)
+        return make_key(fingerprint, handle.key, options)
+
+    def stream(self, initial_prompt=None, max_buffer_seconds=15.0, vad_filter=None, capacity_seconds=30):
+        """Starts an incremental live decoding session (see StreamingTranscriber)."""
+        return StreamingTranscriber(self, initial_prompt=initial_prompt, max_buffer_seconds=max_buffer_seconds,
+                                    vad_filter=vad_filter, capacity_seconds=capacity_seconds)
+
+    def _transcribe_options(self, model_type, initial_prompt, beam_size, vad_filter=None, policy=None):
         # Tuning parameters
         transcribe_options = {
             "beam_size": beam_size,
@@ -44,47 +173,103 @@ class STTEngine:
             # Reduce beam size if it was default (5) to improve speed, unless specified otherwise
             if beam_size == 5:
                 transcribe_options["beam_size"] = 2 
-        
-        segments, info = model.transcribe(
-            audio_input, 
-            **transcribe_options
-        )
-        
-        text = ""
+        if vad_filter is not None:
+            # Callers that already gate audio with their own VAD can skip Whisper's
+            transcribe_options["vad_filter"] = vad_filter
+        if policy is not None:
+            transcribe_options.update(policy.options())
+        return transcribe_options
+
+    def transcribe_words(self, audio_input, initial_prompt=None, model_type="live", beam_size=5, vad_filter=None,
+                         policy=None):
+        """
+        Transcribes audio and returns word-level results as a list of (start, end, word) tuples,
+        times in seconds relative to the start of audio_input.
+        """
+        model = self._model(model_type, policy)
+        transcribe_options = self._transcribe_options(model_type, initial_prompt, beam_size, vad_filter, policy)
+        transcribe_options["word_timestamps"] = True
+        # Word times are what streaming commits on, so segment timestamps stay on whatever the policy says
+        transcribe_options["without_timestamps"] = False
+
+        segments, info = model.transcribe(audio_input, **transcribe_options)
+
+        words = []
         for segment in segments:
-            text += segment.text + " "
-        
-        end_time = time.time()
-        latency = (end_time - start_time) * 1000 # ms
-        
-        return text.strip(), latency
+            for word in segment.words or []:
+                words.append((word.start, word.end, word.word))
+        return words
+
+    def transcribe_batch(self, audio_arrays, initial_prompt=None, model_type="live", beam_size=5, no_speech_threshold=0.6,
+                         policy=None, vad_filter=None):
+        """
+        Transcribes several short float32 clips (<= 30 s each) in one batched encoder/decoder call.
+        The batched call never runs Whisper's VAD; vad_filter applies when clips take the regular path.
+        Returns (list of texts, latency in ms).
+        """
+        start_time = time.perf_counter()
+
+        if not audio_arrays:
+            return [], 0
+
+        model = self._model(model_type, policy)
+
+        # Batching pads every clip to one 30 s window, so longer clips take the regular path
+        if len(audio_arrays) == 1 or any(len(a) > WINDOW_SAMPLES for a in audio_arrays):
+            texts = [self.transcribe(a, initial_prompt=initial_prompt, model_type=model_type, beam_size=beam_size,
+                                     vad_filter=vad_filter, policy=policy)[0]
+                     for a in audio_arrays]
+            return texts, (time.perf_counter() - start_time) * 1000
 
-    def transcribe_generator(self, audio_input, initial_prompt=None, model_type="batch", beam_size=5):
+        features = []
+        for audio in audio_arrays:
+            mel = model.feature_extractor(audio)[:, :WINDOW_FRAMES]
+            if mel.shape[-1] < WINDOW_FRAMES:
+                mel = np.pad(mel, ((0, 0), (0, WINDOW_FRAMES - mel.shape[-1])))
+            features.append(mel)
+        features = np.ascontiguousarray(np.stack(features), dtype=np.float32)
+
+        from faster_whisper.tokenizer import Tokenizer
+        tokenizer = Tokenizer(model.hf_tokenizer, model.model.is_multilingual, task="transcribe", language="en")
+        previous_tokens = tokenizer.encode(" " + initial_prompt.strip()) if initial_prompt else []
+        prompt = model.get_prompt(tokenizer, previous_tokens, without_timestamps=True)
+
+        encoder_output = model.encode(features)
+        results = model.model.generate(
+            encoder_output,
+            [prompt] * len(audio_arrays),
+            beam_size=self._transcribe_options(model_type, initial_prompt, beam_size, policy=policy)["beam_size"],
+            repetition_penalty=1.1 if model_type == "live" else 1.0,
+            max_length=448,
+            suppress_blank=True,
+            suppress_tokens=list(tokenizer.non_speech_tokens),
+            return_no_speech_prob=True,
+        )
+
+        texts = []
+        for result in results:
+            # No Whisper VAD on this path, so drop windows the model itself flags as silence
+            if result.no_speech_prob > no_speech_threshold:
+                texts.append("")
+                continue
+            tokens = [t for t in result.sequences_ids[0] if t < tokenizer.eot]
+            texts.append(tokenizer.decode(tokens).strip())
+
+        latency = (time.perf_counter() - start_time) * 1000
+        return texts, latency
+
+    def transcribe_generator(self, audio_input, initial_prompt=None, model_type="batch", beam_size=5, policy=None,
+                             with_timestamps=False):
         """
-        Yields segments as they are transcribed.
+        Yields segments as they are transcribed: their text, or (start, end, text) tuples with with_timestamps.
         """
-        model = self.live_model if model_type == "live" else self.batch_model
+        model = self._model(model_type, policy)
         
         # Check if audio_input is a path (string) and verify existence
         if isinstance(audio_input, str) and not os.path.exists(audio_input):
              raise FileNotFoundError(f"Audio file not found: {audio_input}")
 
-        # Tuning parameters
-        transcribe_options = {
-            "beam_size": beam_size,
-            "initial_prompt": initial_prompt
-        }
-        
-        if model_type == "live":
-            transcribe_options["condition_on_previous_text"] = False
-            transcribe_options["repetition_penalty"] = 1.1
-            transcribe_options["temperature"] = 0.0
-            transcribe_options["vad_filter"] = True
-        else:
-            transcribe_options["vad_filter"] = True
-            transcribe_options["condition_on_previous_text"] = False
-            if beam_size == 5:
-                transcribe_options["beam_size"] = 2 
+        transcribe_options = self._transcribe_options(model_type, initial_prompt, beam_size, policy=policy)
         
         segments, info = model.transcribe(
             audio_input, 
@@ -92,7 +277,145 @@ class STTEngine:
         )
         
         for segment in segments:
-            yield segment.text
+            yield (segment.start, segment.end, segment.text) if with_timestamps else segment.text
+
+class StreamingTranscriber:
+    """
+    Incremental live decoding with LocalAgreement-2 commits.
+    Audio is appended as it arrives; every process_iter call re-decodes the current
+    window and commits the longest word prefix on which the last two hypotheses agree.
+    Audio covering committed words is trimmed from the window so each step stays bounded.
+    Audio lives in a preallocated AudioRingBuffer of capacity_seconds; process_iter calls
+    must not overlap (insert_audio may run concurrently with one).
+    policy (a DecodePolicy) may be swapped between utterances; it survives reset().
+    """
+    def __init__(self, engine, initial_prompt=None, max_buffer_seconds=15.0, sample_rate=16000, vad_filter=None,
+                 capacity_seconds=30):
+        self.engine = engine
+        self.initial_prompt = initial_prompt
+        self.vad_filter = vad_filter
+        self.policy = None
+        self.max_buffer_seconds = max_buffer_seconds
+        self.sample_rate = sample_rate
+        self.buffer = AudioRingBuffer(capacity_seconds=max(capacity_seconds, max_buffer_seconds), sample_rate=sample_rate)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Drops all audio and hypotheses, e.g. after an utterance has been finalized."""
+        with self._lock:
+            self.buffer.clear()
+            self._origin = self.buffer.start_sample   # absolute sample where this utterance began
+            self.committed = []        # (start, end, word), absolute times
+            self.hypothesis = []       # uncommitted words from the last decode
+            self.trimmed_words = 0     # committed words whose audio is no longer in the window
+            self.new_samples = 0
+
+    def insert_audio(self, audio):
+        """Appends PCM Int16 bytes, an int16 array or a float32 array."""
+        with self._lock:
+            self.new_samples += self.buffer.append(audio)
+
+    @property
+    def buffer_offset(self):
+        """Seconds of audio already trimmed from the front of the window."""
+        return (self.buffer.start_sample - self._origin) / self.sample_rate
+
+    def pending_seconds(self):
+        """Seconds of audio received since the last decode."""
+        return self.new_samples / self.sample_rate
+
+    def process_iter(self):
+        """
+        Runs one decode over the current window.
+        Returns (newly committed text, current uncommitted partial text).
+        """
+        with self._lock:
+            # Aliases the ring; appends only write past its end while we decode
+            audio = self.buffer.view()
+            offset = self.buffer_offset
+            prompt = self._prompt()
+            self.new_samples = 0
+
+        if len(audio) == 0:
+            return "", ""
+
+        words = self.engine.transcribe_words(audio, initial_prompt=prompt, model_type="live", vad_filter=self.vad_filter,
+                                             policy=self.policy)
+        words = [(start + offset, end + offset, word) for start, end, word in words]
+
+        with self._lock:
+            current = self._drop_committed(words)
+            agreed = 0
+            for prev, cur in zip(self.hypothesis, current):
+                if _normalize_word(prev[2]) != _normalize_word(cur[2]):
+                    break
+                agreed += 1
+
+            newly_committed = current[:agreed]
+            self.committed.extend(newly_committed)
+            self.hypothesis = current[agreed:]
+            self._trim()
+
+        return _join_words(newly_committed), _join_words(self.hypothesis)
+
+    def finish(self):
+        """Commits whatever is left of the last hypothesis and returns the whole utterance text."""
+        with self._lock:
+            self.committed.extend(self.hypothesis)
+            self.hypothesis = []
+            return _join_words(self.committed)
+
+    @property
+    def committed_text(self):
+        return _join_words(self.committed)
+
+    def _prompt(self):
+        # Committed text that is no longer in the audio window conditions the next decode
+        context = _join_words(self.committed[:self.trimmed_words])[-200:]
+        parts = [p for p in (self.initial_prompt, context) if p]
+        return " ".join(parts) or None
+
+    def _drop_committed(self, words):
+        """Removes words that re-decode audio already committed (timestamp and n-gram overlap)."""
+        if not self.committed:
+            return words
+
+        last_end = self.committed[-1][1]
+        words = [w for w in words if w[0] > last_end - 0.1]
+
+        # Word timestamps jitter, so also strip a leading n-gram repeating the committed tail
+        committed_tail = [_normalize_word(w[2]) for w in self.committed[-5:]]
+        for n in range(min(len(committed_tail), len(words)), 0, -1):
+            if committed_tail[-n:] == [_normalize_word(w[2]) for w in words[:n]]:
+                return words[n:]
+        return words
+
+    def _trim(self):
+        """Cuts the window at the end of the last committed sentence, or last committed word when too long."""
+        window_seconds = self.buffer.seconds
+        cut_index = None
+        for i in range(len(self.committed) - 1, self.trimmed_words - 1, -1):
+            if self.committed[i][2].strip().endswith((".", "?", "!")):
+                cut_index = i
+                break
+        if cut_index is None and window_seconds > self.max_buffer_seconds and len(self.committed) > self.trimmed_words:
+            cut_index = len(self.committed) - 1
+        if cut_index is None:
+            return
+
+        cut_time = self.committed[cut_index][1]
+        cut_samples = int((cut_time - self.buffer_offset) * self.sample_rate)
+        if cut_samples <= 0:
+            return
+        self.buffer.consume(cut_samples)
+        self.trimmed_words = cut_index + 1
+
+def _normalize_word(word):
+    return word.strip().lower().strip(".,?!")
+
+def _join_words(words):
+    return "".join(w[2] for w in words).strip()
 
 if __name__ == "__main__":
     # Simple test
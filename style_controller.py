@@ -1,27 +1,48 @@
 import re
+from rewrite_engine import RewriteEngine, render
+from result_cache import LRUCache
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
 
 class StyleController:
-    def __init__(self):
+    def __init__(self, cache=None):
         self.formal_replacements = {
-            r"\bcan't\b": "cannot",
-            r"\bwon't\b": "will not",
-            r"\bI'm\b": "I am",
-            r"\bit's\b": "it is",
-            r"\bgonna\b": "going to",
-            r"\bwanna\b": "want to",
-            r"\bgotta\b": "have to",
-            r"\bkids\b": "children",
-            r"\bthanks\b": "thank you",
-            r"\bhi\b": "hello",
-            r"\bguys\b": "everyone"
+            "can't": "cannot",
+            "won't": "will not",
+            "I'm": "I am",
+            "it's": "it is",
+            "gonna": "going to",
+            "wanna": "want to",
+            "gotta": "have to",
+            "kids": "children",
+            "thanks": "thank you",
+            "hi": "hello",
+            "guys": "everyone"
         }
         
         self.concise_removals = [
-            r"\breally\b", r"\bvery\b", r"\bjust\b", r"\bactually\b", 
-            r"\bbasically\b", r"\bliterally\b", r"\bquite\b", r"\bsomewhat\b"
+            "really", "very", "just", "actually", 
+            "basically", "literally", "quite", "somewhat"
         ]
 
+        # Each style's rules compile into one pattern applied in a single pass
+        self.formal_engine = RewriteEngine(self.formal_replacements)
+        self.concise_engine = RewriteEngine({word: "" for word in self.concise_removals})
+        # Union of every style's rules, used by apply_styles to scan the text once for all styles
+        self.shared_engine = RewriteEngine({**self.formal_engine.rules, **self.concise_engine.rules})
+        # Styled output keyed by (style, text)
+        self.cache = cache if cache is not None else LRUCache(maxsize=1024)
+
     def apply_style(self, text, style="Neutral"):
+        key = (style, text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        styled = self._style(text, style)
+        self.cache.set(key, styled)
+        return styled
+
+    def _style(self, text, style):
         if style == "Formal":
             return self._make_formal(text)
         elif style == "Casual":
@@ -31,10 +52,37 @@ class StyleController:
         else:
             return text
 
+    def apply_styles(self, text, styles):
+        """
+        Applies several styles to the same text and returns {style: styled text}.
+        The text is scanned once for the rules of all styles; each style is then
+        rendered from the shared match spans.
+        """
+        results = {}
+        missing = []
+        for style in styles:
+            if style and style not in results: # Ignore empty strings/None and repeats
+                results[style] = self.cache.get((style, text))
+                if results[style] is None:
+                    missing.append(style)
+
+        if missing:
+            spans = self.shared_engine.find(text)
+            for style in missing:
+                results[style] = self._render_style(text, spans, style)
+                self.cache.set((style, text), results[style])
+        return results
+
+    def _render_style(self, text, spans, style):
+        if style == "Formal":
+            return render(text, spans, self.formal_engine.rules)
+        elif style == "Concise":
+            return WHITESPACE_PATTERN.sub(" ", render(text, spans, self.concise_engine.rules)).strip()
+        else:
+            return text
+
     def _make_formal(self, text):
-        for pattern, replacement in self.formal_replacements.items():
-            text = re.sub(pattern, replacement, text, flags=re.IGNORECASE)
-        return text
+        return self.formal_engine.apply(text)
 
     def _make_casual(self, text):
         # For now, just return as is or maybe add some contractions if we had a reverse map
@@ -42,10 +90,9 @@ class StyleController:
         return text
 
     def _make_concise(self, text):
-        for word in self.concise_removals:
-            text = re.sub(word, "", text, flags=re.IGNORECASE)
+        text = self.concise_engine.apply(text)
         # Clean up double spaces
-        text = re.sub(r"\s+", " ", text).strip()
+        text = WHITESPACE_PATTERN.sub(" ", text).strip()
         return text
 
 if __name__ == "__main__":
@@ -7,8 +7,61 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from text_cleaner import TextCleaner
 from style_controller import StyleController
+from inference_scheduler import InferenceScheduler
+from executor import InferenceExecutor, ServerBusyError
+from stt_engine import STTEngine, StreamingTranscriber
+from vad import StreamingVAD
+from audio_buffer import AudioRingBuffer
+from audio_io import decode_wav_bytes, load_upload, audio_fingerprint
+import io
+import wave
+import time
+from staged_stream import Batch, Regroup, run_stages
+from model_registry import ModelRegistry
+from result_cache import LRUCache, SQLiteCache
+from metrics import StageMetrics, StageTimings
+import benchmark
+from grammar_corrector import GrammarCorrector
+from grammar_backends import load_backend
+from grammar_gate import GrammarGate
+from pipeline import EarlyGrammar, GATE_THRESHOLD
+from sentence_assembler import assemble_sentences
+from decode_policy import AdaptiveDecodePolicy, TEMPERATURE_FALLBACK
+from long_audio import split_on_silence, stitch_segments
+from job_queue import JobQueue, JobStore, JobTimings
+from worker_pool import WorkerPool, BATCH
+import signal
+import load_test
+import tempfile
+import numpy as np
+import threading
+import asyncio
 # GrammarCorrector requires loading model, might be slow for unit test, but let's try if installed
 
+class FakePipelineTestCase(unittest.TestCase):
+    """Shared fixture: the benchmark's stand-in pipeline (real pipeline code, no models) for each test."""
+    def setUp(self):
+        self.pipeline = benchmark.build_pipeline(fake=True)
+
+    def tearDown(self):
+        self.pipeline.executor.shutdown()
+
+    def count_grammar(self, gate=None):
+        """Swaps in a grammar corrector whose backend records its generate batches; returns the backend."""
+        backend = CountingBackend()
+        self.pipeline.grammar = GrammarCorrector(backend=backend, gate=gate)
+        return backend
+
+def speech_wav(seconds):
+    """Stand-in speech as 16-bit WAV bytes, like an upload."""
+    return wav_bytes((benchmark.synth_speech(seconds) * 32767).astype(np.int16))
+
+def fake_worker_pool(**options):
+    """WorkerPool of stand-in pipelines; options override the pool's settings."""
+    settings = {"workers": 1, "slots_per_worker": 1, "factory": benchmark.build_pipeline,
+                "factory_options": {"fake": True, "cost": 0.05}, "health_interval": 0.1}
+    return WorkerPool(**{**settings, **options})
+
 class TestModules(unittest.TestCase):
     def setUp(self):
         self.cleaner = TextCleaner()
@@ -24,6 +77,11 @@ class TestModules(unittest.TestCase):
         cleaned = self.cleaner.remove_repetitions(text)
         self.assertEqual(cleaned, "I want to go to the store.")
 
+    def test_cleaner_repetition_runs(self):
+        text = "I I I want to go to to the The the store."
+        cleaned = self.cleaner.remove_repetitions(text)
+        self.assertEqual(cleaned, "I want to go to the store.")
+
     def test_style_formal(self):
         text = "I can't go."
         styled = self.style.apply_style(text, "Formal")
@@ -34,5 +92,768 @@ class TestModules(unittest.TestCase):
         styled = self.style.apply_style(text, "Concise")
         self.assertEqual(styled, "I am happy.")
 
+    def test_apply_styles_matches_single_styles(self):
+        text = "I'm really gonna go, thanks guys."
+        styled = self.style.apply_styles(text, ["Formal", "Concise", "Neutral", None, "Formal"])
+        self.assertEqual(list(styled), ["Formal", "Concise", "Neutral"])
+        for style, result in styled.items():
+            self.assertEqual(result, self.style.apply_style(text, style))
+
+class FakeBatchPipeline:
+    def __init__(self):
+        self.batches = []
+        self.executor = InferenceExecutor(max_workers=1)
+
+    def process_audio_batch(self, audio_arrays, styles):
+        self.batches.append(len(audio_arrays))
+        return [f"{len(a)}:{s}" for a, s in zip(audio_arrays, styles)]
+
+class TestInferenceScheduler(unittest.TestCase):
+    def test_batches_concurrent_submissions(self):
+        pipeline = FakeBatchPipeline()
+        scheduler = InferenceScheduler(pipeline, max_batch_size=4, max_wait_ms=200)
+        futures = [scheduler.submit(np.zeros(i + 1, dtype=np.float32), "Formal") for i in range(3)]
+        scheduler.start()
+        results = [f.result(timeout=5) for f in futures]
+        scheduler.stop()
+        self.assertEqual(results, ["1:Formal", "2:Formal", "3:Formal"])
+        self.assertEqual(pipeline.batches, [3])
+
+    def test_batches_wait_for_a_model_slot(self):
+        pipeline = FakeBatchPipeline()
+        scheduler = InferenceScheduler(pipeline, max_wait_ms=10)
+        scheduler.start()
+        with pipeline.executor.model_slot():
+            future = scheduler.submit(np.zeros(4, dtype=np.float32))
+            time.sleep(0.2)
+            self.assertFalse(future.done())
+        self.assertEqual(future.result(timeout=5), "4:Neutral")
+        scheduler.stop()
+        pipeline.executor.shutdown()
+
+class TestInferenceExecutor(unittest.TestCase):
+    def test_rejects_when_queue_full(self):
+        executor = InferenceExecutor(max_workers=1, max_queue=1)
+        gate = threading.Event()
+        running = executor.submit(gate.wait)
+        queued = executor.submit(lambda: "queued")
+        with self.assertRaises(ServerBusyError):
+            executor.submit(lambda: "rejected")
+        gate.set()
+        self.assertTrue(running.result(timeout=5))
+        self.assertEqual(queued.result(timeout=5), "queued")
+        executor.shutdown()
+        self.assertEqual(executor.pending, 0)
+
+    def test_stream_stages_share_model_slots(self):
+        executor = InferenceExecutor(max_workers=1)
+        with executor.model_slot():
+            # A stage thread holds the only slot, so pool jobs wait for it
+            job = executor.submit(lambda: "ran")
+            time.sleep(0.1)
+            self.assertFalse(job.done())
+        self.assertEqual(job.result(timeout=5), "ran")
+
+        # Streams are driven outside the pool, so their own model_slot() calls cannot deadlock
+        def stream():
+            for i in range(3):
+                with executor.model_slot():
+                    yield i
+
+        async def collect():
+            return [item async for item in executor.iterate(stream())]
+        self.assertEqual(asyncio.run(collect()), [0, 1, 2])
+        self.assertEqual(executor.pending, 0)
+        executor.shutdown()
+
+class FakeWordEngine:
+    """Returns scripted word hypotheses, one list per decode call."""
+    def __init__(self, hypotheses):
+        self.hypotheses = list(hypotheses)
+        self.audio_lengths = []
+
+    def transcribe_words(self, audio, initial_prompt=None, model_type="live", vad_filter=None, policy=None):
+        self.audio_lengths.append(len(audio))
+        return self.hypotheses.pop(0)
+
+class TestStreamingTranscriber(unittest.TestCase):
+    def test_commits_agreed_prefix_and_trims_audio(self):
+        engine = FakeWordEngine([
+            [(0.0, 0.4, " Hello"), (0.5, 0.9, " word")],
+            [(0.0, 0.4, " Hello"), (0.5, 0.9, " world."), (1.0, 1.4, " Next")],
+            [(0.0, 0.4, " Hello"), (0.5, 0.9, " world."), (1.0, 1.4, " Next")],
+        ])
+        stream = StreamingTranscriber(engine)
+
+        stream.insert_audio(np.zeros(16000, dtype=np.float32))
+        self.assertEqual(stream.process_iter(), ("", "Hello word"))
+
+        stream.insert_audio(np.zeros(16000, dtype=np.float32))
+        self.assertEqual(stream.process_iter(), ("Hello", "world. Next"))
+
+        stream.insert_audio(np.zeros(8000, dtype=np.float32))
+        committed, partial = stream.process_iter()
+        self.assertEqual(committed, "world. Next")
+        self.assertEqual(partial, "")
+        # Window was cut at the end of the committed sentence ("world." ends at 0.9 s)
+        self.assertEqual(stream.buffer_offset, 0.9)
+        self.assertEqual(stream.finish(), "Hello world. Next")
+
+def voiced_tone(seconds, sample_rate=16000):
+    """Harmonic-rich tone: loud and spectrally peaked like voiced speech."""
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    return (0.1 * sum(np.sin(2 * np.pi * 150 * k * t) / k for k in range(1, 8))).astype(np.float32)
+
+def white_noise(seconds, level, sample_rate=16000):
+    rng = np.random.default_rng(0)
+    return (rng.standard_normal(int(sample_rate * seconds)) * level).astype(np.float32)
+
+class TestStreamingVAD(unittest.TestCase):
+    def feed(self, vad, audio, chunk=1365):
+        events = []
+        speech = 0
+        for i in range(0, len(audio), chunk):
+            result = vad.process(audio[i:i + chunk])
+            speech += len(result.speech)
+            if result.speech_started:
+                events.append("start")
+            if result.speech_ended:
+                events.append("end")
+        return events, speech / 16000
+
+    def test_detects_utterance_and_drops_silence(self):
+        vad = StreamingVAD(end_ms=500, pre_padding_ms=300)
+        audio = np.concatenate([white_noise(1, 0.003), voiced_tone(1) + white_noise(1, 0.003), white_noise(1, 0.003)])
+        events, speech_seconds = self.feed(vad, audio)
+        self.assertEqual(events, ["start", "end"])
+        # 1 s of speech plus pre-roll and the trailing end-of-speech window
+        self.assertTrue(1.0 <= speech_seconds <= 2.0)
+        self.assertEqual(vad.stats()["utterances"], 1)
+
+    def test_ignores_loud_noise(self):
+        vad = StreamingVAD()
+        events, speech_seconds = self.feed(vad, white_noise(2, 0.1))
+        self.assertEqual(events, [])
+        self.assertEqual(speech_seconds, 0)
+
+class TestAudioRingBuffer(unittest.TestCase):
+    def test_converts_pcm_and_wraps_around(self):
+        buf = AudioRingBuffer(capacity_seconds=1, sample_rate=4)
+        buf.append(np.array([16384, -16384, 0], dtype=np.int16).tobytes())
+        buf.consume(2)
+        buf.append(np.array([0.25, 0.75, 1.0], dtype=np.float32))
+        np.testing.assert_array_equal(buf.view(), [0.0, 0.25, 0.75, 1.0])
+        self.assertEqual(buf.start_sample, 2)
+
+    def test_overflow_drops_oldest(self):
+        buf = AudioRingBuffer(capacity_seconds=1, sample_rate=4)
+        buf.append(np.arange(6, dtype=np.float32))
+        np.testing.assert_array_equal(buf.view(), [2, 3, 4, 5])
+        self.assertEqual(buf.start_sample, 2)
+        buf.append(np.array([6], dtype=np.float32))
+        np.testing.assert_array_equal(buf.view(), [3, 4, 5, 6])
+        self.assertEqual(buf.start_sample, 3)
+
+def wav_bytes(samples, channels=1, sample_rate=16000):
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(np.asarray(samples, dtype=np.int16).tobytes())
+    return out.getvalue()
+
+class TestAudioIO(unittest.TestCase):
+    def test_wav_fast_path_downmixes_stereo(self):
+        audio = decode_wav_bytes(wav_bytes([16384, 0, -16384, -16384], channels=2))
+        self.assertEqual(audio.dtype, np.float32)
+        np.testing.assert_array_equal(audio, [0.25, -0.5])
+
+    def test_non_16k_wav_needs_general_decoder(self):
+        self.assertIsNone(decode_wav_bytes(wav_bytes([0, 0], sample_rate=44100)))
+
+    def test_load_upload_from_memory(self):
+        audio = load_upload(io.BytesIO(wav_bytes([0] * 1600)))
+        self.assertEqual(len(audio), 1600)
+
+    def test_fingerprint_follows_content(self):
+        audio = decode_wav_bytes(wav_bytes([0, 1000, -1000, 0]))
+        self.assertEqual(audio_fingerprint(audio), audio_fingerprint(audio.copy()))
+        self.assertNotEqual(audio_fingerprint(audio), audio_fingerprint(audio[:2]))
+
+class TestStagedStream(unittest.TestCase):
+    def test_stages_overlap_and_keep_order(self):
+        def slow(delay):
+            def stage(x):
+                time.sleep(delay)
+                return x
+            return stage
+
+        def source():
+            for i in range(5):
+                time.sleep(0.05)
+                yield i
+
+        start = time.time()
+        results = list(run_stages(source(), [slow(0.05), lambda x: x * 10]))
+        elapsed = time.time() - start
+        self.assertEqual(results, [0, 10, 20, 30, 40])
+        # Sequential would take ~0.5 s; overlapped is ~0.3 s
+        self.assertLess(elapsed, 0.45)
+
+    def test_propagates_stage_errors(self):
+        def fail(x):
+            raise ValueError("boom")
+        with self.assertRaises(ValueError):
+            list(run_stages(iter([1, 2]), [fail]))
+        with self.assertRaises(ValueError):
+            list(run_stages(iter([1, 2]), [Batch(lambda items: [fail(x) for x in items])]))
+
+    def test_batch_stage_takes_waiting_items_in_order(self):
+        batches = []
+        def square(items):
+            batches.append(len(items))
+            # Slow enough that the rest of the source queues up behind the first item
+            time.sleep(0.1)
+            return [x * x for x in items]
+
+        results = list(run_stages(iter(range(5)), [Batch(square), lambda x: x + 1], maxsize=8))
+        self.assertEqual(results, [1, 2, 5, 10, 17])
+        self.assertEqual(sum(batches), 5)
+        self.assertLess(len(batches), 5)
+
+class TestModelRegistry(unittest.TestCase):
+    def test_shares_identical_models_and_loads_lazily(self):
+        loads = []
+        def loader(size, device, compute_type, num_workers):
+            loads.append((size, num_workers))
+            return object()
+
+        registry = ModelRegistry(loader=loader, evict_unused=True)
+        batch = registry.acquire("base.en", num_workers=1)
+        live = registry.acquire("base.en", num_workers=2)
+        self.assertEqual(loads, [])
+
+        self.assertIs(batch.get(), live.get())
+        self.assertEqual(loads, [("base.en", 3)])
+
+        batch.release()
+        live.release()
+        self.assertEqual(registry.stats(), {})
+
+class CountingBackend(benchmark.FakeGrammarBackend):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def generate(self, inputs, settings):
+        self.batches.append(len(inputs))
+        return super().generate(inputs, settings)
+
+class TruncatingBackend(benchmark.FakeGrammarBackend):
+    """Cuts each output to settings.max_length tokens (words here), as T5 generation does."""
+    def generate(self, inputs, settings):
+        return [" ".join(text.split()[:settings.max_length]) for text in super().generate(inputs, settings)]
+
+class TestGrammarCorrector(unittest.TestCase):
+    def test_pluggable_backend_with_cache(self):
+        backend = CountingBackend()
+        gc = GrammarCorrector(backend=backend, max_batch_size=2)
+        text, _ = gc.correct("first one. second one. third one.")
+        self.assertEqual(text, "First one. Second one. Third one.")
+        self.assertEqual(backend.batches, [2, 1])
+
+        # Repeated sentences come from the cache
+        texts, _ = gc.correct_batch(["second one.", "fourth one."])
+        self.assertEqual(texts, ["Second one.", "Fourth one."])
+        self.assertEqual(backend.batches, [2, 1, 1])
+
+    def test_batches_keep_input_order(self):
+        backend = CountingBackend()
+        gc = GrammarCorrector(backend=backend, max_batch_size=2)
+        # Length-sorted, the long first sentence lands in the last batch
+        text, _ = gc.correct("this first sentence is the longest one. short one. a b c.")
+        self.assertEqual(text, "This first sentence is the longest one. Short one. A b c.")
+        self.assertEqual(backend.batches, [2, 1])
+
+        self.assertEqual(gc.correct("  "), ("", 0))
+        self.assertEqual(gc.correct("no final stop")[0], "No final stop")
+        texts, _ = gc.correct_batch(["", "two words. then three more.", "single."])
+        self.assertEqual(texts, ["", "Two words. Then three more.", "Single."])
+        self.assertEqual(gc.correct_sentences([]), [])
+
+    def test_long_sentences_are_not_cut_off(self):
+        gc = GrammarCorrector(backend=TruncatingBackend())
+        for words in (30, 80):
+            sentence = " ".join(f"word{i}" for i in range(words)) + "."
+            text, _ = gc.correct(sentence)
+            self.assertEqual(text, sentence[:1].upper() + sentence[1:])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            load_backend("onnx", "vennify/t5-base-grammar-correction")
+
+class TestGrammarGate(unittest.TestCase):
+    def test_scores(self):
+        gate = GrammarGate(threshold=0.5)
+        self.assertTrue(gate.needs_correction("I goes to the store yesterday."))
+        self.assertTrue(gate.needs_correction("We was going to the the park."))
+        self.assertTrue(gate.needs_correction("so i think we should leave"))
+        self.assertFalse(gate.needs_correction("The meeting starts at three."))
+        self.assertFalse(gate.needs_correction("sounds good"))
+        self.assertEqual(gate.stats()["skipped"], 2)
+        self.assertEqual(gate.light_fix("sounds good i guess"), "Sounds good I guess")
+
+    def test_corrector_skips_clean_sentences(self):
+        backend = CountingBackend()
+        gc = GrammarCorrector(backend=backend, gate=GrammarGate(threshold=0.5))
+        text, _ = gc.correct("ok. I goes home. The report is ready.")
+        self.assertEqual(text, "Ok. I goes home. The report is ready.")
+        # Only "I goes home." reached the model
+        self.assertEqual(backend.batches, [1])
+
+    def test_default_threshold_corrects_everything(self):
+        backend = CountingBackend()
+        gc = GrammarCorrector(backend=backend, gate=GrammarGate(threshold=GATE_THRESHOLD))
+        # Capitalised and punctuated; the second matches none of the gate's error patterns either
+        text, _ = gc.correct("She don't like it. Me and him goes to work.")
+        self.assertEqual(backend.batches, [2])
+        self.assertEqual(gc.gate.stats()["skipped"], 0)
+
+    def test_fragments_skip_t5_at_the_default_threshold(self):
+        backend = CountingBackend()
+        gc = GrammarCorrector(backend=backend, gate=GrammarGate(threshold=GATE_THRESHOLD))
+        text, _ = gc.correct("okay. sounds good. i goes.")
+        self.assertEqual(text, "Okay. Sounds good. I goes.")
+        # Only the fragment with a known error reached the model
+        self.assertEqual(backend.batches, [1])
+        self.assertEqual(gc.gate.stats()["skipped"], 2)
+        self.assertTrue(GrammarGate(threshold=GATE_THRESHOLD, max_fragment_words=0).needs_correction("okay."))
+
+class TestSentenceAssembler(unittest.TestCase):
+    def test_merges_fragments_and_carries_tails(self):
+        segments = [
+            (0.0, 2.0, " so I goes to the"),
+            (2.0, 4.0, " store yesterday. And then"),
+            (4.0, 6.0, " we left!"),
+        ]
+        self.assertEqual(list(assemble_sentences(segments)), [
+            ("so I goes to the store yesterday.", [(0.0, 2.0), (2.0, 4.0)]),
+            ("And then we left!", [(2.0, 4.0), (4.0, 6.0)]),
+        ])
+
+    def test_flushes_unfinished_text(self):
+        def segments():
+            yield (0.0, 1.0, "first part")
+            yield (1.0, 2.0, "second part")
+            # The next segment is slow to decode: the text so far goes out without waiting for it
+            time.sleep(0.5)
+            yield (2.0, 3.0, "trailing words")
+        started = time.perf_counter()
+        items = run_stages(segments(), [Regroup(lambda items: assemble_sentences(items, max_wait_seconds=0.1))])
+        self.assertEqual(next(items)[0], "first part second part")
+        self.assertLess(time.perf_counter() - started, 0.4)
+        self.assertEqual([text for text, _ in items], ["trailing words"])
+
+    def test_source_errors_reach_the_consumer(self):
+        def segments():
+            yield (0.0, 1.0, "done.")
+            raise ValueError("decode failed")
+        items = run_stages(segments(), [Regroup(assemble_sentences)])
+        self.assertEqual(next(items)[0], "done.")
+        with self.assertRaises(ValueError):
+            next(items)
+
+class TestProcessStream(FakePipelineTestCase):
+    def test_process_stream_reports_source_times(self):
+        items = list(self.pipeline.process_stream(benchmark.synth_speech(10)))
+        self.assertEqual(items[0]["start"], 0.0)
+        self.assertEqual(items[-1]["end"], 10.0)
+        self.assertTrue(all(item["segments"] for item in items))
+
+    def test_process_stream_batches_waiting_sentences(self):
+        backend = self.count_grammar()
+        generate = backend.generate
+        def slow_generate(inputs, settings):
+            time.sleep(0.1)
+            return generate(inputs, settings)
+        backend.generate = slow_generate
+
+        items = list(self.pipeline.process_stream(benchmark.synth_speech(20)))
+        sentences = benchmark.reference_sentences(20)
+        self.assertEqual([item["raw"] for item in items], sentences)
+        # Same text as correcting each sentence on its own, in order
+        expected = [self.pipeline._apply_styles(self.pipeline.grammar.correct(self.pipeline.cleaner.clean(s))[0], "Neutral")
+                    for s in sentences]
+        self.assertEqual([item["final"] for item in items], expected)
+        self.assertEqual(sum(backend.batches), len(sentences))
+        self.assertLess(len(backend.batches), len(sentences))
+
+class TestEarlyGrammar(FakePipelineTestCase):
+    def test_final_pass_only_corrects_the_tail(self):
+        backend = self.count_grammar(gate=GrammarGate(threshold=0.5))
+        early = EarlyGrammar(self.pipeline)
+
+        # The open last sentence waits; complete ones are corrected while speech continues
+        sentences = early.pending("I goes home. We was late. and then")
+        self.assertEqual(sentences, ["I goes home.", "We was late."])
+        early.correct(sentences)
+        self.assertEqual(early.pending("I goes home. We was late. and then we"), [])
+        self.assertEqual(early.pending("I goes home. We was late. and then we was gone."), ["and then we was gone."])
+
+        backend.batches.clear()
+        final = self.pipeline.process_text("I goes home. We was late. and then we was gone!")
+        self.assertEqual(final, "I goes home. We was late. And then we was gone!")
+        self.assertEqual(backend.batches, [1])
+        # Early corrections stay out of the gate's counters
+        self.assertEqual(self.pipeline.grammar.gate.stats()["checked"], 3)
+
+class TestDecodePolicy(unittest.TestCase):
+    def test_selection_follows_load(self):
+        load = [0.0]
+        policy = AdaptiveDecodePolicy(models=("tiny.en", "base.en", "small.en"), upgrade_when_idle=True)
+        policy.add_load_source(lambda: load[0])
+
+        idle = policy.select("batch", audio_seconds=30)
+        self.assertEqual((idle.level, idle.model_size, idle.beam_size), ("idle", "small.en", 5))
+        self.assertEqual(idle.temperature, TEMPERATURE_FALLBACK)
+        # Long recordings and unknown lengths (file paths) are not upgraded
+        self.assertIsNone(policy.select("batch", audio_seconds=600).model_size)
+        self.assertIsNone(policy.select("batch").model_size)
+
+        load[0] = 0.5
+        normal = policy.select("batch")
+        self.assertEqual((normal.level, normal.model_size, normal.beam_size), ("normal", None, 2))
+        self.assertEqual(policy.select("live").options(),
+                         {"beam_size": 5, "temperature": 0.0, "without_timestamps": False})
+
+        load[0] = 0.95
+        overloaded = policy.select("batch")
+        self.assertEqual((overloaded.model_size, overloaded.beam_size), ("tiny.en", 1))
+        self.assertTrue(overloaded.as_dict()["without_timestamps"])
+
+    def test_disallowed_models_and_fixed_mode(self):
+        policy = AdaptiveDecodePolicy(models=("base.en",))
+        self.assertIsNone(policy.select("batch", audio_seconds=10).model_size)
+
+        fixed = AdaptiveDecodePolicy(adaptive=False)
+        fixed.add_load_source(lambda: 1.0)
+        self.assertEqual(fixed.select("live").level, "normal")
+        self.assertEqual(fixed.selectable_models(), [])
+
+    def test_idle_keeps_baseline(self):
+        policy = AdaptiveDecodePolicy()
+        idle = policy.select("batch", audio_seconds=10)
+        self.assertEqual((idle.level, idle.model_size, idle.beam_size), ("idle", None, 2))
+        self.assertEqual(policy.selectable_models(), ["tiny.en"])
+
+class TestDecodeWarmup(FakePipelineTestCase):
+    def test_warmup_loads_every_choice(self):
+        self.pipeline.decode_policy = AdaptiveDecodePolicy(upgrade_when_idle=True)
+        self.pipeline.warmup()
+        loaded = {key for key, entry in self.pipeline.stt.registry.stats().items() if entry["loaded"]}
+        self.assertEqual(loaded, {"base.en/cpu/int8", "tiny.en/cpu/int8", "small.en/cpu/int8"})
+
+class TestLongAudio(unittest.TestCase):
+    def tone(self, seconds):
+        return (0.5 * np.sin(2 * np.pi * 200 * np.arange(int(seconds * 16000)) / 16000)).astype(np.float32)
+
+    def test_splits_at_pauses_and_hard_cuts_with_overlap(self):
+        silence = np.zeros(16000, dtype=np.float32)
+        audio = np.concatenate([self.tone(20), silence, self.tone(20), silence, silence])
+        chunks = split_on_silence(audio)
+        # Cut in the middle of the pause; the trailing silence-only chunk is dropped
+        self.assertEqual(len(chunks), 2)
+        self.assertAlmostEqual(chunks[0][1] / 16000, 20.5, delta=0.1)
+        self.assertEqual(chunks[1][0], chunks[0][1])
+
+        chunks = split_on_silence(self.tone(45))
+        self.assertEqual(chunks, [(0, 30 * 16000), (29 * 16000, 45 * 16000)])
+
+    def test_stitch_removes_overlap(self):
+        chunks = [(0, 30 * 16000), (29 * 16000, 45 * 16000)]
+        segments = stitch_segments(chunks, [
+            [(0.0, 10.0, " We shipped the build"), (10.0, 30.0, " and then the tests ran overnight")],
+            [(0.0, 0.8, " overnight"), (0.0, 5.0, " the tests ran overnight without failures.")],
+        ])
+        self.assertEqual([text for _, _, text in segments],
+                         [" We shipped the build", " and then the tests ran overnight", "without failures."])
+        self.assertEqual(segments[2][:2], (29.0, 34.0))
+
+class TestChunkedDecoding(FakePipelineTestCase):
+    def test_engine_decodes_chunks_in_parallel(self):
+        audio = benchmark.synth_speech(90)
+        segments, _, chunks = self.pipeline.stt.transcribe_long(audio)
+        self.assertGreater(chunks, 2)
+        starts = [start for start, _, _ in segments]
+        self.assertEqual(starts, sorted(starts))
+        self.assertLessEqual(segments[-1][1], 90.0)
+        _, _, log, _ = self.pipeline.process(audio)
+        self.assertEqual(log["STT Chunks"], chunks)
+
+class TestJobStore(unittest.TestCase):
+    def test_priority_order_and_restart_recovery(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = JobStore(tmp)
+            low = store.create(io.BytesIO(b"a"), priority=0)
+            high = store.create(io.BytesIO(b"b"), priority=5)
+            self.assertEqual(store.claim()["id"], high)
+            store.close()
+
+            # A new queue re-queues the job left running by the previous process
+            queue = JobQueue(JobStore(tmp))
+            self.assertEqual(queue.get(low)["queue_position"], 1)
+            self.assertEqual(queue.store.counts()["queued"], 2)
+            queue.store.close()
+
+class TestJobQueue(FakePipelineTestCase):
+    def test_finished_jobs_expire(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = JobQueue(JobStore(tmp), workers=0, retention_seconds=0)
+            done = queue.store.create(io.BytesIO(b"a"))
+            waiting = queue.store.create(io.BytesIO(b"b"))
+            queue.store.claim()
+            queue.store.finish(done, result={"final_text": "ok"})
+            time.sleep(0.01)
+            # The sweeper runs as soon as the queue starts; queued jobs are never expired
+            queue.start(self.pipeline)
+            queue.stop()
+            self.assertIsNone(queue.get(done))
+            self.assertEqual(queue.get(waiting)["status"], "queued")
+            queue.store.close()
+
+    def test_workers_run_jobs_to_completion(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = JobQueue(JobStore(tmp), workers=2, poll_interval=0.05)
+            ok = queue.submit(io.BytesIO(speech_wav(3)), "Formal")
+            bad = queue.submit(io.BytesIO(b"not audio"))
+            queue.start(self.pipeline)
+            deadline = time.time() + 10
+            while queue.store.counts()["queued"] + queue.store.counts()["running"] and time.time() < deadline:
+                time.sleep(0.02)
+            queue.stop()
+
+            job = queue.get(ok)
+            self.assertEqual((job["status"], job["progress"]), ("done", 1.0))
+            self.assertTrue(job["result"]["final_text"])
+            self.assertIn("stt", job["result"]["timings"])
+            self.assertEqual(queue.get(bad)["status"], "failed")
+            self.assertEqual(os.listdir(queue.store.audio_dir), [])
+            queue.store.close()
+
+    def test_jobs_take_executor_model_slots(self):
+        executor = self.pipeline.executor
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = JobQueue(JobStore(tmp), workers=1, poll_interval=0.05)
+            job_id = queue.submit(io.BytesIO(speech_wav(1)))
+            with executor.model_slot(), executor.model_slot():
+                queue.start(self.pipeline, executor=executor)
+                time.sleep(0.3)
+                # Admitted by the executor, but waiting for a model slot
+                self.assertEqual(queue.get(job_id)["stage"], "decode")
+                self.assertEqual(executor.pending, 1)
+            deadline = time.time() + 10
+            while queue.get(job_id)["status"] != "done" and time.time() < deadline:
+                time.sleep(0.02)
+            queue.stop()
+            self.assertEqual(queue.get(job_id)["status"], "done")
+            queue.store.close()
+
+    def test_errors_without_a_message_fail_the_job(self):
+        def process(*args):
+            raise RuntimeError()
+        self.pipeline.process = process
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = JobQueue(JobStore(tmp), workers=1, poll_interval=0.05)
+            job_id = queue.submit(io.BytesIO(speech_wav(1)))
+            queue.start(self.pipeline)
+            deadline = time.time() + 10
+            while queue.get(job_id)["status"] in ("queued", "running") and time.time() < deadline:
+                time.sleep(0.02)
+            queue.stop()
+
+            job = queue.get(job_id)
+            self.assertEqual((job["status"], job["error"], job["result"]), ("failed", "RuntimeError", None))
+            queue.store.close()
+
+class TestWorkerPool(unittest.TestCase):
+    def test_dispatch_and_restart(self):
+        pool = fake_worker_pool()
+        pool.start(timeout=60)
+        try:
+            timings = StageTimings(StageMetrics())
+            self.assertEqual(pool.process_live(benchmark.synth_speech(2), "Neutral", timings),
+                             "Um so I goes to the store yesterday and and bought some milk.")
+            self.assertIn("grammar", timings.as_dict())
+
+            # Longer than a slot: handed over in its own shared memory block
+            raw_text, _, _, _ = pool.submit(benchmark.synth_speech(31), op=BATCH).result()
+            self.assertTrue(raw_text)
+
+            pending = pool.submit(benchmark.synth_speech(20))
+            with self.assertRaises(ServerBusyError):
+                pool.submit(benchmark.synth_speech(1))
+            os.kill(pool.stats()[0]["pid"], signal.SIGKILL)
+            with self.assertRaises(RuntimeError):
+                pending.result(timeout=10)
+
+            deadline = time.time() + 30
+            while not pool.stats()[0]["ready"] and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(pool.stats()[0]["restarts"], 1)
+            self.assertTrue(pool.process_live(benchmark.synth_speech(1)))
+        finally:
+            pool.stop()
+
+    def test_batch_jobs_wait_for_a_slot_and_report_stages(self):
+        pool = fake_worker_pool()
+        pool.start(timeout=60)
+        try:
+            live = pool.submit(benchmark.synth_speech(20))
+            stages = []
+            # The only slot is taken by live traffic: the job waits for it instead of failing
+            raw_text, _, _, _ = pool.process(benchmark.synth_speech(2), "Neutral", JobTimings(stages.append))
+            self.assertTrue(live.done())
+            self.assertTrue(raw_text)
+            self.assertEqual(stages, ["stt", "cleaning", "grammar", "style"])
+        finally:
+            pool.stop()
+
+    def test_startup_fails_when_a_pipeline_cannot_be_built(self):
+        pool = fake_worker_pool(factory_options={"fake": True, "no_such_option": 1})
+        with self.assertRaises(RuntimeError) as raised:
+            pool.start(timeout=60)
+        self.assertIn("no_such_option", str(raised.exception))
+        self.assertEqual(pool.stats()[0]["restarts"], 0)
+
+class TestResultCache(unittest.TestCase):
+    def test_lru_eviction_and_counters(self):
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)  # evicts "b", the least recently used
+        self.assertIsNone(cache.get("b"))
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 1, 2))
+
+    def test_persistent_tier_survives_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.sqlite3")
+            first = LRUCache(maxsize=4, persistent=SQLiteCache(path))
+            first.set("key", "I went to the store.")
+            first.persistent.close()
+
+            second = LRUCache(maxsize=4, persistent=SQLiteCache(path))
+            self.assertEqual(second.get("key"), "I went to the store.")
+            self.assertEqual(second.stats()["hits"], 1)
+            second.persistent.close()
+
+class TestMetrics(unittest.TestCase):
+    def test_percentiles(self):
+        metrics = StageMetrics()
+        for ms in range(1, 101):
+            metrics.observe("stt", float(ms))
+        stats = metrics.summary()["stt"]
+        self.assertEqual((stats["p50_ms"], stats["p95_ms"], stats["p99_ms"]), (50.0, 95.0, 99.0))
+        self.assertEqual(stats["count"], 100)
+        self.assertIn('stage="stt",quantile="0.95"} 95.0', metrics.render_prometheus())
+
+    def test_request_timings_feed_shared_metrics(self):
+        metrics = StageMetrics()
+        timings = StageTimings(metrics)
+        for _ in range(2):
+            with timings.stage("grammar"):
+                time.sleep(0.01)
+        self.assertGreaterEqual(timings.as_dict()["grammar"], 20)
+        self.assertEqual(metrics.summary()["grammar"]["count"], 2)
+
+class TestPipelineTimings(FakePipelineTestCase):
+    def test_stage_names_measure_one_thing(self):
+        timings = StageTimings(StageMetrics())
+        list(self.pipeline.process_stream(benchmark.synth_speech(5), "Neutral", timings))
+        # Per-segment decodes are kept apart from whole-request STT
+        self.assertIn("stt_segment", timings.as_dict())
+        self.assertNotIn("stt", timings.as_dict())
+
+        timings = StageTimings(StageMetrics())
+        self.pipeline.process_text("so I goes home.", "Neutral", timings)
+        self.assertEqual(set(timings.as_dict()), {"grammar", "style"})
+
+class RecordingWhisperModel(benchmark.FakeWhisperModel):
+    """Stand-in Whisper model that keeps the options of every transcribe call."""
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def transcribe(self, audio, **options):
+        self.calls.append(options)
+        return super().transcribe(audio, **options)
+
+class TestUtteranceVAD(FakePipelineTestCase):
+    def test_gated_utterances_skip_whisper_vad(self):
+        model = RecordingWhisperModel()
+        self.pipeline.stt = STTEngine(registry=ModelRegistry(loader=lambda *args: model))
+        speech = benchmark.synth_speech(2)
+
+        # A one-utterance batch takes the regular transcribe path
+        self.pipeline.process_audio_batch([speech], ["Neutral"])
+        self.pipeline.process_live(speech, vad_filter=False)
+        self.assertEqual([call["vad_filter"] for call in model.calls], [False, False])
+
+        # Raw PCM uploads have not been through StreamingVAD
+        self.pipeline.process_bytes((speech * 32767).astype(np.int16).tobytes())
+        self.assertTrue(model.calls[-1]["vad_filter"])
+
+class TestTranscriptCache(FakePipelineTestCase):
+    def test_restyling_the_same_audio_reuses_the_transcript(self):
+        model = RecordingWhisperModel()
+        self.pipeline.stt = STTEngine(registry=ModelRegistry(loader=lambda *args: model))
+        speech = benchmark.synth_speech(3)
+
+        raw, _, log, _ = self.pipeline.process(speech, "Neutral")
+        self.assertEqual(log["Transcript Cache"], "miss")
+        # A copy of the same samples still hits: the key is the audio content, not the array
+        raw_again, _, log, _ = self.pipeline.process(speech.copy(), "Formal")
+        self.assertEqual(log["Transcript Cache"], "hit")
+        self.assertEqual(raw_again, raw)
+        self.assertEqual(len(model.calls), 1)
+
+class TestBenchmark(unittest.TestCase):
+    def test_fake_run_covers_every_entry_point(self):
+        report = benchmark.run_benchmarks(fake=True, repeats=1, lengths=[1, 2])
+        self.assertEqual(set(report["results"]), {
+            "stt.live", "stt.batch", "stt.long", "cleaner", "grammar", "style", "style.multi",
+            "process", "process_bytes", "process_stream",
+        })
+        # One warm call per clip, and one per clip and style for "style"
+        for name, result in report["results"].items():
+            self.assertEqual(result["calls"], 8 if name == "style" else 2)
+        self.assertIn("first_segment_ms", report["results"]["process_stream"])
+        self.assertEqual(list(report["results"]), list(benchmark.BENCHMARK_NAMES))
+        # Memory is reported against each benchmark's own starting point
+        for result in report["results"].values():
+            self.assertGreaterEqual(result["peak_rss_mb"], result["baseline_rss_mb"])
+        self.assertEqual(set(report["grammar_gate"]), set(benchmark.BENCHMARK_NAMES))
+
+class TestLoadTest(unittest.TestCase):
+    def test_summary_counts_outcomes_and_latencies(self):
+        recording = load_test.Recording("clip", np.zeros(16000, dtype=np.float32))
+        results = []
+        for latencies in ([0.2, 0.4], [0.3]):
+            result = load_test.SessionResult("stream", recording)
+            result.first_text = 0.1
+            result.final_latencies = latencies
+            results.append(result)
+        dropped = load_test.SessionResult("stream", recording)
+        dropped.fail(load_test.DROPPED, "closed")
+        results.append(dropped)
+
+        summary = load_test.summarise("stream", 3, results, wall=2.0)
+        self.assertEqual((summary["ok"], summary["dropped"], summary["sessions"]), (2, 1, 3))
+        self.assertAlmostEqual(summary["error_rate"], 1 / 3, places=3)
+        self.assertEqual(summary["final_latency_ms"]["p50"], 300.0)
+        self.assertEqual(summary["audio_seconds_per_second"], 1.0)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,147 @@
+import numpy as np
+from audio_buffer import PCM_SCALE
+
+class VADResult:
+    """Output of StreamingVAD.process for one chunk of input audio."""
+    def __init__(self, speech, speech_started, speech_ended):
+        # Audio to forward downstream (speech frames plus padding); empty while silent
+        self.speech = speech
+        self.speech_started = speech_started
+        self.speech_ended = speech_ended
+
+class StreamingVAD:
+    """
+    Frame-level voice activity detector for 16kHz mono audio.
+    Each frame is scored on energy above an adaptive noise floor and on spectral
+    flatness (noise is spectrally flat, voiced speech is not). Hysteresis turns frame
+    decisions into utterances: speech starts after start_ms of speech frames and ends
+    after end_ms of non-speech frames. Non-speech audio outside utterances is dropped,
+    except for pre_padding_ms of pre-roll kept so word onsets are not clipped.
+    """
+    def __init__(self, sample_rate=16000, frame_ms=30, start_ms=90, end_ms=500, pre_padding_ms=300,
+                 margin_db=10.0, min_energy_db=-50.0, flatness_threshold=0.45):
+        self.sample_rate = sample_rate
+        self.frame_samples = int(sample_rate * frame_ms / 1000)
+        self.start_frames = max(1, start_ms // frame_ms)
+        self.end_frames = max(1, end_ms // frame_ms)
+        self.pre_padding_frames = pre_padding_ms // frame_ms
+        self.margin_db = margin_db
+        self.min_energy_db = min_energy_db
+        self.flatness_threshold = flatness_threshold
+        self._window = np.hanning(self.frame_samples).astype(np.float32)
+        self.reset()
+
+    def reset(self):
+        self.in_speech = False
+        self.noise_floor_db = None
+        self._remainder = np.zeros(0, dtype=np.float32)
+        self._preroll = []
+        self._speech_run = 0
+        self._silence_run = 0
+        self.frames_total = 0
+        self.speech_frames = 0
+        self.dropped_frames = 0
+        self.utterances = 0
+
+    def stats(self):
+        """Per-connection counters, e.g. for logging when a socket closes."""
+        return {
+            "frames_total": self.frames_total,
+            "speech_frames": self.speech_frames,
+            "dropped_frames": self.dropped_frames,
+            "dropped_seconds": round(self.dropped_frames * self.frame_samples / self.sample_rate, 2),
+            "utterances": self.utterances,
+            "noise_floor_db": round(float(self.noise_floor_db), 1) if self.noise_floor_db is not None else None,
+        }
+
+    def process(self, audio):
+        """
+        Feeds a chunk of int16 PCM or float32 audio in [-1, 1] and returns a VADResult.
+        The forwarded speech keeps the input dtype, so int16 input is never converted twice.
+        """
+        if len(self._remainder) and self._remainder.dtype == audio.dtype:
+            audio = np.concatenate([self._remainder, audio])
+        n_frames = len(audio) // self.frame_samples
+        self._remainder = audio[n_frames * self.frame_samples:].copy()
+        if n_frames == 0:
+            return VADResult(np.zeros(0, dtype=audio.dtype), False, False)
+
+        frames = audio[:n_frames * self.frame_samples].reshape(n_frames, self.frame_samples)
+        energies_db, flatness = self._features(frames)
+
+        out = []
+        started = False
+        ended = False
+        for frame, energy_db, flat in zip(frames, energies_db, flatness):
+            self.frames_total += 1
+            is_speech = self._is_speech(energy_db, flat)
+            if not is_speech:
+                self._update_noise_floor(energy_db)
+
+            if self.in_speech:
+                out.append(frame)
+                self.speech_frames += 1
+                self._silence_run = 0 if is_speech else self._silence_run + 1
+                if self._silence_run >= self.end_frames:
+                    self.in_speech = False
+                    self._silence_run = 0
+                    ended = True
+            else:
+                self._preroll.append(frame)
+                self._speech_run = self._speech_run + 1 if is_speech else 0
+                if self._speech_run >= self.start_frames:
+                    # Flush the pre-roll (which contains the confirming frames) as the utterance onset
+                    out.extend(self._preroll)
+                    self.speech_frames += len(self._preroll)
+                    self._preroll = []
+                    self._speech_run = 0
+                    self.in_speech = True
+                    self.utterances += 1
+                    started = True
+                elif len(self._preroll) > self.pre_padding_frames + self.start_frames:
+                    self._preroll.pop(0)
+                    self.dropped_frames += 1
+
+        speech = np.concatenate(out) if out else np.zeros(0, dtype=audio.dtype)
+        return VADResult(speech, started, ended)
+
+    def speech_mask(self, audio):
+        """
+        Per-frame speech decisions for a whole recording (offline use, e.g. long_audio),
+        without hysteresis or padding. The noise floor adapts as in process.
+        Returns a bool array with one entry per frame; a trailing partial frame counts as one.
+        """
+        n_frames = -(-len(audio) // self.frame_samples)
+        padded = np.zeros(n_frames * self.frame_samples, dtype=audio.dtype)
+        padded[:len(audio)] = audio
+        energies_db, flatness = self._features(padded.reshape(n_frames, self.frame_samples))
+
+        mask = np.zeros(n_frames, dtype=bool)
+        for i, (energy_db, flat) in enumerate(zip(energies_db, flatness)):
+            mask[i] = self._is_speech(energy_db, flat)
+            if not mask[i]:
+                self._update_noise_floor(energy_db)
+        return mask
+
+    def _features(self, frames):
+        if frames.dtype == np.int16:
+            frames = frames * PCM_SCALE
+        energies_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+        power = np.abs(np.fft.rfft(frames * self._window, axis=1)) ** 2 + 1e-10
+        flatness = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+        return energies_db, flatness
+
+    def _is_speech(self, energy_db, flatness):
+        if energy_db < self.min_energy_db:
+            return False
+        floor = self.noise_floor_db if self.noise_floor_db is not None else self.min_energy_db
+        return energy_db > floor + self.margin_db and flatness < self.flatness_threshold
+
+    def _update_noise_floor(self, energy_db):
+        # Follow drops in the floor quickly and rises slowly, so speech tails don't drag it up
+        if self.noise_floor_db is None:
+            self.noise_floor_db = energy_db
+        elif energy_db < self.noise_floor_db:
+            self.noise_floor_db += 0.5 * (energy_db - self.noise_floor_db)
+        else:
+            self.noise_floor_db += 0.02 * (energy_db - self.noise_floor_db)
@@ -0,0 +1,322 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from multiprocessing import shared_memory
+import numpy as np
+from executor import ServerBusyError
+from job_queue import JobTimings
+from metrics import StageTimings
+
+SAMPLE_RATE = 16000
+LIVE, BATCH = "live", "batch"
+
+def build_pipeline(**options):
+    """Default worker pipeline factory (module level, so spawned workers can import it)."""
+    from pipeline import DictationPipeline
+    return DictationPipeline(**options)
+
+def _worker_main(index, slot_name, requests, responses, factory, factory_options):
+    """
+    Model worker process: builds its own pipeline, then serves requests until it gets None.
+    Audio is read in place from shared memory; only the small request and result messages are pickled.
+    Spawned workers share the server's resource tracker, so attaching here never unlinks a block.
+    Requests that ask for progress get a ("stage", ...) message as each stage starts.
+    A pipeline that fails to build is reported as ("error", ...) and the worker exits.
+    """
+    # The server knows how busy this worker is; it sends the load along with each request
+    load = [0.0]
+    try:
+        pipeline = factory(**factory_options)
+        pipeline.decode_policy.add_load_source(lambda: load[0])
+        pipeline.warmup()
+    except Exception as e:
+        responses.put(("error", index, f"{type(e).__name__}: {e}"))
+        return
+    slots = shared_memory.SharedMemory(name=slot_name)
+    responses.put(("ready", index, os.getpid()))
+
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        request_id, op, location, length, style, load[0], report_stages = message
+        # Slot offsets live in this worker's block; larger requests come in their own block
+        shm, offset = (slots, location) if isinstance(location, int) else (shared_memory.SharedMemory(name=location), 0)
+        audio = np.ndarray(length, dtype=np.float32, buffer=shm.buf, offset=offset)
+        if report_stages:
+            timings = JobTimings(lambda stage, request_id=request_id: responses.put(("stage", index, request_id, stage)))
+        else:
+            timings = StageTimings()
+        try:
+            if op == LIVE:
+                # Live requests are /stream utterances, already gated by StreamingVAD
+                result = pipeline.process_live(audio, style, timings, vad_filter=False)
+            else:
+                result = pipeline.process(audio, style, timings)
+            responses.put(("result", index, request_id, True, (result, timings.as_dict())))
+        except Exception as e:
+            responses.put(("result", index, request_id, False, f"{type(e).__name__}: {e}"))
+        finally:
+            # The array must go before its buffer can be closed
+            del audio
+            if shm is not slots:
+                shm.close()
+    slots.close()
+
+class _Worker:
+    def __init__(self, index, slot_count, slot_samples):
+        self.index = index
+        self.slot_samples = slot_samples
+        self.slots = shared_memory.SharedMemory(create=True, size=slot_count * slot_samples * 4)
+        self.free_slots = list(range(slot_count))
+        self.process = None
+        self.requests = None
+        self.ready = False
+        self.restarts = 0
+        # Why the pipeline failed to build; such a worker is not restarted
+        self.error = None
+        # request id -> (future, slot index or one-off SharedMemory, StageTimings or None, on_stage or None)
+        self.inflight = {}
+
+class WorkerPool:
+    """
+    Runs pipelines in `workers` separate processes, so the GIL-bound stages (cleaning,
+    style, tokenisation, PCM conversion) of different requests use different cores.
+    The front-end copies each utterance's float32 audio once into a slot of the chosen
+    worker's shared memory block (slots_per_worker slots of slot_seconds) and sends only
+    the slot offset; audio longer than a slot gets a one-off shared memory block.
+    Requests go to the ready worker with the fewest in flight; each worker takes at most
+    slots_per_worker at a time and ServerBusyError is raised when all are full (or, with
+    wait, the request waits for a slot, as batch jobs do). A worker that dies fails its
+    in-flight requests and is restarted.
+    factory(**factory_options) builds each worker's pipeline and must be importable by
+    the spawned workers (a module-level function).
+    """
+    def __init__(self, workers=2, slots_per_worker=4, slot_seconds=30, factory=build_pipeline, factory_options=None,
+                 health_interval=1.0):
+        self.slots_per_worker = slots_per_worker
+        self.factory = factory
+        self.factory_options = factory_options or {}
+        self.health_interval = health_interval
+        self._context = multiprocessing.get_context("spawn")
+        self._responses = self._context.Queue()
+        self._workers = [_Worker(i, slots_per_worker, int(slot_seconds * SAMPLE_RATE)) for i in range(workers)]
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._stopping = False
+        self._threads = []
+
+    def start(self, wait=True, timeout=None):
+        """
+        Spawns the workers and, with wait, blocks until every worker has loaded its pipeline.
+        Raises RuntimeError when a worker's pipeline fails to build, or TimeoutError after
+        timeout seconds; the pool is stopped first.
+        """
+        for worker in self._workers:
+            self._spawn(worker)
+        for target, name in ((self._collect, "worker-results"), (self._monitor, "worker-health")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if not wait:
+            return
+        with self._ready:
+            started = self._ready.wait_for(
+                lambda: all(w.ready for w in self._workers) or any(w.error for w in self._workers), timeout)
+            failed = [w for w in self._workers if w.error]
+        if failed:
+            self.stop()
+            raise RuntimeError(f"Model worker {failed[0].index} failed to start: {failed[0].error}")
+        if not started:
+            self.stop()
+            raise TimeoutError("Model workers did not become ready in time")
+
+    def stop(self):
+        with self._ready:
+            self._stopping = True
+            self._ready.notify_all()
+        for worker in self._workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.requests.put(None)
+        for worker in self._workers:
+            if worker.process is not None:
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+            self._fail_inflight(worker, RuntimeError("Worker pool stopped"))
+            worker.slots.close()
+            worker.slots.unlink()
+        self._responses.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, audio, style="Neutral", op=LIVE, timings=None, wait=False, on_stage=None):
+        """
+        Queues a float32 16kHz array for process_live (op="live", an utterance already gated by
+        StreamingVAD, so Whisper's VAD is skipped) or process (op="batch")
+        on the least loaded worker and returns a concurrent.futures.Future of the result.
+        The audio is copied before this returns, so the caller may reuse its buffer.
+        When every worker is full this raises ServerBusyError, or with wait blocks until a slot frees up.
+        The worker's stage timings are added to timings (and so to this process's metrics);
+        on_stage(stage) is called as each stage starts in the worker.
+        """
+        future = Future()
+        with self._ready:
+            if wait:
+                self._ready.wait_for(lambda: self._stopping or self._candidates()
+                                     or all(w.error for w in self._workers))
+            if self._stopping:
+                raise RuntimeError("Worker pool stopped")
+            if all(w.error for w in self._workers):
+                raise RuntimeError("No model worker could load its pipeline")
+            candidates = self._candidates()
+            if not candidates:
+                raise ServerBusyError(f"All {len(self._workers)} model workers are busy")
+            worker = min(candidates, key=lambda w: len(w.inflight))
+            request_id = next(self._ids)
+            load = len(worker.inflight) / self.slots_per_worker
+
+            if len(audio) <= worker.slot_samples and worker.free_slots:
+                slot = worker.free_slots.pop()
+                location = slot * worker.slot_samples * 4
+                np.ndarray(len(audio), dtype=np.float32, buffer=worker.slots.buf, offset=location)[:] = audio
+            else:
+                slot = shared_memory.SharedMemory(create=True, size=max(len(audio) * 4, 1))
+                np.ndarray(len(audio), dtype=np.float32, buffer=slot.buf)[:] = audio
+                location = slot.name
+            worker.inflight[request_id] = (future, slot, timings, on_stage)
+            worker.requests.put((request_id, op, location, len(audio), style, load, on_stage is not None))
+        return future
+
+    async def run(self, audio, style="Neutral", op=LIVE, timings=None):
+        return await asyncio.wrap_future(self.submit(audio, style, op, timings))
+
+    def process_live(self, audio_float32, style="Neutral", timings=None):
+        """Blocking DictationPipeline.process_live on a worker."""
+        return self.submit(audio_float32, style, LIVE, timings).result()
+
+    def process(self, audio_input, style_mode="Neutral", timings=None):
+        """
+        Blocking DictationPipeline.process on a worker (float32 arrays only), e.g. for JobQueue.
+        Waits for a free slot instead of failing while live traffic fills the workers, and
+        forwards stage progress to timings.on_stage when it has one (JobTimings).
+        """
+        return self.submit(audio_input, style_mode, BATCH, timings, wait=True,
+                           on_stage=getattr(timings, "on_stage", None)).result()
+
+    def stats(self):
+        with self._lock:
+            return [
+                {"pid": w.process.pid if w.process is not None else None, "ready": w.ready,
+                 "inflight": len(w.inflight), "restarts": w.restarts, "error": w.error}
+                for w in self._workers
+            ]
+
+    def _candidates(self):
+        return [w for w in self._workers if w.ready and len(w.inflight) < self.slots_per_worker]
+
+    def _spawn(self, worker):
+        worker.ready = False
+        worker.requests = self._context.Queue()
+        worker.process = self._context.Process(
+            target=_worker_main, name=f"model-worker-{worker.index}", daemon=True,
+            args=(worker.index, worker.slots.name, worker.requests, self._responses, self.factory, self.factory_options)
+        )
+        worker.process.start()
+
+    def _collect(self):
+        while True:
+            message = self._responses.get()
+            if message is None:
+                return
+            if message[0] == "ready":
+                _, index, pid = message
+                with self._ready:
+                    self._workers[index].ready = True
+                    self._ready.notify_all()
+                print(f"Model worker {index} ready (pid {pid})")
+                continue
+            if message[0] == "error":
+                _, index, error = message
+                with self._ready:
+                    self._workers[index].error = error
+                    self._ready.notify_all()
+                print(f"Model worker {index} failed to load its pipeline: {error}")
+                continue
+            if message[0] == "stage":
+                _, index, request_id, stage = message
+                with self._lock:
+                    entry = self._workers[index].inflight.get(request_id)
+                if entry is not None and entry[3] is not None:
+                    entry[3](stage)
+                continue
+
+            _, index, request_id, ok, payload = message
+            with self._ready:
+                entry = self._workers[index].inflight.pop(request_id, None)
+                if entry is not None:
+                    self._release(self._workers[index], entry[1])
+                    self._ready.notify_all()
+            if entry is None:
+                continue
+            future, _, timings, _ = entry
+            if not ok:
+                self._resolve(future, error=RuntimeError(payload))
+                continue
+            result, stage_timings = payload
+            if timings is not None:
+                for stage, ms in stage_timings.items():
+                    timings.add(stage, ms)
+            self._resolve(future, result)
+
+    def _monitor(self):
+        while True:
+            time.sleep(self.health_interval)
+            with self._lock:
+                if self._stopping:
+                    return
+                # A worker whose pipeline cannot be built would only fail again
+                dead = [w for w in self._workers
+                        if w.process is not None and not w.process.is_alive() and w.error is None]
+                for worker in dead:
+                    print(f"Model worker {worker.index} exited ({worker.process.exitcode}), restarting")
+                    worker.ready = False
+                    worker.restarts += 1
+            for worker in dead:
+                self._fail_inflight(worker, RuntimeError(f"Model worker {worker.index} exited"))
+                with self._lock:
+                    if not self._stopping:
+                        self._spawn(worker)
+
+    def _fail_inflight(self, worker, error):
+        with self._ready:
+            entries = list(worker.inflight.values())
+            worker.inflight.clear()
+            for _, slot, _, _ in entries:
+                self._release(worker, slot)
+            self._ready.notify_all()
+        for future, _, _, _ in entries:
+            self._resolve(future, error=error)
+
+    def _resolve(self, future, result=None, error=None):
+        # The caller may have cancelled (e.g. its socket closed) while the worker was busy
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def _release(self, worker, slot):
+        if isinstance(slot, int):
+            worker.free_slots.append(slot)
+        else:
+            slot.close()
+            slot.unlink()